@@ -0,0 +1,275 @@
+# alert_daemon.py
+"""
+自選股價位警示 (常駐程式)
+
+    python alert_daemon.py --token <FinMind Token> [--interval 60] [--webhook http://127.0.0.1:9000/alerts] [--out alerts.jsonl]
+    python alert_daemon.py --once --always      # 只檢查一輪，不論是否為交易時段
+
+- 自選清單保存於 watchlists.json：{"清單名稱": ["2330", "2317"], ...}
+- 價位門檻 (便宜價、合理價、昂貴價、內在價值) 直接取用資料倉儲 scores 表中最近一次的分析結果，不重新分析
+- 每輪只抓一次全市場價格快照 (data.py get_price_snapshot)，以陣列一次比對所有自選股的門檻
+- 只有股價「穿越」門檻時才發出警示 (上穿 / 跌破)，第一輪只建立基準，不發警示
+- 警示輸出：日誌、webhook (POST JSON)、檔案 (每行一筆 JSON)
+- 沒有即時報價權限時改用日收盤價：只在收盤資料的發布時段 (發布行事曆的 TaiwanStockPrice) 檢查，
+  警示在收盤資料公布後才會發出，盤中的價位穿越看不到
+- scores 表或自選清單有變動時重建門檻，並以上一輪的價格作為基準，門檻變動本身不會觸發警示
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from scheduler import RELEASE_CALENDAR, DailyWindow
+from warehouse import Warehouse, DB_PATH, taipei_now
+
+WATCHLISTS_PATH = os.environ.get('STOCK_WATCHLISTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'watchlists.json'))
+
+# 比對的門檻欄位 (scores 表) 與警示中的名稱
+BAND_COLS = {'便宜價': '便宜價', '合理價': '合理價', '昂貴價': '昂貴價', '目標價': '內在價值'}
+
+# 即時報價快照：台股交易時段 (台灣時間)
+TRADING_WINDOW = DailyWindow((9, 0), (14, 0))
+# 改用日收盤價時：收盤資料的發布時段，最短每 EOD_INTERVAL 秒檢查一次 (全市場收盤價一次請求較大)
+EOD_WINDOW = RELEASE_CALENDAR['TaiwanStockPrice'].window
+EOD_INTERVAL = 600
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+
+
+def load_watchlists(path=WATCHLISTS_PATH):
+    """讀取自選清單 {名稱: [代號, ...]}"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return {name: [str(s).strip() for s in ids] for name, ids in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def save_watchlist(name, stock_ids, path=WATCHLISTS_PATH):
+    watchlists = load_watchlists(path)
+    watchlists[name] = list(dict.fromkeys(str(s).strip() for s in stock_ids if str(s).strip()))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(watchlists, f, ensure_ascii=False, indent=2)
+    return watchlists
+
+
+class BandIndex:
+    """
+    自選股 (所有清單的聯集) 的價位門檻，levels 為 (股票, 門檻) 矩陣
+    above 記錄上一輪股價是否在各門檻之上，每輪以一次矩陣比較找出狀態改變的 (股票, 門檻)
+    """
+
+    def __init__(self, df_scores, watchlists):
+        members = {}
+        for name, ids in watchlists.items():
+            for sid in ids:
+                members.setdefault(sid, []).append(name)
+
+        df = df_scores.assign(股票代號=df_scores['股票代號'].astype(str)).set_index('股票代號')
+        df = df[df.index.isin(members)]
+        self.stock_ids = df.index.to_numpy()
+        self.names = df['股票名稱'].astype(str).to_numpy()
+        self.levels = df.reindex(columns=list(BAND_COLS)).to_numpy(dtype='float64')
+        self.members = members
+        self.missing = sorted(set(members) - set(self.stock_ids))
+
+        self.price = np.full(len(self.stock_ids), np.nan)
+        self.above = None
+
+    def __len__(self):
+        return len(self.stock_ids)
+
+    def prime(self, stock_ids, price):
+        """以既有價格建立基準 (重建門檻時沿用上一輪的價格)"""
+        pos = {sid: i for i, sid in enumerate(stock_ids)}
+        idx = np.array([pos.get(sid, -1) for sid in self.stock_ids], dtype='int64')
+        self.price = np.where(idx >= 0, np.asarray(price, dtype='float64')[idx], np.nan) if len(idx) else self.price
+        self.above = self.price[:, None] >= self.levels
+
+    def check(self, snapshot):
+        """
+        snapshot：全市場價格 (stock_id, date, close)
+        回傳這一輪穿越門檻的警示 (list of dict)
+        """
+        quotes = snapshot.drop_duplicates('stock_id', keep='last').set_index('stock_id')
+        quotes = quotes.reindex(self.stock_ids)
+        price = quotes['close'].to_numpy(dtype='float64')
+        has_price = np.isfinite(price) & (price > 0)
+
+        above = price[:, None] >= self.levels
+        if self.above is None:
+            self.above, self.price = above, np.where(has_price, price, np.nan)
+            return []
+
+        # 本輪與上一輪都有價格、且門檻有值時才判斷是否穿越
+        valid = (has_price & np.isfinite(self.price))[:, None] & np.isfinite(self.levels)
+        crossed = (above != self.above) & valid
+        rows, cols = np.nonzero(crossed)
+
+        band_names = list(BAND_COLS.values())
+        dates = quotes['date'].astype(str).to_numpy()
+        alerts = [{
+            'stock_id': self.stock_ids[i],
+            'name': self.names[i],
+            'band': band_names[j],
+            'direction': '上穿' if above[i, j] else '跌破',
+            'threshold': round(float(self.levels[i, j]), 2),
+            'prev_price': round(float(self.price[i]), 2),
+            'price': round(float(price[i]), 2),
+            'date': dates[i],
+            'watchlists': self.members.get(self.stock_ids[i], []),
+        } for i, j in zip(rows, cols)]
+
+        # 沒有報價的股票保留上一輪的狀態
+        self.above = np.where(has_price[:, None], above, self.above)
+        self.price = np.where(has_price, price, self.price)
+        return alerts
+
+
+def format_alert(a):
+    arrow = '📈' if a['direction'] == '上穿' else '📉'
+    return (f"{arrow} {a['name']} ({a['stock_id']}) {a['direction']}{a['band']} {a['threshold']}："
+            f"{a['prev_price']} → {a['price']} [{', '.join(a['watchlists'])}]")
+
+
+def log_sink(logger=log):
+    def emit(alerts):
+        for a in alerts:
+            logger(format_alert(a))
+    return emit
+
+
+def file_sink(path):
+    """每筆警示一行 JSON，附加寫入"""
+    def emit(alerts):
+        with open(path, 'a', encoding='utf-8') as f:
+            for a in alerts:
+                f.write(json.dumps({**a, 'alerted_at': taipei_now().isoformat(timespec='seconds')}, ensure_ascii=False) + "\n")
+    return emit
+
+
+def webhook_sink(url, timeout=10):
+    """同一輪的警示合併成一次 POST {"alerts": [...]}"""
+    from http_client import get_transport
+
+    def emit(alerts):
+        get_transport().post(url, json={'alerts': alerts, 'text': "\n".join(format_alert(a) for a in alerts)}, timeout=timeout)
+    return emit
+
+
+def _scores_version(warehouse, watchlists_path):
+    """scores 表與自選清單的版本，有變動時才重建門檻"""
+    with warehouse.connect(readonly=True) as con:
+        version = con.execute('SELECT COUNT(*), MAX(updated_at) FROM scores').fetchone()
+    try:
+        mtime = os.path.getmtime(watchlists_path)
+    except OSError:
+        mtime = None
+    return version, mtime
+
+
+def load_band_index(warehouse, watchlists):
+    cols = ', '.join(f'"{c}"' for c in ['股票代號', '股票名稱'] + list(BAND_COLS))
+    return BandIndex(warehouse.query(f'SELECT {cols} FROM scores'), watchlists)
+
+
+class AlertDaemon:
+    def __init__(self, data_loader, warehouse, sinks, watchlists_path=WATCHLISTS_PATH, logger=log):
+        self.data_loader = data_loader
+        self.warehouse = warehouse
+        self.sinks = sinks
+        self.watchlists_path = watchlists_path
+        self.logger = logger
+        self.index = None
+        self._version = None
+        # 價格來源是否為日收盤價 (None：尚未抓過)
+        self.end_of_day = None
+
+    def _refresh_index(self):
+        version = _scores_version(self.warehouse, self.watchlists_path)
+        if version == self._version:
+            return
+        index = load_band_index(self.warehouse, load_watchlists(self.watchlists_path))
+        if self.index is not None and self.index.above is not None:
+            index.prime(self.index.stock_ids, self.index.price)
+        self.index, self._version = index, version
+        if self.logger:
+            self.logger(f"🎯 監控 {len(index)} 檔自選股的價位門檻")
+            if index.missing:
+                self.logger(f"⚠️ 尚未分析、沒有門檻的股票：{', '.join(index.missing)}")
+
+    def tick(self):
+        """檢查一輪，回傳本輪警示"""
+        self._refresh_index()
+        if not len(self.index):
+            return []
+        snapshot = self.data_loader.get_price_snapshot(logger=self.logger)
+        if snapshot.empty:
+            if self.logger: self.logger("⚠️ 本輪沒有取得價格快照")
+            return []
+        end_of_day = bool(snapshot.attrs.get('end_of_day'))
+        if end_of_day != self.end_of_day and self.logger:
+            self.logger("⚠️ 沒有即時報價，改以日收盤價檢查：收盤資料公布後才會發出警示" if end_of_day
+                        else "📡 使用即時報價快照檢查")
+        self.end_of_day = end_of_day
+
+        alerts = self.index.check(snapshot)
+        for sink in self.sinks if alerts else []:
+            try:
+                sink(alerts)
+            except Exception as e:
+                if self.logger: self.logger(f"⚠️ 警示輸出失敗: {str(e)}")
+        return alerts
+
+    def run(self, interval=60, once=False, always=False):
+        while True:
+            started = time.monotonic()
+            now = taipei_now()
+            # 還不知道價格來源時，兩個時段都檢查
+            windows = {None: (TRADING_WINDOW, EOD_WINDOW), False: (TRADING_WINDOW,), True: (EOD_WINDOW,)}[self.end_of_day]
+            if always or any(now < w[1] for w in (window.latest(now) for window in windows) if w):
+                try:
+                    self.tick()
+                except Exception as e:
+                    if self.logger: self.logger(f"❌ 本輪檢查失敗: {str(e)}")
+            if once:
+                return
+            wait = max(interval, EOD_INTERVAL) if self.end_of_day else interval
+            time.sleep(max(wait - (time.monotonic() - started), 1))
+
+
+def main(argv=None):
+    from data import StockData
+
+    parser = argparse.ArgumentParser(description="台股基本面分析 - 自選股價位警示")
+    parser.add_argument('--db', default=DB_PATH, help="資料倉儲路徑 (SQLite)")
+    parser.add_argument('--token', default=os.environ.get('FINMIND_TOKEN', ''), help="FinMind Token")
+    parser.add_argument('--watchlists', default=WATCHLISTS_PATH, help="自選清單檔案")
+    parser.add_argument('--interval', type=int, default=60, help="檢查間隔 (秒)")
+    parser.add_argument('--webhook', help="警示以 POST JSON 送到指定網址")
+    parser.add_argument('--out', help="警示附加寫入指定檔案 (每行一筆 JSON)")
+    parser.add_argument('--once', action='store_true', help="只檢查一輪")
+    parser.add_argument('--always', action='store_true', help="非交易時段也檢查")
+    args = parser.parse_args(argv)
+
+    sinks = [log_sink()]
+    if args.webhook:
+        sinks.append(webhook_sink(args.webhook))
+    if args.out:
+        sinks.append(file_sink(args.out))
+
+    # 價格快照每輪都重新抓取，不經過發布行事曆，也不寫入資料倉儲
+    daemon = AlertDaemon(StockData(args.token), Warehouse(args.db), sinks, watchlists_path=args.watchlists)
+    daemon.run(interval=args.interval, once=args.once, always=args.always)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
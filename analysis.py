@@ -0,0 +1,110 @@
+# analysis.py
+"""
+單一股票的完整分析流程 (成長 → 獲利 → 股東報酬 → 估值)
+網頁 (app.py) 與批次模式 (batch.py) 共用
+"""
+import json
+from datetime import datetime
+
+from frame_dtypes import widen_frame
+from pipeline import Node, Pipeline
+from strategy_growth import analyze_growth_stage
+from strategy_profit import analyze_profit_stage
+from strategy_shareholder import analyze_shareholder_return
+from strategy_valuation import analyze_valuation_stage
+
+
+def _revenue(ctx):
+    df_rev = ctx['data_loader'].get_revenue(ctx['stock_id'])
+    return df_rev if df_rev.empty else df_rev[df_rev['date'] <= datetime.now()]
+
+
+def _widened(func):
+    """策略函式以原始型別 (float64 / int64) 計算，輸入的精簡型別資料表先還原"""
+    def stage(*args, logger=None):
+        return func(*[widen_frame(a) for a in args], logger=logger)
+    stage.__name__ = func.__name__
+    return stage
+
+
+def _as_dict(func):
+    """策略函式回傳非 dict (資料不足) 時視為空結果"""
+    func = _widened(func)
+    def stage(*args, logger=None):
+        res = func(*args, logger=logger)
+        return res if isinstance(res, dict) else {}
+    stage.__name__ = func.__name__
+    return stage
+
+
+# 單一股票的分析流程：資料集節點每次重新取得，策略節點依輸入內容快取
+# 成長 → 獲利 → 股東報酬 → 估值；估值只依賴股東報酬輸出中的 推估eps
+STOCK_PIPELINE = Pipeline([
+    Node('revenue', _revenue, memo=False),
+    Node('profitability', lambda ctx: ctx['data_loader'].get_profitability(ctx['stock_id']), memo=False),
+    Node('annual', lambda ctx: ctx['data_loader'].get_shareholder_return(ctx['stock_id']), memo=False),
+    Node('price', lambda ctx: ctx['data_loader'].get_latest_price(ctx['stock_id']), memo=False),
+    Node('bond', lambda ctx: ctx['data_loader'].get_us_bond_yield(), memo=False),
+    Node('pe_band', lambda ctx: ctx['data_loader'].get_pe_band(ctx['stock_id']), memo=False),
+
+    Node('growth', _as_dict(analyze_growth_stage), ['revenue'], label='成長性'),
+    Node('profit', _as_dict(analyze_profit_stage), ['profitability', 'growth'], label='獲利性'),
+    Node('shareholder', _as_dict(analyze_shareholder_return), ['annual', 'growth', 'profit'], label='股東報酬'),
+    Node('valuation', _widened(analyze_valuation_stage),
+         ['pe_band', 'price', 'bond', 'shareholder.推估eps', 'annual'], label='估值'),
+])
+
+# 資料集節點：策略實際使用的輸入，分析時交給 recorder 封存，供重現 (見 run_archive.py)
+INPUT_NODES = ('revenue', 'profitability', 'annual', 'price', 'bond', 'pe_band')
+
+
+def read_stock_map(path='stock_map.json'):
+    """讀取權值股白名單，檔案不存在或格式錯誤時回傳空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def analyze_stock(data_loader, stock_id, stock_name, industry, ui_key, results, logger=None, recorder=None):
+    """
+    抓取資料並執行四個策略階段 (STOCK_PIPELINE)，結果寫入 results (ResultSet)
+    recorder：run_archive.InputRecorder，有指定時收集輸入切片，payloads 只保存切片的參照
+    回傳 (StockResult, None)；資料不足時回傳 (None, 原因)
+    """
+    ctx = {'data_loader': data_loader, 'stock_id': stock_id}
+    df_rev = STOCK_PIPELINE.run(ctx, targets=['revenue'])['revenue']
+    if df_rev.empty:
+        return None, f"⚠️  {stock_id}該股營收數據不足。"
+
+    if logger: logger(f"📈 執行分析流程：成長性 → 獲利性 → 報酬能力 → 估值...")
+    run = STOCK_PIPELINE.run(ctx, logger=logger, seed={'revenue': df_rev})
+
+    reused = [STOCK_PIPELINE.nodes[n].label for n in ('growth', 'profit', 'shareholder', 'valuation') if n in run.cached]
+    if reused and logger:
+        logger(f"♻️ 輸入資料未變動，沿用快取結果：{'、'.join(reused)}")
+
+    df_profit, df_annual = run['profitability'], run['annual']
+    res_growth, res_profit, res_sh, res_val = run['growth'], run['profit'], run['shareholder'], run['valuation']
+
+    info = {
+        '股票代號': stock_id,
+        '股票名稱': stock_name,
+        '產業別': industry,
+        'ui_key': ui_key,
+    }
+    record = results.append(info, growth=res_growth, profit=res_profit, shareholder=res_sh, valuation=res_val)
+    put_payloads(results, stock_id, df_rev, df_profit, df_annual)
+    if recorder is not None:
+        results.payloads.put('inputs', stock_id, recorder.record({name: (run.hashes[name], run[name]) for name in INPUT_NODES}))
+    return record, None
+
+
+def put_payloads(results, stock_id, df_rev, df_profit, df_annual):
+    """原始序列只保留報表需要的欄位，存放於結果表之外"""
+    results.payloads.put('revenue', stock_id, df_rev[['date', 'revenue', 'Mon_YoY', 'Cum_YoY']].copy())
+    results.payloads.put('margin', stock_id, df_profit[['date', 'GPM', 'OPM']].copy())
+    results.payloads.put('annual', stock_id, df_annual[['year', 'ROE', 'EPS', 'q_count', 'is_projected']].copy())
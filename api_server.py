@@ -0,0 +1,323 @@
+# api_server.py
+"""
+分析結果的 HTTP/JSON 服務 (asyncio + aiohttp)，與 Streamlit 頁面並行，供其他工具程式化呼叫
+
+    python api_server.py --port 8000 [--token <FinMind Token>] [--db stock_cache.db]
+
+端點：
+    GET  /api/health
+    GET  /api/stocks/{stock_id}           單檔摘要 (綜合評分、目標價…)，必要時即時分析
+    GET  /api/stocks/{stock_id}/detail    單檔完整結果 + 營收/利潤率/年度序列
+    POST /api/analyze                     批次分析 {"stocks": ["2330", "2317"], "refresh": false}
+    GET  /api/leaderboard?limit=50&mode=industry
+    ?refresh=1 強制重新分析
+
+- 結果依序從 記憶體快取 → 資料倉儲 scores 表 (批次模式或其他程序的快照) 取得，超過 API_CACHE_TTL 才重新分析
+- 回應以內容雜湊作為 ETag，帶 If-None-Match 且未變動時回 304
+- 同一檔股票同時有多個請求時只分析一次，其餘請求等待同一個結果
+- 分析本身 (StockData + analyze_stock) 在執行緒池中執行，不阻塞事件迴圈
+- 測試時可用 FINMIND_API_URL 指向本機的 FinMind 替身服務 (見 data.py)
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from warehouse import Warehouse, DB_PATH, taipei_now
+
+API_CACHE_TTL = timedelta(seconds=int(os.environ.get('API_CACHE_TTL', 6 * 3600)))
+API_WORKERS = int(os.environ.get('API_WORKERS', 8))
+API_MAX_BATCH = 200
+
+SUMMARY_COLS = ['股票代號', '股票名稱', '產業別', 'MasterScore', '最終總評', '目前股價',
+                '便宜價', '合理價', '昂貴價', '目標價', '價值評估', '推估eps']
+
+
+def _clean(obj):
+    """NaN / numpy 型別轉成 JSON 可接受的值"""
+    if isinstance(obj, dict):
+        return {k: _clean(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_clean(v) for v in obj]
+    if hasattr(obj, 'item'):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return obj
+
+
+class Body:
+    """編碼好的 JSON 回應與其 ETag，快取命中時直接回傳，不重新序列化"""
+    __slots__ = ('data', 'etag')
+
+    def __init__(self, payload):
+        self.data = json.dumps(_clean(payload), ensure_ascii=False).encode('utf-8')
+        self.etag = '"' + hashlib.sha1(self.data).hexdigest()[:20] + '"'
+
+
+class Snapshot:
+    """一檔股票的分析結果 (摘要與完整結果各自編碼)"""
+
+    def __init__(self, record, fetched_at, source, series=None):
+        self.record = record
+        self.fetched_at = fetched_at
+        self.source = source
+        self.summary = Body({**{k: record.get(k) for k in SUMMARY_COLS},
+                             'updated_at': fetched_at.isoformat(timespec='seconds'), 'source': source})
+        self.detail = Body({'record': record, 'series': series or {},
+                            'updated_at': fetched_at.isoformat(timespec='seconds'), 'source': source}) if series is not None else None
+
+
+def _series(results, stock_id):
+    out = {}
+    for kind in ('revenue', 'margin', 'annual'):
+        df = results.payloads.get(kind, stock_id)
+        if df is not None:
+            out[kind] = df.to_dict(orient='list')
+    return out
+
+
+class AnalysisService:
+    """
+    記憶體快取 + 資料倉儲快照 + 同檔請求合併
+    所有方法都在事件迴圈中呼叫；阻塞的分析與 SQLite 讀寫交給執行緒池
+    """
+
+    def __init__(self, token="", warehouse=None, scheduled=True, ttl=API_CACHE_TTL, workers=API_WORKERS):
+        from data import StockData
+        from scheduler import RefreshScheduler
+
+        self.warehouse = warehouse or Warehouse()
+        self.data_loader = StockData(token, warehouse=self.warehouse,
+                                     scheduler=RefreshScheduler(self.warehouse) if scheduled else None)
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self.snapshots = {}
+        self.inflight = {}
+        self.stats = {'requests': 0, 'memory': 0, 'warehouse': 0, 'analyzed': 0, 'coalesced': 0, 'not_modified': 0}
+        self._board = {}
+
+    def _fresh(self, snap, need_detail):
+        return snap is not None and taipei_now() - snap.fetched_at < self.ttl and (not need_detail or snap.detail)
+
+    def _load_snapshot(self, stock_id):
+        """資料倉儲 scores 表中的結果 (例如批次模式寫入的)"""
+        try:
+            df = self.warehouse.query('SELECT * FROM scores WHERE "股票代號" = ?', (stock_id,))
+        except Exception:
+            return None
+        if df.empty:
+            return None
+        row = df.iloc[0].to_dict()
+        fetched = datetime.fromisoformat(row.pop('updated_at'))
+        row['股票'] = f"{row.get('股票名稱')} ({stock_id})"
+        return Snapshot(_clean(row), fetched, 'warehouse')
+
+    def _analyze_blocking(self, stock_id):
+        """在工作執行緒中分析一檔股票並寫入資料倉儲"""
+        from analysis import analyze_stock, read_stock_map
+        from result_store import ResultSet
+
+        listed = read_stock_map().get(stock_id)
+        if listed and not listed.get("recommend", True):
+            raise ValueError(f"{stock_id} 屬於【{listed.get('industry')}】，不適用本模型。({listed.get('note', '')})")
+
+        info = self.data_loader.get_stock_info(stock_id)
+        results = ResultSet(capacity=1)
+        record, err_msg = analyze_stock(
+            self.data_loader, stock_id, info.get("name", stock_id), info.get("industry", "未知產業"),
+            f"{stock_id}_{int(time.time())}_api", results
+        )
+        if record is None:
+            raise ValueError(err_msg.strip(" ⚠️"))
+        self.warehouse.save_scores(results)
+        return Snapshot(record.to_dict(), taipei_now(), 'analysis', series=_series(results, stock_id))
+
+    async def get(self, stock_id, refresh=False, detail=False):
+        """取得一檔股票的 Snapshot；同一檔同時只會有一個分析在執行"""
+        snap = self.snapshots.get(stock_id)
+        if not refresh and self._fresh(snap, detail):
+            self.stats['memory'] += 1
+            return snap
+
+        loop = asyncio.get_running_loop()
+        if not refresh and not detail:
+            snap = await loop.run_in_executor(self.executor, self._load_snapshot, stock_id)
+            if self._fresh(snap, False):
+                self.stats['warehouse'] += 1
+                self.snapshots.setdefault(stock_id, snap)
+                return snap
+
+        task = self.inflight.get(stock_id)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(loop.run_in_executor(self.executor, self._analyze_blocking, stock_id))
+        self.inflight[stock_id] = task
+        try:
+            snap = await asyncio.shield(task)
+            self.snapshots[stock_id] = snap
+            self.stats['analyzed'] += 1
+            return snap
+        finally:
+            if self.inflight.get(stock_id) is task:
+                del self.inflight[stock_id]
+
+    def _leaderboard_blocking(self, limit, mode):
+        """以資料倉儲 scores 表 (所有分析過的股票) 組出排行榜；scores 未變動時沿用上次的回應"""
+        from leaderboard import leaderboard_frame
+
+        with self.warehouse.connect(readonly=True) as con:
+            version = con.execute('SELECT COUNT(*), MAX(updated_at) FROM scores').fetchone()
+        key = (version, limit, mode)
+        if key in self._board:
+            return self._board[key]
+
+        df = self.warehouse.query('SELECT * FROM scores')
+        ranks = None
+        if mode == 'industry':
+            from analysis import read_stock_map
+            from ranking import compute_industry_ranks
+            ranks = compute_industry_ranks(df, stock_map=read_stock_map())
+        board = leaderboard_frame(df, ranks=ranks)
+        board = board.sort_values('綜合評分', ascending=False, na_position='last').head(limit)
+        body = Body({'count': int(len(df)), 'mode': mode, 'rows': board.to_dict(orient='records')})
+        self._board = {key: body}
+        return body
+
+    async def leaderboard(self, limit=50, mode='absolute'):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._leaderboard_blocking, limit, mode)
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+
+def _respond(request, body, status=200):
+    """依 If-None-Match 回 304 或完整內容"""
+    service = request.app['service']
+    headers = {'ETag': body.etag, 'Cache-Control': 'no-cache'}
+    if body.etag in [t.strip() for t in request.headers.get('If-None-Match', '').split(',')]:
+        service.stats['not_modified'] += 1
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body.data, status=status, content_type='application/json', charset='utf-8', headers=headers)
+
+
+def _error(status, msg):
+    return web.json_response({'error': msg}, status=status, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+
+def _flag(request, name):
+    return request.query.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+@web.middleware
+async def count_requests(request, handler):
+    request.app['service'].stats['requests'] += 1
+    return await handler(request)
+
+
+async def health(request):
+    service = request.app['service']
+    return web.json_response({
+        'status': 'ok', 'cached': len(service.snapshots), 'inflight': len(service.inflight),
+        'stats': service.stats, 'fetch_stats': service.data_loader.fetch_stats,
+        'mem_cache': service.data_loader.mem_cache.stats(),
+    })
+
+
+async def stock_summary(request):
+    try:
+        snap = await request.app['service'].get(request.match_info['stock_id'], refresh=_flag(request, 'refresh'))
+    except ValueError as e:
+        return _error(404, str(e))
+    except Exception as e:
+        return _error(502, f"分析失敗: {e}")
+    return _respond(request, snap.summary)
+
+
+async def stock_detail(request):
+    try:
+        snap = await request.app['service'].get(request.match_info['stock_id'], refresh=_flag(request, 'refresh'), detail=True)
+    except ValueError as e:
+        return _error(404, str(e))
+    except Exception as e:
+        return _error(502, f"分析失敗: {e}")
+    return _respond(request, snap.detail)
+
+
+async def analyze_batch(request):
+    """批次分析：各股票同時進行 (受執行緒池大小限制)，個別失敗不影響其他股票"""
+    try:
+        payload = await request.json()
+    except Exception:
+        return _error(400, "請求內容需為 JSON")
+    stocks = list(dict.fromkeys(str(s).strip() for s in payload.get('stocks', []) if str(s).strip()))
+    if not stocks:
+        return _error(400, "stocks 不可為空")
+    if len(stocks) > API_MAX_BATCH:
+        return _error(400, f"一次最多 {API_MAX_BATCH} 檔")
+
+    service = request.app['service']
+    refresh = bool(payload.get('refresh', False))
+    outcomes = await asyncio.gather(*(service.get(s, refresh=refresh) for s in stocks), return_exceptions=True)
+
+    results, errors = [], {}
+    for stock_id, out in zip(stocks, outcomes):
+        if isinstance(out, Exception):
+            errors[stock_id] = str(out)
+        else:
+            results.append(json.loads(out.summary.data))
+    return _respond(request, Body({'results': results, 'errors': errors}))
+
+
+async def leaderboard(request):
+    try:
+        limit = max(1, min(int(request.query.get('limit', 50)), 5000))
+    except ValueError:
+        return _error(400, "limit 需為整數")
+    mode = 'industry' if request.query.get('mode') == 'industry' else 'absolute'
+    body = await request.app['service'].leaderboard(limit, mode)
+    return _respond(request, body)
+
+
+async def _shutdown(app):
+    app['service'].executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(service):
+    app = web.Application(middlewares=[count_requests])
+    app['service'] = service
+    app.router.add_get('/api/health', health)
+    app.router.add_get('/api/stocks/{stock_id}', stock_summary)
+    app.router.add_get('/api/stocks/{stock_id}/detail', stock_detail)
+    app.router.add_post('/api/analyze', analyze_batch)
+    app.router.add_get('/api/leaderboard', leaderboard)
+    app.on_cleanup.append(_shutdown)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股基本面分析 - HTTP/JSON 服務")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--db', default=DB_PATH, help="資料倉儲路徑 (SQLite)")
+    parser.add_argument('--token', default=os.environ.get('FINMIND_TOKEN', ''), help="FinMind Token")
+    parser.add_argument('--force', action='store_true', help="忽略發布行事曆，每次分析都重新抓取")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(args.token, warehouse=Warehouse(args.db), scheduled=not args.force)
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
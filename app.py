@@ -1,14 +1,11 @@
 import streamlit as st
-import pandas as pd
+import os
 import time
-import requests
 import json 
 from datetime import datetime
-from data import StockData
-from strategy_growth import analyze_growth_stage
-from strategy_profit import analyze_profit_stage 
-from strategy_shareholder import analyze_shareholder_return
-from strategy_valuation import analyze_valuation_stage
+
+# pandas / requests / xlsxwriter 等重量級模組延後到真正需要的路徑才載入，
+# 讓首次開啟頁面與每次 rerun 不必付出匯入成本
 
 st.set_page_config(
     page_title="台股基本面戰情室",
@@ -34,7 +31,7 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
+@st.cache_resource(show_spinner=False)
 def load_stock_map():
     try:
         with open('stock_map.json', 'r', encoding='utf-8') as f:
@@ -46,6 +43,238 @@ def load_stock_map():
 
 stock_map = load_stock_map()
 
+@st.cache_resource(show_spinner=False)
+def get_warehouse():
+    """本機資料倉儲 (原始資料快取 + 分析結果)，整個程序共用"""
+    from warehouse import Warehouse
+    return Warehouse()
+
+@st.cache_resource(show_spinner=False)
+def get_data_client(token, scheduled=True):
+    """資料客戶端 (含證券主檔) 依 token 在整個程序中只建立一次"""
+    from data import StockData
+    from scheduler import RefreshScheduler
+    warehouse = get_warehouse()
+    # scheduled：依發布行事曆判斷是否需要重新抓取，未到更新時間的資料讀取本機快取
+    return StockData(token, warehouse=warehouse, scheduler=RefreshScheduler(warehouse) if scheduled else None)
+
+@st.cache_resource(show_spinner=False)
+def get_news_store():
+    """本機新聞庫 (增量匯入、去重與全文檢索)"""
+    from news_store import NewsStore
+    return NewsStore(get_warehouse())
+
+def load_stock_news(token, stock_id):
+    """只匯入上次之後的新新聞 (一小時內檢查過則不呼叫 API)，再從本機新聞庫讀取最近 10 則"""
+    store = get_news_store()
+    store.ingest(get_data_client(token), stock_id)
+    return store.latest(stock_id, limit=10)
+
+def render_news(news_df, show_stock=False):
+    for idx, row in news_df.iterrows():
+        with st.container(border=True):
+            c_date, c_content = st.columns([1, 4])
+
+            date_str = row['date'].strftime('%Y-%m-%d') if row['date'] == row['date'] else "未知日期"
+            stock_tag = f"{row['stock_id']} | " if show_stock else ""
+            c_date.caption(f"{stock_tag}{date_str} | {row.get('source', '')}")
+
+            title = row.get('title', '無標題')
+            link = row.get('link', '#')
+            c_content.markdown(f"**[{title}]({link})**")
+
+            if row.get('description'):
+                desc = str(row['description'])[:100] + "..."
+                c_content.caption(desc)
+
+def render_scenarios(results, stock_id):
+    """估值情境分析：個股兩張敏感度熱度圖 + 全市場低估比例 (見 scenario.py)"""
+    import pandas as pd
+    from scenario import (DEFAULT_ROE_CAP, ROE_CAP_GRID, heatmap, scenario_inputs,
+                          stock_scenarios, universe_scenarios, universe_slice)
+
+    df_now = results.frame()
+    inputs = scenario_inputs(df_now)
+    i = list(inputs['stock_id']).index(stock_id)
+    df_band, df_iv = stock_scenarios(inputs, i)
+
+    st.caption("黑點為目前模型假設；顏色為估計價相對目前股價的潛在空間")
+    c_band, c_iv = st.columns(2)
+    with c_band:
+        st.altair_chart(heatmap(
+            df_band, '明年成長率', 'OPM調整係數', '合理價潛在空間', title="合理價：明年成長率 × OPM 調整係數",
+            marker={'明年成長率': inputs['growth'][i], 'OPM調整係數': inputs['opm_factor'][i]}
+        ), width="stretch")
+    with c_iv:
+        st.altair_chart(heatmap(
+            df_iv, '美債殖利率', 'ROE上限', '內在價值潛在空間', title="內在價值：美債殖利率 × ROE 上限",
+            marker={'美債殖利率': inputs['bond'][i], 'ROE上限': DEFAULT_ROE_CAP}
+        ), width="stretch")
+
+    # 全市場：資料倉儲中所有分析過的股票，本次結果優先
+    try:
+        df_all = get_warehouse().query('SELECT * FROM scores')
+        df_all = pd.concat([df_now, df_all[~df_all['股票代號'].isin(df_now['股票代號'])]], ignore_index=True)
+    except Exception:
+        df_all = df_now
+    roe_cap = st.select_slider("ROE 上限", options=list(ROE_CAP_GRID), value=min(ROE_CAP_GRID, key=lambda r: abs(r - DEFAULT_ROE_CAP)),
+                               format_func=lambda r: f"{r:.0%}", key="scenario_roe_cap")
+    start = time.perf_counter()
+    grid = universe_scenarios(scenario_inputs(df_all))
+    st.altair_chart(heatmap(
+        universe_slice(grid, roe_cap), '美債殖利率', '明年成長率', '雙重低估比例',
+        title=f"全市場 {grid['stocks']} 檔：股價低於便宜價且低於內在價值的比例 (各股成長率一律改為此值)"
+    ), width="stretch")
+    st.caption(f"50 × 50 × 20 情境網格計算耗時 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def render_monte_carlo(results, stock_id, board_key):
+    """目標價機率分布：依各股票歷史波動抽樣 (見 monte_carlo.py)，結果依分析結果版本保存"""
+    import pandas as pd
+    from monte_carlo import MC_PATHS, mc_inputs, sample_paths, simulate
+
+    inputs = mc_inputs(results.frame())
+    if st.button(f"🎲 執行模擬 (每檔 {MC_PATHS:,} 條路徑)", key="mc_run"):
+        start = time.perf_counter()
+        st.session_state['mc_result'] = simulate(inputs)
+        st.session_state['mc_key'] = board_key
+        add_log(f"🎲 蒙地卡羅模擬 {len(inputs['price'])} 檔 × {MC_PATHS:,} 條路徑，耗時 {time.perf_counter() - start:.2f}s")
+    if st.session_state.get('mc_key') != board_key:
+        st.caption("以近六月營收年增標準差與近 8 季營業利益率標準差抽樣明年成長率與利潤率，估算目標價的分布")
+        return
+
+    mc = st.session_state['mc_result']
+    row = mc.loc[stock_id]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("低於便宜價機率", f"{row['低於便宜價機率']:.1%}")
+    c2.metric("低於內在價值機率", f"{row['低於內在價值機率']:.1%}")
+    c3.metric("雙重低估機率", f"{row['雙重低估機率']:.1%}")
+
+    import altair as alt
+    i = list(inputs['stock_id']).index(stock_id)
+    paths = sample_paths(inputs, i, seed=0).melt(var_name='價格', value_name='目標價')
+    chart = alt.Chart(paths).mark_bar(opacity=0.5, binSpacing=0).encode(
+        x=alt.X('目標價:Q', bin=alt.Bin(maxbins=80)),
+        y=alt.Y('count():Q', stack=None, title='路徑數'),
+        color='價格:N',
+    )
+    rule = alt.Chart(pd.DataFrame({'目前股價': [inputs['price'][i]]})).mark_rule(color='black', strokeDash=[4, 4]).encode(x='目前股價:Q')
+    st.altair_chart(chart + rule, width="stretch")
+    st.dataframe(mc, width="stretch")
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=64)
+def load_river(token, stock_id, years, budget):
+    """歷史股價與本益比/淨值比，下採樣後的河流圖資料 (見 charts.py)；快取的是下採樣後的小表格"""
+    from charts import river_frame
+    client = get_data_client(token)
+    return river_frame(client.get_price_history(stock_id, years=years), client.get_valuation_history(stock_id, years=years), budget=budget)
+
+def render_river(results, stock_id, token):
+    """本益比 / 淨值比河流圖，可同時比較多檔股票"""
+    from charts import PB_LEVELS, PE_LEVELS, POINT_BUDGET, river_chart
+
+    r1, r2, r3 = st.columns([4, 2, 2])
+    with r1:
+        picked = st.multiselect("股票", results.stock_ids, default=[stock_id], max_selections=4, key="river_stocks")
+    with r2:
+        years = st.segmented_control("期間", [5, 10, 20], default=5, format_func=lambda y: f"{y} 年", key="river_years") or 5
+    with r3:
+        budget = st.select_slider("每檔點數", [300, POINT_BUDGET, 1200], value=POINT_BUDGET, key="river_budget")
+
+    for sid in picked:
+        with st.spinner(f"📡 載入 {sid} 歷史資料..."):
+            df, multiples, raw_points = load_river(token, sid, years, budget)
+        if df.empty:
+            st.info(f"📭 {sid} 查無歷史股價或本益比資料。")
+            continue
+        name = results.record(sid).get('股票名稱', sid)
+        c_pe, c_pb = st.columns(2)
+        with c_pe:
+            st.altair_chart(river_chart(df, PE_LEVELS, f"{name} ({sid}) 本益比河流", multiples), width="stretch")
+        if all(c in df.columns for c in PB_LEVELS):
+            with c_pb:
+                st.altair_chart(river_chart(df, PB_LEVELS, f"{name} ({sid}) 淨值比河流", multiples), width="stretch")
+        st.caption(f"{sid}：{raw_points:,} 個交易日下採樣為 {len(df):,} 點 (LTTB)；倍數為期間內排除虧損、95% 縮尾後的平均 ± 1 倍標準差")
+
+def render_run_diff(results):
+    """最新結果與前一次分析的比較 (見 run_history.py)"""
+    from run_history import diff_latest, movers
+
+    scope = st.radio("比較範圍", ["本次分析的股票", "所有分析過的股票"], horizontal=True, key="diff_scope")
+    try:
+        diff = diff_latest(get_warehouse(), results.stock_ids if scope == "本次分析的股票" else None)
+    except Exception as e:
+        st.error(f"❌ 讀取歷史結果失敗: {str(e)}")
+        return
+    compared = diff[~diff['首次']]
+    if compared.empty:
+        st.info("📭 這些股票還沒有前一次的分析結果，下次分析後即可比較。")
+        return
+
+    report = movers(compared)
+    st.caption(f"{len(compared)} 檔有前次結果 (另有 {int(diff['首次'].sum())} 檔為首次分析)；前次 = 資料倉儲中早於最新結果的最後一次分析")
+    tabs = st.tabs([f"📈 分數上升 ({len(report['上升'])})", f"📉 分數下降 ({len(report['下降'])})",
+                    f"🔀 總評改變 ({len(report['總評改變'])})", f"🎯 價位穿越 ({len(report['價位穿越'])})"])
+    for tab, key in zip(tabs, ['上升', '下降', '總評改變', '價位穿越']):
+        with tab:
+            if report[key].empty:
+                st.caption("沒有變化")
+            else:
+                st.dataframe(report[key], hide_index=True, width="stretch")
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_peer_model(version):
+    """全市場月營收 YoY 的相關矩陣與動能群組 (見 peers.py)；version 為資料倉儲月營收的更新版本，有新資料才重算"""
+    from peers import build_peer_model, load_revenue_panel
+    return build_peer_model(load_revenue_panel(get_warehouse()))
+
+def render_peers(results, stock_id):
+    """個股的營收動能同儕：相關係數最高的股票與其評分並列"""
+    import pandas as pd
+    from peers import PEER_COUNT, closest_peers, cohort_of
+
+    try:
+        version = get_warehouse().query(
+            "SELECT COUNT(*) AS n, MAX(fetched_at) AS t FROM fetch_log WHERE dataset = 'TaiwanStockMonthRevenue'"
+        ).iloc[0]
+        with st.spinner("🧮 計算營收動能相關矩陣..."):
+            model = load_peer_model((int(version['n']), version['t']))
+    except Exception as e:
+        st.error(f"❌ 同儕分析失敗: {str(e)}")
+        return
+
+    peers = closest_peers(model, stock_id, k=PEER_COUNT)
+    if peers.empty:
+        st.info("📭 月營收資料不足，無法計算同儕。")
+        return
+
+    # 評分：本次結果優先，其餘取資料倉儲中最近一次的分析結果
+    cols = ['股票代號', '股票名稱', '產業別', 'MasterScore', '成長總分', 'total_score', '股東報酬與獲利分', '近三月平均YoY', '目前股價', '合理價']
+    ids = [stock_id] + peers['股票代號'].tolist()
+    df_now = results.frame(cols)
+    df_now = df_now[df_now['股票代號'].isin(ids)]
+    try:
+        col_sql = ', '.join(f'"{c}"' for c in cols)
+        marks = ', '.join('?' * len(ids))
+        stored = get_warehouse().query(f'SELECT {col_sql} FROM scores WHERE "股票代號" IN ({marks})', tuple(ids))
+        df_scores = pd.concat([df_now.astype({'產業別': object}), stored[~stored['股票代號'].isin(df_now['股票代號'])]], ignore_index=True)
+    except Exception:
+        df_scores = df_now
+
+    me = pd.DataFrame({'股票代號': [stock_id], '相關係數': [1.0], '動能群組': [cohort_of(model, stock_id)]})
+    table = pd.concat([me, peers], ignore_index=True).merge(df_scores, on='股票代號', how='left')
+    table = table.rename(columns={'total_score': '獲利分', '股東報酬與獲利分': '報酬分'}).set_index('股票代號')
+
+    st.caption(f"{stock_id} 屬於【{cohort_of(model, stock_id)}】；相關矩陣涵蓋 {len(model['stock_ids'])} 檔 × {len(model['months'])} 個月的月營收年增率 (未分析過的同儕沒有評分)")
+    st.dataframe(table, width="stretch", column_config={
+        "相關係數": st.column_config.ProgressColumn(format="%.2f", min_value=-1, max_value=1),
+        "近三月平均YoY": st.column_config.NumberColumn(format="percent"),
+    })
+    with st.expander("📊 動能群組一覽"):
+        st.dataframe(model['cohorts'], width="stretch", hide_index=True, column_config={
+            "近3月平均YoY": st.column_config.NumberColumn(format="percent"),
+            "近12月平均YoY": st.column_config.NumberColumn(format="percent"),
+        })
+
 @st.dialog("⚠️ 股票篩選警示")
 def show_alert_dialog(stock_id, msg, is_fatal=False):
     st.write(f"**偵測到股票代號：{stock_id}**")
@@ -91,6 +320,8 @@ def show_strategy_guide():
 def call_gemini_api(stock_res, api_key):
     if not api_key:
         return "⚠️ 請先在側邊欄輸入 Gemini AI Token。"
+
+    from http_client import get_transport
         
     url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={api_key}"
     
@@ -176,7 +407,8 @@ def call_gemini_api(stock_res, api_key):
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=60)
+        # 與 FinMind 共用連線池，連續產生報告時不必重新建立 TLS 連線
+        response = get_transport().post(url, json=payload, timeout=60)
         if response.status_code == 200:
             return response.json().get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', "AI 無回應")
         else:
@@ -201,6 +433,94 @@ def render_kpi_card(title, value, delta=None, prefix="", suffix=""):
     st.metric(label=title, value=f"{prefix}{value}{suffix}", delta=delta)
 
 
+# 價位卡配色：(背景, 邊框, 文字, 圖示)
+PRICE_CARD_THEMES = {
+    "便宜價": ("#F0FDF4", "#BBF7D0", "#166534", "💎"),
+    "合理價": ("#FFF7ED", "#FED7AA", "#9A3412", "⚖️"),
+    "昂貴價": ("#FEF2F2", "#FECACA", "#991B1B", "⚠️"),
+}
+
+
+def get_price_card_html(title, price, diff, theme):
+    """估值頁的價位卡 (便宜/合理/昂貴價)"""
+    bg, border, text, icon = theme
+    diff_sign = "+" if diff > 0 else ""
+    
+    return f"""
+    <div style="
+        background-color: {bg};
+        border: 1px solid {border};
+        border-radius: 12px;
+        padding: 20px;
+        text-align: center;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+        height: 100%;
+    ">
+        <div style="color: {text}; font-weight: bold; font-size: 1.1em; margin-bottom: 8px;">
+            {icon} {title}
+        </div>
+        <div style="color: #1f2937; font-size: 2em; font-weight: 800; margin: 0;">
+            ${price}
+        </div>
+        <div style="margin-top: 8px; font-size: 0.9em; color: #4b5563;">
+            距目前價：<span style="color: {text}; font-weight: 600;">{diff_sign}{diff}%</span>
+        </div>
+    </div>
+    """
+
+
+def build_detail_view(res):
+    """個股診斷頁的衍生數值：綜合評分徽章、KPI 卡片數值、價位卡 HTML"""
+    avg_score = int((res.get('MasterScore', 0)))
+    score_color = "green" if avg_score >= 80 else "orange"
+    score_html = f"""
+        <div style="border: 2px solid {score_color}; border-radius: 10px; padding: 10px; text-align: center;">
+            <h1 style="margin:0; color:{score_color};">{avg_score} 分</h1>
+            <small>綜合評分</small>
+        </div>
+    """
+
+    kpis = [
+        ("單月營收年增", round(res.get('最新單月營收年增') * 100, 2), f"{res.get('營收年增成長')} %", "%"),
+        ("GPM (季度)", round(res.get('latest_gpm') * 100, 2), f"{res.get('gpm_growth')} %", "%"),
+        ("OPM (季度)", round(res.get('latest_opm') * 100, 2), f"{res.get('opm_growth')} %", "%"),
+        ("ROE (年度)", round(res.get('最新ROE') * 100, 2), f"{res.get('ROE成長')} %", "%"),
+        ("EPS (年度)", round(res.get('最新EPS'), 2), f"{res.get('EPS成長')} %", ""),
+    ]
+
+    curr_p = res.get('目前股價', 0)
+    cards = []
+    for title, theme in PRICE_CARD_THEMES.items():
+        price = res.get(title, 0)
+        diff = round(((curr_p - price) / price) * 100, 1) if price > 0 else 0
+        cards.append(get_price_card_html(title, price, diff, theme))
+
+    return {'score_html': score_html, 'kpis': kpis, 'cards': cards}
+
+
+def get_detail_view(results, stock_id, board_key):
+    """單檔紀錄與 build_detail_view 的結果，依 (結果表版本, 代號) 快取；結果表更新時整批作廢"""
+    if st.session_state.get('detail_view_key') != board_key:
+        st.session_state['detail_views'] = {}
+        st.session_state['detail_view_key'] = board_key
+    cache = st.session_state['detail_views']
+    if stock_id not in cache:
+        res = results.record(stock_id)
+        cache[stock_id] = (res, build_detail_view(res) if res else None)
+    return cache[stock_id]
+
+
+def get_stock_labels(results, board_key):
+    """個股下拉選單的標籤 (代號 + 名稱)，依結果表版本快取"""
+    if st.session_state.get('stock_labels_key') != board_key:
+        df = results.frame(['股票代號', '股票名稱'])
+        st.session_state['stock_labels'] = {
+            sid: f"{sid} ({name})" for sid, name in zip(df['股票代號'].astype(str), df['股票名稱'])
+        }
+        st.session_state['stock_labels_key'] = board_key
+    return st.session_state['stock_labels']
+
+
 with st.sidebar:
     st.title("🎛️ 戰情室控制台")
     
@@ -209,17 +529,28 @@ with st.sidebar:
         gemini_token = st.text_input("Gemini AI Token", type="password", help="請輸入 Google Gemini API Key 以啟用 AI 分析")
 
     st.divider()
-    stock_input = st.text_area("輸入股票代號 (用逗號隔開)", value="2317")
+    if 'stock_input' not in st.session_state:
+        st.session_state['stock_input'] = "2317"
+    stock_input = st.text_area("輸入股票代號 (用逗號隔開)", key="stock_input")
 
     st.divider()
 
     start_btn = st.button("🚀 開始分析", width='stretch')
+    use_schedule = st.checkbox("依發布行事曆使用快取", value=True, help="月營收、季報等資料未到發布時間時直接使用本機快取；取消勾選則全部重新抓取")
+    # 網址加上 ?profile=1 時預設開啟
+    profile_run = st.toggle("🩺 效能剖析", value=st.query_params.get('profile') in ('1', 'true'),
+                            help="以取樣式剖析器記錄這次分析的耗時分佈，完成後可在系統日誌下載火焰圖與呼叫樹")
+
+    score_mode = st.radio(
+        "評分模式", ["絕對門檻", "產業相對排名"], horizontal=True,
+        help="產業相對排名：營收動能、營益率、ROE、EPS 成長與本益比折價，以同產業的百分位數 (PR) 加權評分"
+    )
 
     with st.popover("ℹ️ 使用說明"):
         st.write("1. 適合的產業為「獲利與營收高度正相關」")
         st.write("如電子代工與零組件、半導體產業、軟體與 SaaS 服務")
         st.write("2. 不適用：景氣循環股、金融、營建")
-        st.write("⚠️ 注意：單次分析限制最多 5 檔股票。")
+        st.write("3. 排行榜支援分頁、排序與篩選，可一次分析大量股票。")
 
     st.divider()
     st.write("🎵 **戰情室 BGM**")
@@ -232,170 +563,307 @@ with st.sidebar:
     # 下拉選單選擇音樂
     selected_bgm = st.selectbox("選擇背景音樂", list(bgm_playlist.keys()), label_visibility="collapsed")
     
-    # 播放音樂 (loop=True 代表單曲循環)
-    st.audio(bgm_playlist[selected_bgm], start_time=0, loop=True)
+    # 播放音樂 (loop=True 代表單曲循環)，找不到音樂檔時略過，避免整頁中斷
+    if os.path.exists(bgm_playlist[selected_bgm]):
+        st.audio(bgm_playlist[selected_bgm], start_time=0, loop=True)
+    else:
+        st.caption("🔇 找不到音樂檔")
 
 if start_btn:
-    stock_list = [s.strip() for s in stock_input.split(',')]
+    from analysis import analyze_stock
+    from result_store import ResultSet
 
-    if len(stock_list) > 5:
-        st.error(f"❌ 偵測到 {len(stock_list)} 檔股票。為維護系統穩定，單次分析上限為 5 檔，請減少數量後再重試。")
-        st.stop()
-    
-    results = []
+    # 去除空白與重複代號，保留輸入順序
+    stock_list = list(dict.fromkeys(s.strip() for s in stock_input.split(',') if s.strip()))
+
+    # 多檔分析時不逐檔跳出對話框，警示改記錄於日誌
+    single_mode = len(stock_list) == 1
+
+    results = ResultSet()
     st.session_state['process_logs'] = [] 
 
-    data_loader = StockData(finmind_token)
+    data_loader = get_data_client(finmind_token, scheduled=use_schedule)
+    fetch_before = dict(data_loader.fetch_stats)
     run_timestamp = int(time.time()) 
     
     add_log(f"🚀 啟動分析任務，目標個股：{stock_list}")
+    # 封存啟用時，分析過程中收集各股的輸入切片 (見 run_archive.py)
+    try:
+        from run_archive import input_recorder
+        recorder = input_recorder()
+    except Exception as e:
+        recorder = None
+        add_log(f"⚠️ 無法封存本次分析的輸入資料: {str(e)}")
+
+    profiler = st.session_state['profile_report'] = None
+    if profile_run:
+        from profiling import SamplingProfiler
+        profiler = SamplingProfiler().start()
 
     with st.status("🧬 系統正在執行深度計算...", expanded=True) as status:
-        for i, stock_id in enumerate(stock_list):
-            st.write(f"#### 🔍 處理個股：{stock_id}")
-            add_log(f"🔍 處理個股：{stock_id}")
-
-            stock_whitelist_info = stock_map.get(stock_id)
-
-            if stock_whitelist_info:
-                # 代號存在於 JSON 中
-                stock_name = stock_whitelist_info.get("name", "未知股票")
-                industry = stock_whitelist_info.get("industry", "未知產業")
-                recommend = stock_whitelist_info.get("recommend", True)
-                note = stock_whitelist_info.get("note", "")
+        try:
+            progress = st.progress(0.0)
+            for i, stock_id in enumerate(stock_list):
+                progress.progress(i / len(stock_list), text=f"🔍 處理個股：{stock_id} ({i + 1}/{len(stock_list)})")
+                add_log(f"🔍 處理個股：{stock_id}")
+
+                stock_whitelist_info = stock_map.get(stock_id)
+
+                if stock_whitelist_info:
+                    # 代號存在於 JSON 中
+                    stock_name = stock_whitelist_info.get("name", "未知股票")
+                    industry = stock_whitelist_info.get("industry", "未知產業")
+                    recommend = stock_whitelist_info.get("recommend", True)
+                    note = stock_whitelist_info.get("note", "")
                 
-                if not recommend:
-                    warn_msg = f"此股票屬於【{industry}】，非「獲利與營收高度正相關」產業，不適用本模型。\n({note})"
-                    show_alert_dialog(stock_id, warn_msg, is_fatal=True)
-                    
-                    add_log(f"⚠️ {stock_id} 跳過：{warn_msg}")
-                    st.warning(warn_msg)
-                    st.divider()
-                    continue 
-            else:
-                warn_msg = "此股票未列入台股前 150 大權值股清單，基本面數據可能較不完整或波動較大。"
-                show_alert_dialog(stock_id, warn_msg, is_fatal=False)
-                
-                stock_info = data_loader.get_stock_info(stock_id)
-                if isinstance(stock_info, dict):
-                    stock_name = stock_info.get("name", "未知股票")
-                    industry = stock_info.get("industry", "未知產業")
-                else:
-                    stock_name = str(stock_info)
-                    industry = "未知產業"          
-
-            try:
-                add_log(f"📡 正在獲取 {stock_id} 原始數據...")
-                stock_info = data_loader.get_stock_info(stock_id)
-
-                if stock_info == "未知股票":
-                    err_msg = f"⚠️ 查無股票代號 {stock_id}。"
-                    st.warning(err_msg)
-                    add_log(err_msg)
-                    continue 
-
-                if isinstance(stock_info, dict):
-                    stock_name = stock_info.get("name", stock_id)
-                    industry = stock_info.get("industry", "未知產業")
+                    if not recommend:
+                        warn_msg = f"此股票屬於【{industry}】，非「獲利與營收高度正相關」產業，不適用本模型。\n({note})"
+                        if single_mode:
+                            show_alert_dialog(stock_id, warn_msg, is_fatal=True)
+                            st.warning(warn_msg)
+
+                        add_log(f"⚠️ {stock_id} 跳過：{warn_msg}")
+                        continue 
                 else:
-                    stock_name = stock_info
-                    industry = "未知產業"
-
-
-                df_rev = data_loader.get_revenue(stock_id)
-
-                if df_rev.empty:
-                    err_msg = f"⚠️  {stock_id}該股營收數據不足。"
-                    st.warning(err_msg)
-                    add_log(err_msg)
-                    continue 
-
-                df_rev = df_rev[df_rev['date'] <= datetime.now()]
-                df_profit = data_loader.get_profitability(stock_id)
-                time.sleep(0.2) 
-
-
-                add_log(f"📈 執行策略 A：成長性診斷...")
-                res_growth = analyze_growth_stage(df_rev, logger=add_log)
-                if not isinstance(res_growth, dict): res_growth = {}
-
-                add_log(f"💰 執行策略 B：獲利性診斷...")
-
-                res_profit = analyze_profit_stage(df_profit, res_growth, logger=add_log)
-                if not isinstance(res_profit, dict): res_profit = {}
-        
-                add_log(f"👑 執行策略 C：報酬能力診斷...")
-                df_annual = data_loader.get_shareholder_return(stock_id)
-                res_sh = analyze_shareholder_return(df_annual, res_growth, res_profit, logger=add_log)
-                
-                if not isinstance(res_sh, dict): res_sh = {}
-
-                current_price = data_loader.get_latest_price(stock_id)
-                ten_american = data_loader.get_us_bond_yield()
-                df_val = data_loader.get_valuation_history(stock_id)
-                res_val = analyze_valuation_stage(df_val, current_price, ten_american,res_sh['推估eps'],df_annual, logger=add_log)
+                    warn_msg = "此股票未列入台股前 150 大權值股清單，基本面數據可能較不完整或波動較大。"
+                    if single_mode:
+                        show_alert_dialog(stock_id, warn_msg, is_fatal=False)
+                    add_log(f"⚠️ {stock_id}：{warn_msg}")
                 
-                df_news = data_loader.get_stock_news(stock_id, days=90, logger=add_log)
+                    stock_info = data_loader.get_stock_info(stock_id)
+                    if isinstance(stock_info, dict):
+                        stock_name = stock_info.get("name", "未知股票")
+                        industry = stock_info.get("industry", "未知產業")
+                    else:
+                        stock_name = str(stock_info)
+                        industry = "未知產業"          
+
+                try:
+                    add_log(f"📡 正在獲取 {stock_id} 原始數據...")
+                    stock_info = data_loader.get_stock_info(stock_id)
+
+                    if stock_info == "未知股票":
+                        err_msg = f"⚠️ 查無股票代號 {stock_id}。"
+                        st.warning(err_msg)
+                        add_log(err_msg)
+                        continue 
+
+                    if isinstance(stock_info, dict):
+                        stock_name = stock_info.get("name", stock_id)
+                        industry = stock_info.get("industry", "未知產業")
+                    else:
+                        stock_name = stock_info
+                        industry = "未知產業"
 
-                combined_res = {**res_growth, **res_profit, **res_sh, **res_val}
-                combined_res['股票'] = f"{stock_name} ({stock_id})"
-                combined_res['股票代號'] = stock_id
-                combined_res['股票名稱'] = stock_name
-                combined_res['產業別'] = industry
-                combined_res['ui_key'] = f"{stock_id}_{run_timestamp}_{i}"
-                combined_res['news']= df_news
 
+                    combined_res, err_msg = analyze_stock(
+                        data_loader, stock_id, stock_name, industry,
+                        f"{stock_id}_{run_timestamp}_{i}", results, logger=add_log, recorder=recorder
+                    )
+                    if combined_res is None:
+                        st.warning(err_msg)
+                        add_log(err_msg)
+                        continue 
 
-                results.append(combined_res)
-                add_log(f"✅ {stock_id} 分析完成，得分：{combined_res.get('成長總分', 'N/A')}")
-                st.write(f"✅ {stock_id} 分析完成")
+                    add_log(f"✅ {stock_id} 分析完成，得分：{combined_res.get('成長總分', 'N/A')}")
       
-            except Exception as e:
-                err_msg = f"❌ {stock_id} 分析失敗: {str(e)}"
-                st.error(err_msg)
-                add_log(err_msg)
+                except Exception as e:
+                    err_msg = f"❌ {stock_id} 分析失敗: {str(e)}"
+                    st.error(err_msg)
+                    add_log(err_msg)
 
-        status.update(label="✨ 所有分析完畢！", state="complete", expanded=False)
+            progress.progress(1.0, text=f"✅ 完成 {len(results)} / {len(stock_list)} 檔")
+            status.update(label="✨ 所有分析完畢！", state="complete", expanded=False)
+        finally:
+            # st.rerun 或例外中斷分析時也要停止取樣，保留已取得的報告
+            if profiler is not None:
+                report = profiler.stop()
+                st.session_state['profile_report'] = report
+                add_log(f"🩺 效能剖析：取樣 {report.samples} 次，耗時 {report.elapsed:.2f} 秒")
         st.session_state['analysis_results'] = results
+        api_calls = data_loader.fetch_stats['api'] - fetch_before['api']
+        cache_hits = data_loader.fetch_stats['cache'] - fetch_before['cache']
+        memory_hits = data_loader.fetch_stats['memory'] - fetch_before['memory']
+        add_log(f"📡 API 呼叫 {api_calls} 次，未到發布時間改用快取 {cache_hits} 次，共用記憶體快取 {memory_hits} 次")
+        add_log(f"📦 結果表佔用記憶體：{results.memory_usage() / 1024:.1f} KB")
+        # 分析結果寫入資料倉儲，之後可用 SQL 選股直接查詢，不必重新計算
+        try:
+            add_log(f"💾 已寫入 {get_warehouse().save_scores(results)} 檔分析結果至資料倉儲")
+        except Exception as e:
+            add_log(f"⚠️ 分析結果寫入資料倉儲失敗: {str(e)}")
+        try:
+            from run_history import diff_latest, summary_lines
+            for line in summary_lines(diff_latest(get_warehouse(), results.stock_ids)):
+                add_log(line)
+        except Exception as e:
+            add_log(f"⚠️ 與前次結果比較失敗: {str(e)}")
+        # 結果與輸入切片封存為 Parquet，之後可重新開啟或重現 (見 run_archive.py)
+        try:
+            from run_archive import archive_run
+            archive_run(results, source='app', recorder=recorder, logger=add_log)
+        except Exception as e:
+            add_log(f"⚠️ 分析結果封存失敗: {str(e)}")
         add_log("🏁 任務結束。")
 
-if st.session_state['analysis_results']:
-    results = st.session_state['analysis_results']
-    df_res = pd.DataFrame(results)
-    
-
-    # 計算公式：(目標價 / 目前股價 - 1) * 100
-    df_res['保底潛在空間'] = ((df_res['目標價'] / df_res['目前股價'] - 1) * 100).map(lambda x: f"{x:+.1f}%")
+def fill_stock_input(stock_ids):
+    """把選股結果帶入側邊欄的代號輸入框"""
+    st.session_state['stock_input'] = ",".join(stock_ids)
+
+# SQL 選股：在資料倉儲已保存的分析結果上查詢，不重新抓取或計算 (開啟時才載入)
+if st.toggle("🔎 SQL 選股 (查詢已分析過的股票)", key="screen_panel"):
+    from screener import load_screens, save_screen, run_screen
+
+    with st.container(border=True):
+        screens = load_screens()
+        s1, s2 = st.columns([3, 7])
+        with s1:
+            picked = st.selectbox("已保存的條件", ["(自訂條件)"] + list(screens.keys()))
+        with s2:
+            where = st.text_input(
+                "WHERE 條件", value=screens.get(picked, ""),
+                placeholder="MasterScore > 80 AND 目前股價 < 合理價 AND industry = '半導體業'"
+            )
+
+        try:
+            t0 = time.perf_counter()
+            df_screen = run_screen(get_warehouse(), where)
+            st.caption(f"符合條件 {len(df_screen)} 檔 ({(time.perf_counter() - t0) * 1000:.1f} ms)，資料來源為各股最近一次的分析結果")
+            st.dataframe(df_screen, width="stretch", hide_index=True, height=250)
+
+            b1, b2, b3 = st.columns([2, 3, 2])
+            with b1:
+                st.button(
+                    "📋 帶入代號重新分析", disabled=df_screen.empty,
+                    on_click=fill_stock_input, args=(df_screen['stock_id'].tolist(),)
+                )
+            with b2:
+                screen_name = st.text_input("條件名稱", placeholder="輸入名稱以保存條件", label_visibility="collapsed")
+            with b3:
+                if st.button("💾 保存條件", disabled=not (screen_name and where)):
+                    save_screen(screen_name, where)
+                    st.rerun()
+        except Exception as e:
+            st.error(f"❌ 查詢失敗: {str(e)}")
+
+def open_archived_run(run_id):
+    """把封存的分析載入為目前的分析結果"""
+    from run_archive import open_run
+    st.session_state['analysis_results'] = open_run(run_id)
+    st.session_state['process_logs'] = [f"🗄️ 已開啟封存的分析 {run_id} (原始序列在檢視個股時才載入)"]
+
+# 歷史分析封存：重新開啟過去某次分析、查詢單檔股票在各次分析的結果 (開啟時才載入)
+if st.toggle("🗄️ 歷史分析封存 (重新開啟過去的分析)", key="archive_panel"):
+    from run_archive import list_runs, stock_history
+
+    with st.container(border=True):
+        try:
+            runs = list_runs()
+        except Exception as e:
+            runs = None
+            st.error(f"❌ 讀取封存失敗: {str(e)}")
+        if runs is not None and runs.empty:
+            st.info("📭 還沒有封存的分析，完成一次分析後會自動封存。")
+        elif runs is not None:
+            labels = {r.run_id: f"{r.run_at:%Y-%m-%d %H:%M} · {r.source} · {r.檔數} 檔" for r in runs.itertuples()}
+            a1, a2 = st.columns([7, 3])
+            with a1:
+                run_id = st.selectbox("封存的分析", list(labels), format_func=labels.get)
+            with a2:
+                st.write("")
+                if st.button("📂 開啟這次分析", width="stretch"):
+                    try:
+                        open_archived_run(run_id)
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ 開啟封存失敗: {str(e)}")
+            st.caption(f"共 {len(runs)} 次分析，{runs['大小(KB)'].sum() / 1024:.1f} MB (zstd 壓縮的 Parquet)")
+
+            history_id = st.text_input("單檔歷史", placeholder="輸入股票代號，例如 2330", key="archive_stock")
+            if history_id.strip():
+                t0 = time.perf_counter()
+                df_hist = stock_history(history_id.strip(), columns=['股票名稱', 'MasterScore', '目前股價', '合理價', '最終總評'])
+                st.caption(f"{len(df_hist)} 次分析含 {history_id.strip()} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+                if not df_hist.empty:
+                    st.line_chart(df_hist.set_index('run_at')[['MasterScore']])
+                    st.dataframe(df_hist.drop(columns=['股票代號']), hide_index=True, width="stretch")
+
+@st.fragment
+def render_leaderboard_view(df_board, results, board_key, industry_mode):
+    """排行榜區塊：篩選、排序、分頁只重跑這個片段"""
+    from report_export import export_report_bytes
+    from leaderboard import filter_leaderboard, page_leaderboard, SORTABLE_COLS
+
+    st.subheader("🏆 產業相對排名" if industry_mode else "🏆 綜合評分排行榜")
+
+    # 篩選/排序/分頁都在預先算好的排行榜上進行，只把當頁送到前端
+    f1, f2, f3, f4 = st.columns([3, 2, 2, 3])
+    with f1:
+        pick_industries = st.multiselect("產業別", sorted(df_board['產業別'].dropna().unique()), placeholder="全部產業")
+    with f2:
+        sort_by = st.selectbox("排序欄位", SORTABLE_COLS)
+    with f3:
+        min_score = st.number_input("綜合評分 ≥", min_value=0, max_value=100, value=0, step=5)
+    with f4:
+        keyword = st.text_input("搜尋代號/名稱", "")
+
+    df_view = filter_leaderboard(df_board, industries=pick_industries, min_score=min_score, keyword=keyword)
+    total = len(df_view)
+    page_size = 50
+    page_count = max((total - 1) // page_size + 1, 1)
+    p1, p2 = st.columns([2, 8])
+    with p1:
+        page = st.number_input(f"頁數 (共 {page_count} 頁)", min_value=1, max_value=page_count, value=1)
+
+    df_page = page_leaderboard(df_view, sort_by=sort_by, page=page, page_size=page_size)
+    with p2:
+        st.caption(f"符合條件 {total} 檔，顯示第 {(page - 1) * page_size + min(1, total)} - {(page - 1) * page_size + len(df_page)} 檔")
 
-    st.subheader("🏆 綜合評分排行榜")
-    cols = ['股票','MasterScore', '目前股價', '目標價', '保底潛在空間','便宜價','合理價','昂貴價','最終總評']
-    rename_map = {'MasterScore': '綜合評分','最終總評': '分析評語','目標價': '實力保底價'}
-    existing_cols = [c for c in cols if c in df_res.columns]
-    
     st.dataframe(
-        df_res[existing_cols].rename(columns=rename_map).set_index('股票').sort_values('實力保底價', ascending=False), 
-        use_container_width=True, height=250
+        df_page.drop(columns=['股票代號', '產業別']).set_index('股票'),
+        use_container_width=True, height=250,
+        column_config={"保底潛在空間": st.column_config.NumberColumn(format="%+.1f%%")}
     )
 
-    col_dl, col_help = st.columns([2, 8]) # 調整比例讓按鈕靠左
+    col_dl, col_xlsx, col_help = st.columns([2, 2, 6]) # 調整比例讓按鈕靠左
     with col_dl:
-        st.download_button("📥 匯出分析報告", df_res.to_csv().encode('utf-8-sig'), "report.csv", "text/csv")
+        if st.session_state.get('leaderboard_csv_key') != st.session_state.get('leaderboard_key'):
+            st.session_state['leaderboard_csv'] = df_board.to_csv().encode('utf-8-sig')
+            st.session_state['leaderboard_csv_key'] = st.session_state.get('leaderboard_key')
+        st.download_button("📥 匯出排行榜 CSV", st.session_state['leaderboard_csv'], "report.csv", "text/csv")
+    with col_xlsx:
+        # Excel 報表含完整原始序列，按下才產生，並依結果表版本快取
+        if st.session_state.get('excel_report_key') == board_key:
+            st.download_button(
+                "📥 下載 Excel 報表", st.session_state['excel_report'], "report.xlsx",
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        elif st.button("📊 產生 Excel 報表"):
+            with st.spinner("報表產生中..."):
+                st.session_state['excel_report'] = export_report_bytes(results, logger=add_log)
+                st.session_state['excel_report_key'] = board_key
+            st.rerun()
     with col_help:
         if st.button("ℹ️ 策略維度說明"):
             show_strategy_guide()
-    st.divider()
 
+
+@st.fragment
+def render_detail_view(results, board_key, industry_ranks):
+    """個股深度診斷：切換股票、面向或按鈕只重畫這個片段，不重建排行榜"""
     st.subheader("🔍 個股深度診斷")
     
-    success_ids = [d.get('股票代號') for d in results]
+    # 結果表以代號建有索引，不需線性搜尋整份結果
+    success_ids = results.stock_ids
     
     if success_ids:
+        # 選項標籤只在結果表版本變動時建立一次，不必每次重跑都逐檔組出完整紀錄
+        labels = get_stock_labels(results, board_key)
         selected_id = st.selectbox(
             "請選擇要深入分析的股票：", 
             success_ids, 
-            format_func=lambda x: f"{x} ({next((d['股票名稱'] for d in results if d.get('股票代號') == x), '未分析')})"
+            format_func=lambda x: labels.get(x, f"{x} (未分析)")
         )
-        res = next((d for d in results if d.get('股票代號') == selected_id), None)
+        res, view = get_detail_view(results, selected_id, board_key)
         
         if res:
 
@@ -406,43 +874,31 @@ if st.session_state['analysis_results']:
                     st.caption(f"產業別：{res['產業別']} | 資料日期：{datetime.now().strftime('%Y-%m-%d')}")
 
                 with c2:
-                    avg_score = int((res.get('MasterScore', 0)))
-                    score_color = "green" if avg_score >= 80 else "orange"
-                    st.markdown(f"""
-                        <div style="border: 2px solid {score_color}; border-radius: 10px; padding: 10px; text-align: center;">
-                            <h1 style="margin:0; color:{score_color};">{avg_score} 分</h1>
-                            <small>綜合評分</small>
-                        </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(view['score_html'], unsafe_allow_html=True)
 
                 st.info(f"Master Score 最終總評：{res.get('最終總評', '無特定建議')}")
 
-            col1, col2, col3, col4, col5 = st.columns(5)
-            roe = round(res.get('最新ROE') * 100, 2)
-            eps = round(res.get('最新EPS'), 2)
-            gpm = round(res.get('latest_gpm') * 100, 2)
-            opm = round(res.get('latest_opm') * 100, 2)
-            gro = round(res.get('最新單月營收年增') * 100, 2)
-
-
-            with col1:
-                render_kpi_card("單月營收年增", gro,  f"{res.get('營收年增成長')} %", suffix="%")
-            with col2:
-                render_kpi_card("GPM (季度)", gpm, f"{res.get('gpm_growth')} %", suffix="%")
-            with col3:
-                render_kpi_card("OPM (季度)", opm, f"{res.get('opm_growth')} %", suffix="%")
-            with col4:
-                render_kpi_card("ROE (年度)", roe, f"{res.get('ROE成長')} %", suffix="%")
-            with col5:
-                render_kpi_card("EPS (年度)", eps, f"{res.get('EPS成長')} %")
+                if industry_ranks is not None and selected_id in industry_ranks.index:
+                    rk = industry_ranks.loc[selected_id]
+                    st.caption(f"產業相對排名：{rk['排名產業']} 第 {rk['產業排名']} 名 (產業相對分 {rk['產業相對分']})，各指標 PR 如下 (同業少於 3 家時以全市場計算)")
+                    pr_cols = st.columns(5)
+                    for col, name in zip(pr_cols, ['營收動能PR', '營益率PR', 'ROEPR', 'EPS成長PR', '本益比折價PR']):
+                        col.metric(name.replace('PR', ' PR'), "N/A" if rk[name] != rk[name] else f"{rk[name]:.0f}")
+
+            for col, (title, value, delta, suffix) in zip(st.columns(5), view['kpis']):
+                with col:
+                    render_kpi_card(title, value, delta, suffix=suffix)
             st.write("")
 
 
-            tab_main, tab_profit, tab_val, tab_news, tab_ai = st.tabs([
-                "🚀 成長動能", "🤝 獲利結構/股東報酬", "💰 估值與目標價", "📰 重大新聞", "🤖 AI 分析"
-            ])
+            # st.tabs 會把所有分頁一次畫完，改用分段選單只渲染目前選到的頁面
+            section = st.segmented_control(
+                "診斷面向",
+                ["🚀 成長動能", "🤝 獲利結構/股東報酬", "💰 估值與目標價", "📰 重大新聞", "🤖 AI 分析"],
+                default="🚀 成長動能", label_visibility="collapsed", key="detail_section"
+            ) or "🚀 成長動能"
 
-            with tab_main:
+            if section == "🚀 成長動能":
                 st.subheader("營收動能模組")
                 col1, col2 = st.columns(2)
                 col1.metric("綜合動能訊號", f"{res.get('狀態診斷', 'N/A')}")
@@ -457,7 +913,12 @@ if st.session_state['analysis_results']:
                 """)
                 st.info(f"💡 成長動能總評：{res.get('成長總分建議', '無特定建議')}")
 
-            with tab_profit:
+                # 需要讀取全市場月營收並計算相關矩陣，開啟時才載入
+                if st.toggle("👥 營收動能同儕 (走勢最相近的股票)", key="peer_panel"):
+                    with st.container(border=True):
+                        render_peers(results, selected_id)
+
+            elif section == "🤝 獲利結構/股東報酬":
                 st.subheader("獲利/報酬體質模組")
                 col1, = st.columns(1)
                 col2, = st.columns(1)
@@ -472,65 +933,15 @@ if st.session_state['analysis_results']:
                 """)
                 st.info(f"💡 獲利含金量總評：{res.get('action', '無特定建議')}")
 
-            with tab_val:
+            elif section == "💰 估值與目標價":
                 eps_next = round(res.get('推估eps'), 2)
                 st.subheader(f"本益比估值法 (推估明年 EPS: {eps_next}) ex.市場的期待值")
                 curr_p = res.get('目前股價', 0)
 
-                def get_price_card_html(title, price, diff, theme):
-
-                    bg, border, text, icon = theme
-                    diff_sign = "+" if diff > 0 else ""
-                    
-                    return f"""
-                    <div style="
-                        background-color: {bg};
-                        border: 1px solid {border};
-                        border-radius: 12px;
-                        padding: 20px;
-                        text-align: center;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-                        height: 100%;
-                    ">
-                        <div style="color: {text}; font-weight: bold; font-size: 1.1em; margin-bottom: 8px;">
-                            {icon} {title}
-                        </div>
-                        <div style="color: #1f2937; font-size: 2em; font-weight: 800; margin: 0;">
-                            ${price}
-                        </div>
-                        <div style="margin-top: 8px; font-size: 0.9em; color: #4b5563;">
-                            距目前價：<span style="color: {text}; font-weight: 600;">{diff_sign}{diff}%</span>
-                        </div>
-                    </div>
-                    """
-                
-                c_low, c_fair, c_high = st.columns(3)
-                with c_low:
-                    p_cheap = res.get('便宜價', 0)
-                    diff = round(((curr_p - p_cheap) / p_cheap) * 100, 1) if p_cheap > 0 else 0
-
-                    st.markdown(get_price_card_html(
-                        "便宜價", p_cheap, diff, 
-                        ("#F0FDF4", "#BBF7D0", "#166534", "💎")
-                    ), unsafe_allow_html=True)
-
-                with c_fair:
-                    p_fair = res.get('合理價', 0)
-                    diff_fair = round(((curr_p - p_fair) / p_fair) * 100, 1) if p_fair > 0 else 0
-
-                    st.markdown(get_price_card_html(
-                        "合理價", p_fair, diff_fair, 
-                        ("#FFF7ED", "#FED7AA", "#9A3412", "⚖️")
-                    ), unsafe_allow_html=True)
-
-                with c_high:
-                    p_exp = res.get('昂貴價', 0)
-                    diff_exp = round(((curr_p - p_exp) / p_exp) * 100, 1) if p_exp > 0 else 0
-
-                    st.markdown(get_price_card_html(
-                        "昂貴價", p_exp, diff_exp, 
-                        ("#FEF2F2", "#FECACA", "#991B1B", "⚠️")
-                    ), unsafe_allow_html=True)
+                # 價位卡 HTML 依結果表版本快取，切換面向時不重新組字串
+                for col, html in zip(st.columns(3), view['cards']):
+                    with col:
+                        st.markdown(html, unsafe_allow_html=True)
 
                 st.write("")
 
@@ -555,33 +966,35 @@ if st.session_state['analysis_results']:
                         st.caption(datetime.now().strftime('%Y-%m-%d'))
                         st.info(res.get('價值評估'))
 
-            with tab_news:
+                # 需要抓取多年日資料，開啟時才載入
+                if st.toggle("📈 本益比 / 淨值比河流圖", key="river_panel"):
+                    with st.container(border=True):
+                        render_river(results, selected_id, finmind_token)
+
+                with st.expander("🎛️ 情境分析 (敏感度)"):
+                    render_scenarios(results, selected_id)
+
+                with st.expander("🎲 目標價機率分布 (蒙地卡羅)"):
+                    render_monte_carlo(results, selected_id, board_key)
+
+            elif section == "📰 重大新聞":
                     st.subheader("📰 近期新聞")
-                    news_df = res.get('news')
+                    with st.spinner("📡 載入新聞中..."):
+                        news_df = load_stock_news(finmind_token, selected_id)
                     
                     if news_df is not None and not news_df.empty:
-
-                        news_df = news_df.drop_duplicates(subset=['title']).head(10)
-                        
-                        for idx, row in news_df.iterrows():
-                            with st.container(border=True):
-                                c_date, c_content = st.columns([1, 4])
-
-                                date_str = row['date'].strftime('%Y-%m-%d') if pd.notnull(row['date']) else "未知日期"
-                                c_date.caption(f"{date_str} | {row.get('source', '')}")
-                                
-
-                                title = row.get('title', '無標題')
-                                link = row.get('link', '#')
-                                c_content.markdown(f"**[{title}]({link})**")
-                                
-                                if 'description' in row and pd.notnull(row['description']):
-                                    desc = str(row['description'])[:100] + "..."
-                                    c_content.caption(desc)
+                        render_news(news_df)
                     else:
                         st.info("📭 查無近期相關新聞。")
 
-            with tab_ai:
+                    # 在本機新聞庫中跨所有股票搜尋，不呼叫 API
+                    news_query = st.text_input("🔎 搜尋全市場新聞", placeholder="例如：CoWoS、降價")
+                    if news_query:
+                        hits = get_news_store().search(news_query, limit=30)
+                        st.caption(f"共找到 {len(hits)} 則 (最多顯示 30 則)")
+                        render_news(hits, show_stock=True)
+
+            elif section == "🤖 AI 分析":
                 st.markdown("### 🤖 Gemini AI 深度投資解析")
                 st.write("點擊下方按鈕，讓 AI 為您即時解讀財報與市場情緒。")
                 
@@ -616,6 +1029,35 @@ if st.session_state['analysis_results']:
                     st.progress(min(max(s_return, 0), 100) / 100)
                     st.caption(f"得分：{s_return} / 100")
 
+
+if st.session_state['analysis_results']:
+    import pandas as pd
+    from leaderboard import build_leaderboard
+
+    results = st.session_state['analysis_results']
+    # 排行榜只在結果表版本變動時重建，之後的互動只做篩選與分頁
+    board_key = (id(results), results.version)
+    industry_mode = score_mode == "產業相對排名"
+    if st.session_state.get('leaderboard_key') != (board_key, industry_mode):
+        ranks = None
+        if industry_mode:
+            from ranking import rank_universe
+            # 以資料倉儲中所有分析過的股票作為同業比較母體
+            ranks = rank_universe(results, warehouse=get_warehouse(), stock_map=stock_map)
+        st.session_state['industry_ranks'] = ranks
+        st.session_state['leaderboard'] = build_leaderboard(results, ranks=ranks)
+        st.session_state['leaderboard_key'] = (board_key, industry_mode)
+    df_board = st.session_state['leaderboard']
+    industry_ranks = st.session_state['industry_ranks']
+
+    render_leaderboard_view(df_board, results, board_key, industry_mode)
+    # 與前一次分析的比較 (開啟時才查詢)
+    if st.toggle("🔁 與前次分析比較 (評分異動、總評變化、價位穿越)", key="diff_panel"):
+        render_run_diff(results)
+    st.divider()
+
+    render_detail_view(results, board_key, industry_ranks)
+
     st.divider()
     with st.expander("⚙️ 系統分析流水線日誌", expanded=False):
         if st.session_state['process_logs']:
@@ -623,5 +1065,29 @@ if st.session_state['analysis_results']:
             if st.button("🗑️ 清空日誌"):
                 st.session_state['process_logs'] = []
                 st.rerun()
+
+        from http_client import get_transport
+        conn_stats = get_transport().stats()
+        if conn_stats:
+            st.caption("🔌 連線池重用統計 (各主機)")
+            st.dataframe(pd.DataFrame.from_dict(conn_stats, orient='index'), width="stretch")
+
+        from mem_cache import get_mem_cache
+        mem = get_mem_cache().stats()
+        st.caption(f"🧠 共用記憶體快取：{mem['entries']} 筆、{mem['bytes'] / 1024 / 1024:.1f} / {mem['budget'] / 1024 / 1024:.0f} MB，"
+                   f"命中率 {mem['hit_ratio']:.0%} (命中 {mem['hits']}、未命中 {mem['misses']}、合併請求 {mem['coalesced']}、淘汰 {mem['evictions']})")
+
+        report = st.session_state.get('profile_report')
+        if report is not None:
+            st.caption(f"🩺 效能剖析：取樣 {report.samples} 次 (每 {report.interval * 1000:.0f} ms)，耗時 {report.elapsed:.2f} 秒；"
+                       "各階段為工作執行緒的累計時間，平行執行時總和可能大於實際耗時")
+            col_stage, col_hot = st.columns([2, 3])
+            col_stage.dataframe(report.stage_summary(), hide_index=True, width='stretch')
+            col_hot.dataframe(report.hot_functions(), hide_index=True, width='stretch')
+            col_svg, col_tree, col_folded = st.columns(3)
+            col_svg.download_button("🔥 火焰圖 (SVG)", report.flamegraph_svg(), file_name="profile_flamegraph.svg", mime="image/svg+xml")
+            col_tree.download_button("🌳 呼叫樹 (TXT)", report.call_tree(), file_name="profile_calltree.txt", mime="text/plain")
+            col_folded.download_button("📄 Collapsed stacks", report.folded(), file_name="profile.folded", mime="text/plain",
+                                       help="可匯入 speedscope.app 或 flamegraph.pl")
 else:
     st.info("💡 請在左側輸入代號並點擊「開始分析」以查看結果。")
\ No newline at end of file
@@ -0,0 +1,411 @@
+# batch.py
+"""
+批次模式 (命令列)
+
+    python batch.py analyze 2330 2317 --token <FinMind Token> [--export report.xlsx]
+    python batch.py analyze 2330 2317 ... --workers 8   # 多程序評分 (原始資料透過共享記憶體傳給工作程序)
+    python batch.py screen 高分且低於合理價
+    python batch.py screen --where "MasterScore > 80 AND industry = '半導體業'" [--reanalyze --token ...]
+    python batch.py screens
+    python batch.py plan [2330 2317]            # 依發布行事曆列出需要更新的資料
+    python batch.py refresh --token ...          # 只重新分析有資料到期的股票
+    python batch.py check-dtypes [2330 2317]     # 確認精簡型別不影響評分，並比較記憶體用量
+    python batch.py movers [2330 2317] [--csv diff.csv]   # 最新結果與前一次分析的比較
+    python batch.py analyze 2330 2317 --profile prof/run   # 效能剖析：輸出 run.svg (火焰圖)、run.txt (呼叫樹)、run.folded
+    python batch.py archive list                 # 封存的分析 (每次分析結束時自動封存，見 run_archive.py)
+    python batch.py archive history 2330 [--start 2026-01-01]   # 單檔股票在各次分析的結果
+    python batch.py archive replay <run_id> 2330  # 以封存的輸入重新計算，確認結果可重現
+
+analyze 的結果會寫入資料倉儲 (warehouse.py)，screen 直接在已存的分析結果上查詢，不重新抓取或計算
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from pandas.errors import DatabaseError
+from screener import load_screens, run_screen
+from warehouse import Warehouse, DB_PATH
+
+# 不分股票的共用資料 (美債殖利率) 的代號
+SHARED_DATA_IDS = {'United States 10-Year'}
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+
+
+def _split_codes(values):
+    """代號可用空白或逗號分隔，去除重複並保留順序"""
+    return list(dict.fromkeys(s.strip() for arg in values for s in arg.split(',') if s.strip()))
+
+
+def run_analysis(stock_list, token, warehouse, logger=log, scheduled=True):
+    """依序分析股票並把結果寫入資料倉儲，回傳 ResultSet"""
+    from analysis import analyze_stock, read_stock_map
+    from data import StockData
+    from result_store import ResultSet
+    from scheduler import RefreshScheduler
+
+    stock_map = read_stock_map()
+    data_loader = StockData(token, warehouse=warehouse, scheduler=RefreshScheduler(warehouse) if scheduled else None)
+    results = ResultSet()
+    recorder = input_recorder(logger)
+    run_timestamp = int(time.time())
+
+    for i, stock_id in enumerate(stock_list):
+        logger(f"🔍 處理個股：{stock_id} ({i + 1}/{len(stock_list)})")
+        listed = stock_map.get(stock_id)
+        if listed and not listed.get("recommend", True):
+            logger(f"⚠️ {stock_id} 跳過：此股票屬於【{listed.get('industry')}】，不適用本模型。({listed.get('note', '')})")
+            continue
+
+        try:
+            stock_info = data_loader.get_stock_info(stock_id)
+            record, err_msg = analyze_stock(
+                data_loader, stock_id, stock_info.get("name", stock_id), stock_info.get("industry", "未知產業"),
+                f"{stock_id}_{run_timestamp}_{i}", results, logger=logger, recorder=recorder
+            )
+            if record is None:
+                logger(err_msg)
+                continue
+            logger(f"✅ {stock_id} 分析完成，綜合評分：{record.get('MasterScore', 'N/A')}")
+        except Exception as e:
+            logger(f"❌ {stock_id} 分析失敗: {str(e)}")
+
+    saved = warehouse.save_scores(results)
+    logger(f"📡 API 呼叫 {data_loader.fetch_stats['api']} 次，未到發布時間改用快取 {data_loader.fetch_stats['cache']} 次")
+    logger(f"💾 已寫入 {saved} 檔分析結果至 {warehouse.path}")
+    log_movers(warehouse, results.stock_ids, logger)
+    archive_run(results, recorder=recorder, logger=logger)
+    return results
+
+
+def log_movers(warehouse, stock_ids, logger=log):
+    """與前一次分析比較，記錄分數異動、總評變化與價位穿越"""
+    from run_history import diff_latest, summary_lines
+    for line in summary_lines(diff_latest(warehouse, stock_ids)):
+        logger(line)
+
+
+def input_recorder(logger=log):
+    """收集輸入切片的 InputRecorder (見 run_archive.py)；封存停用或無法使用時回傳 None"""
+    try:
+        from run_archive import input_recorder as new_recorder
+        return new_recorder()
+    except Exception as e:
+        logger(f"⚠️ 無法封存本次分析的輸入資料: {str(e)}")
+        return None
+
+
+def archive_run(results, recorder=None, source='batch', logger=log):
+    """結果與輸入切片封存為 Parquet (見 run_archive.py)；封存失敗不影響已寫入資料倉儲的結果"""
+    try:
+        from run_archive import archive_run as archive
+        return archive(results, source=source, recorder=recorder, logger=logger)
+    except Exception as e:
+        logger(f"⚠️ 分析結果封存失敗: {str(e)}")
+        return None
+
+
+def run_parallel_analysis(stock_list, token, warehouse, workers, logger=log, scheduled=True):
+    """
+    多程序評分：先以執行緒補抓到期的原始資料，再把面板放進共享記憶體交給工作程序
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from analysis import read_stock_map
+    from data import StockData
+    from parallel_batch import score_universe
+    from scheduler import RefreshScheduler
+
+    stock_map = read_stock_map()
+    scheduler = RefreshScheduler(warehouse) if scheduled else None
+    data_loader = StockData(token, warehouse=warehouse, scheduler=scheduler)
+
+    skipped = {s for s in stock_list if not (stock_map.get(s) or {}).get("recommend", True)}
+    for s in skipped:
+        logger(f"⚠️ {s} 跳過：此股票屬於【{stock_map[s].get('industry')}】，不適用本模型。({stock_map[s].get('note', '')})")
+    stock_list = [s for s in stock_list if s not in skipped]
+
+    # 1. I/O：只補抓到期 (或從未抓過) 的資料，寫入資料倉儲
+    if scheduler is not None:
+        due = scheduler.plan(stock_list)
+        due = due[due['due']]
+        refresh = [s for s in stock_list if s in set(due['data_id'])]
+    else:
+        refresh = stock_list
+
+    def warm(stock_id):
+        data_loader.get_revenue(stock_id)
+        data_loader.get_profitability(stock_id)
+        data_loader.get_shareholder_return(stock_id)
+        data_loader.get_pe_band(stock_id)
+        data_loader.get_latest_price(stock_id)
+
+    data_loader.get_us_bond_yield()
+    if refresh:
+        logger(f"📡 補抓 {len(refresh)} 檔股票的到期資料...")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(warm, refresh))
+
+    # 2. CPU：多程序評分
+    run_timestamp = int(time.time())
+    jobs = []
+    for i, stock_id in enumerate(stock_list):
+        info = data_loader.get_stock_info(stock_id)
+        jobs.append((stock_id, info.get("name", stock_id), info.get("industry", "未知產業"), f"{stock_id}_{run_timestamp}_{i}"))
+    # 工作程序各自收集並寫出輸入切片，結果只帶回參照
+    recorder = input_recorder(logger)
+    results = score_universe(jobs, warehouse, workers=workers, logger=logger,
+                             archive_dir=recorder.archive_dir if recorder is not None else None)
+
+    saved = warehouse.save_scores(results)
+    logger(f"📡 API 呼叫 {data_loader.fetch_stats['api']} 次，未到發布時間改用快取 {data_loader.fetch_stats['cache']} 次")
+    logger(f"💾 已寫入 {saved} 檔分析結果至 {warehouse.path}")
+    log_movers(warehouse, results.stock_ids, logger)
+    archive_run(results, logger=logger)
+    return results
+
+
+class _WarehouseOnly:
+    """排程器：所有資料一律視為未到期，只讀資料倉儲"""
+
+    def is_due(self, *args, **kwargs):
+        return False
+
+
+def check_dtypes(stock_list, warehouse, logger=log):
+    """
+    以資料倉儲中的原始資料，分別用原始型別與精簡型別 (frame_dtypes.py) 各評分一次
+    評分結果必須完全相同；同時比較全市場原始面板與結果 payloads 的記憶體用量
+    回傳評分不一致的欄位清單
+    """
+    from analysis import STOCK_PIPELINE, analyze_stock
+    from data import StockData
+    from frame_dtypes import compact_frame, frame_nbytes
+    from result_store import ResultSet
+    from scheduler import STOCK_DATASETS
+
+    runs = {}
+    for compact in (False, True):
+        STOCK_PIPELINE.clear()
+        loader = StockData("", warehouse=warehouse, scheduler=_WarehouseOnly(), compact=compact)
+        results = ResultSet()
+        for stock_id in stock_list:
+            try:
+                analyze_stock(loader, stock_id, stock_id, "", stock_id, results)
+            except Exception as e:
+                logger(f"❌ {stock_id} 分析失敗: {str(e)}")
+        runs[compact] = results
+    STOCK_PIPELINE.clear()
+
+    base = runs[False].frame().drop(columns=['ui_key']).set_index('股票代號').sort_index()
+    slim = runs[True].frame().drop(columns=['ui_key']).set_index('股票代號').sort_index()
+    diff = [c for c in base.columns if not base[c].equals(slim[c])]
+    if diff:
+        logger(f"❌ 精簡型別改變了評分結果：{', '.join(diff)}")
+    else:
+        logger(f"✅ {len(base)} 檔股票評分結果完全相同 ({len(base.columns)} 個欄位)")
+
+    raw = compact = 0
+    for dataset in STOCK_DATASETS:
+        df = warehouse.load_dataset(dataset)
+        df = df[df['stock_id'].astype(str).isin(set(stock_list))] if 'stock_id' in df.columns else df
+        raw += frame_nbytes(df)
+        compact += frame_nbytes(compact_frame(df))
+    logger(f"🧮 原始面板：{raw / 1024 / 1024:.1f} MB → {compact / 1024 / 1024:.1f} MB ({raw / max(compact, 1):.1f}x)")
+    before, after = runs[False].payloads.memory_usage(), runs[True].payloads.memory_usage()
+    logger(f"🧮 結果 payloads：{before / 1024:.0f} KB → {after / 1024:.0f} KB ({before / max(after, 1):.1f}x)")
+    return diff
+
+
+def write_profile(report, prefix, logger=log):
+    """剖析報告輸出為 火焰圖 (.svg)、呼叫樹 (.txt)、collapsed stacks (.folded)"""
+    if os.path.dirname(prefix):
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    outputs = {'.svg': report.flamegraph_svg(), '.txt': report.call_tree(), '.folded': report.folded()}
+    for ext, content in outputs.items():
+        with open(prefix + ext, 'w', encoding='utf-8') as f:
+            f.write(content)
+    logger(f"🩺 效能剖析：取樣 {report.samples} 次，耗時 {report.elapsed:.2f} 秒")
+    print(report.stage_summary().to_string(index=False))
+    logger(f"📑 剖析報告已輸出：{', '.join(prefix + ext for ext in outputs)}")
+
+
+def run_archive_command(args):
+    import pandas as pd
+    import run_archive
+
+    if args.action == 'list':
+        runs = run_archive.list_runs()
+        print(runs.drop(columns=['path']).to_string(index=False) if not runs.empty else "(無)")
+        return 0
+    if args.action == 'history':
+        if len(args.targets) != 1:
+            log("❌ history 需要一個股票代號")
+            return 2
+        start = time.perf_counter()
+        df = run_archive.stock_history(args.targets[0], args.start, args.end,
+                                       columns=['股票名稱', 'MasterScore', '目前股價', '便宜價', '合理價', '昂貴價'])
+        print(df.to_string(index=False) if not df.empty else "(無)")
+        log(f"🗄️ {len(df)} 次分析 ({(time.perf_counter() - start) * 1000:.1f} ms)")
+        return 0
+    if len(args.targets) != 2:
+        log("❌ replay 需要 run_id 與股票代號")
+        return 2
+    run_id, stock_id = args.targets
+    record, row = run_archive.replay_stock(run_id, stock_id)
+    diffs = [c for c in ('MasterScore', '成長總分', 'total_score', '股東報酬與獲利分', '便宜價', '合理價', '昂貴價', '最終總評')
+             if not (record.get(c) == row[c] or (pd.isna(record.get(c)) and pd.isna(row[c])))]
+    for c in diffs:
+        log(f"   {c}: 封存 {row[c]} → 重現 {record.get(c)}")
+    log(f"🔁 {stock_id} 於 {run_id} 的結果{'可完全重現' if not diffs else f'有 {len(diffs)} 項不同'}")
+    return 1 if diffs else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股基本面分析 - 批次模式")
+    parser.add_argument('--db', default=DB_PATH, help="資料倉儲路徑 (SQLite)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_analyze = sub.add_parser('analyze', help="分析股票並寫入資料倉儲")
+    p_analyze.add_argument('stocks', nargs='+', help="股票代號 (可用空白或逗號分隔)")
+    p_analyze.add_argument('--token', default=os.environ.get('FINMIND_TOKEN', ''), help="FinMind Token")
+    p_analyze.add_argument('--export', help="同時輸出 Excel 報表到指定路徑")
+    p_analyze.add_argument('--force', action='store_true', help="忽略發布行事曆，全部重新抓取")
+    p_analyze.add_argument('--workers', type=int, default=1, help="評分使用的程序數 (大於 1 時啟用多程序模式)")
+    p_analyze.add_argument('--profile', metavar='PREFIX', help="以取樣剖析器記錄本次分析，輸出 PREFIX.svg / .txt / .folded (只剖析主程序)")
+
+    p_screen = sub.add_parser('screen', help="執行選股條件")
+    p_screen.add_argument('name', nargs='?', help="已保存的選股條件名稱")
+    p_screen.add_argument('--where', help="直接指定 WHERE 子句")
+    p_screen.add_argument('--order-by', default='MasterScore DESC')
+    p_screen.add_argument('--limit', type=int, default=500)
+    p_screen.add_argument('--csv', help="結果輸出為 CSV")
+    p_screen.add_argument('--reanalyze', action='store_true', help="對選出的股票重新抓取並分析")
+    p_screen.add_argument('--token', default=os.environ.get('FINMIND_TOKEN', ''), help="FinMind Token (--reanalyze 時使用)")
+
+    sub.add_parser('screens', help="列出已保存的選股條件")
+
+    p_plan = sub.add_parser('plan', help="依發布行事曆列出需要更新的資料")
+    p_plan.add_argument('stocks', nargs='*', help="股票代號，預設為資料倉儲中所有分析過的股票")
+    p_plan.add_argument('--all', action='store_true', help="連同未到期的資料一併列出")
+
+    p_refresh = sub.add_parser('refresh', help="只重新分析有資料到期的股票")
+    p_refresh.add_argument('stocks', nargs='*', help="股票代號，預設為資料倉儲中所有分析過的股票")
+    p_refresh.add_argument('--token', default=os.environ.get('FINMIND_TOKEN', ''), help="FinMind Token")
+
+    p_check = sub.add_parser('check-dtypes', help="確認精簡型別不影響評分，並比較記憶體用量")
+    p_check.add_argument('stocks', nargs='*', help="股票代號，預設為資料倉儲中所有分析過的股票")
+
+    p_movers = sub.add_parser('movers', help="最新結果與前一次分析的比較 (分數異動、總評變化、價位穿越)")
+    p_movers.add_argument('stocks', nargs='*', help="股票代號，預設為資料倉儲中所有分析過的股票")
+    p_movers.add_argument('--top', type=int, default=10, help="分數上升 / 下降各列出幾檔")
+    p_movers.add_argument('--csv', help="逐檔比較結果輸出為 CSV")
+
+    p_archive = sub.add_parser('archive', help="歷史分析封存：列出封存、單檔歷史、以封存的輸入重現結果")
+    p_archive.add_argument('action', choices=['list', 'history', 'replay'])
+    p_archive.add_argument('targets', nargs='*', help="history：股票代號；replay：run_id 與股票代號")
+    p_archive.add_argument('--start', help="history 的起始日期 (YYYY-MM-DD)")
+    p_archive.add_argument('--end', help="history 的結束日期 (YYYY-MM-DD)")
+
+    args = parser.parse_args(argv)
+    warehouse = Warehouse(args.db)
+
+    if args.command == 'screens':
+        for name, where in load_screens().items():
+            print(f"{name}: {where}")
+        return 0
+
+    if args.command == 'check-dtypes':
+        stock_list = _split_codes(args.stocks) or warehouse.query('SELECT "股票代號" FROM scores')['股票代號'].tolist()
+        return 1 if check_dtypes(stock_list, warehouse) else 0
+
+    if args.command == 'movers':
+        from run_history import diff_latest, movers
+        start = time.perf_counter()
+        diff = diff_latest(warehouse, _split_codes(args.stocks) or None)
+        log(f"🔁 比較 {len(diff)} 檔股票 ({(time.perf_counter() - start) * 1000:.1f} ms)，其中 {int(diff['首次'].sum())} 檔沒有前次結果")
+        for title, df in movers(diff[~diff['首次']], top=args.top).items():
+            print(f"\n== {title} ({len(df)}) ==")
+            print(df.to_string(index=False) if not df.empty else "(無)")
+        if args.csv:
+            diff.to_csv(args.csv, index=False, encoding='utf-8-sig')
+            log(f"📥 已輸出：{args.csv}")
+        return 0
+
+    if args.command == 'archive':
+        return run_archive_command(args)
+
+    if args.command in ('plan', 'refresh'):
+        from scheduler import RefreshScheduler
+        stock_list = _split_codes(args.stocks) or warehouse.query('SELECT "股票代號" FROM scores')['股票代號'].tolist()
+        jobs = RefreshScheduler(warehouse).plan(stock_list)
+        due = jobs[jobs['due']]
+        if args.command == 'plan':
+            print((jobs if args.all else due).to_string(index=False))
+            log(f"🗓️ {len(stock_list)} 檔股票，共 {len(jobs)} 項資料，其中 {len(due)} 項需要更新")
+            return 0
+        targets = [s for s in stock_list if s in set(due['data_id'])]
+        if due['data_id'].isin(SHARED_DATA_IDS).any():
+            # 美債等共用資料到期時，估值需全部重算
+            targets = stock_list
+        log(f"🗓️ {len(targets)} / {len(stock_list)} 檔股票有資料到期，開始更新")
+        if targets:
+            run_analysis(targets, args.token, warehouse)
+        return 0
+
+    if args.command == 'analyze':
+        stock_list = _split_codes(args.stocks)
+        profiler = None
+        if args.profile:
+            from profiling import SamplingProfiler
+            profiler = SamplingProfiler().start()
+        try:
+            if args.workers > 1:
+                results = run_parallel_analysis(stock_list, args.token, warehouse, args.workers, scheduled=not args.force)
+            else:
+                results = run_analysis(stock_list, args.token, warehouse, scheduled=not args.force)
+        finally:
+            # 分析中斷 (例外、Ctrl+C) 時也停止取樣並輸出已取得的報告
+            if profiler is not None:
+                write_profile(profiler.stop(), args.profile)
+        if args.export and len(results):
+            from report_export import write_report
+            write_report(results, args.export, logger=log)
+            log(f"📑 報表已輸出：{args.export}")
+        return 0
+
+    # screen
+    if args.where:
+        where = args.where
+    else:
+        screens = load_screens()
+        if args.name not in screens:
+            parser.error(f"找不到選股條件：{args.name} (可用 `python batch.py screens` 查詢)")
+        where = screens[args.name]
+
+    start = time.perf_counter()
+    try:
+        df = run_screen(warehouse, where, order_by=args.order_by, limit=args.limit)
+    except (ValueError, sqlite3.Error, DatabaseError) as e:
+        # 條件不合法或 SQL 錯誤 (pandas 會把 sqlite3 的錯誤包成 DatabaseError)
+        log(f"❌ 查詢失敗: {str(e)}")
+        return 2
+    log(f"🔎 {where} → {len(df)} 檔 ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+    if args.csv:
+        df.to_csv(args.csv, index=False, encoding='utf-8-sig')
+        log(f"📥 已輸出：{args.csv}")
+    else:
+        print(df.to_string(index=False))
+
+    if args.reanalyze and not df.empty:
+        run_analysis(df['stock_id'].tolist(), args.token, warehouse)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
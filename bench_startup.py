@@ -0,0 +1,94 @@
+# bench_startup.py
+"""
+啟動效能量測
+- 冷啟動：全新 Python 程序中第一次執行 app.py 的耗時
+- rerun：同一個 session 內再次執行 app.py 的耗時
+- 重量級模組：首頁載入後是否已被匯入，以及各自的匯入成本
+
+用法：python bench_startup.py [--runs 3] [--reruns 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'xlsxwriter']
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.run()
+t2 = time.perf_counter()
+reruns = []
+for _ in range({reruns}):
+    s = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - s)
+print(json.dumps({{
+    "streamlit_import": t1 - t0,
+    "first_run": t2 - t1,
+    "reruns": reruns,
+    "exceptions": [e.message for e in at.exception],
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+IMPORT_SCRIPT = """
+import time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+"""
+
+
+def run_child(code):
+    out = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def ms(seconds):
+    return f"{seconds * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 app.py 冷啟動與 rerun 耗時")
+    parser.add_argument('--runs', type=int, default=3, help="冷啟動重複次數")
+    parser.add_argument('--reruns', type=int, default=10, help="每次冷啟動後的 rerun 次數")
+    args = parser.parse_args()
+
+    app = os.path.join(APP_DIR, 'app.py')
+    firsts, reruns, loaded, exceptions = [], [], set(), set()
+    for _ in range(args.runs):
+        res = json.loads(run_child(CHILD_SCRIPT.format(app=app, reruns=args.reruns, heavy=HEAVY_MODULES)))
+        firsts.append(res['first_run'])
+        reruns.extend(res['reruns'])
+        loaded.update(res['loaded'])
+        exceptions.update(res['exceptions'])
+
+    print("=" * 20 + " 啟動效能 " + "=" * 20)
+    print(f"冷啟動 (首次執行 app.py) 中位數 : {ms(statistics.median(firsts))}")
+    print(f"rerun 中位數                    : {ms(statistics.median(reruns))}")
+    print(f"rerun p95                       : {ms(sorted(reruns)[int(len(reruns) * 0.95) - 1])}")
+    print(f"首頁已載入的重量級模組          : {sorted(loaded) or '無'}")
+    if exceptions:
+        print(f"⚠️ 執行時發生例外 : {sorted(exceptions)}")
+
+    print("-" * 50)
+    print("各模組獨立匯入成本 (全新程序)：")
+    for module in HEAVY_MODULES + ['data']:
+        try:
+            cost = float(run_child(IMPORT_SCRIPT.format(module=module)))
+            print(f"  {module:<12}{ms(cost)}")
+        except subprocess.CalledProcessError:
+            print(f"  {module:<12}  未安裝")
+
+
+if __name__ == '__main__':
+    main()
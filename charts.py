@@ -0,0 +1,123 @@
+# charts.py
+"""
+歷史估值河流圖 (本益比 / 淨值比)
+- 本益比河流：便宜 / 合理 / 昂貴本益比 × 每日的近四季 EPS (股價 / PER)
+- 淨值比河流：低 / 中 / 高股價淨值比 × 每日的每股淨值 (股價 / PBR)
+- 倍數以與 strategy_valuation 相同的方式計算 (排除 <= 0、95% 縮尾後的平均 ± 1 倍標準差)，期間為圖上顯示的整段歷史
+- 在伺服器端以 LTTB (Largest-Triangle-Three-Buckets) 下採樣到固定點數再送到瀏覽器，
+  10~20 年的日資料也只傳送數百個點
+"""
+import numpy as np
+import pandas as pd
+
+from pe_sketch import CLIP_QUANTILE
+
+# 每檔股票送到前端的點數上限
+POINT_BUDGET = 600
+
+PE_LEVELS = ['便宜本益比', '合理本益比', '昂貴本益比']
+PB_LEVELS = ['低淨值比', '中淨值比', '高淨值比']
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 下採樣，回傳保留點的索引 (遞增)
+    首尾兩點一定保留，其餘每個區段保留與前一個保留點、下一個區段平均點構成最大三角形的點
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    idx = np.empty(n_out, dtype='int64')
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def _band(values):
+    """排除 <= 0 後 95% 縮尾的 (平均 - σ, 平均, 平均 + σ)"""
+    s = pd.Series(values)
+    s = s[s > 0]
+    if s.empty:
+        return None
+    s = s.clip(upper=s.quantile(CLIP_QUANTILE))
+    avg, std = s.mean(), s.std()
+    return avg - std, avg, avg + std
+
+
+def river_frame(df_price, df_val, budget=POINT_BUDGET):
+    """
+    df_price：日股價 (date, close)；df_val：日本益比/淨值比 (date, PER, PBR)
+    回傳 (下採樣後的寬表格, 倍數, 原始點數)
+    寬表格欄位：date、股價、各 PE/PB 倍數對應的價格；所有序列共用同一組取樣點，河流上下緣不會錯位
+    """
+    if df_price is None or df_val is None or df_price.empty or df_val.empty:
+        return pd.DataFrame(), {}, 0
+
+    price = df_price[['date', 'close']].assign(date=pd.to_datetime(df_price['date']))
+    val = df_val[['date', 'PER', 'PBR']].assign(date=pd.to_datetime(df_val['date']))
+    df = price.merge(val, on='date', how='inner').sort_values('date', ignore_index=True)
+    df = df.astype({'close': 'float64', 'PER': 'float64', 'PBR': 'float64'})
+    df = df[df['close'] > 0].reset_index(drop=True)
+    if df.empty:
+        return pd.DataFrame(), {}, 0
+
+    pe, pb = _band(df['PER']), _band(df['PBR'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eps = np.where(df['PER'] > 0, df['close'] / df['PER'], np.nan)
+        bvps = np.where(df['PBR'] > 0, df['close'] / df['PBR'], np.nan)
+
+    out = pd.DataFrame({'date': df['date'], '股價': df['close']})
+    multiples = {}
+    for levels, band, base in ((PE_LEVELS, pe, eps), (PB_LEVELS, pb, bvps)):
+        if band is None:
+            continue
+        for name, m in zip(levels, band):
+            multiples[name] = round(float(m), 2)
+            out[name] = (m * base).round(2)
+
+    # 取樣點以股價為主，再加上 EPS 的轉折 (季報公布造成的河流跳動)
+    t = df['date'].to_numpy(dtype='datetime64[D]').astype('float64')
+    idx = lttb(t, df['close'].to_numpy(), budget)
+    finite = np.isfinite(eps)
+    if finite.sum() > budget // 4:
+        idx = np.union1d(idx, np.nonzero(finite)[0][lttb(t[finite], eps[finite], budget // 4)])
+    return out.iloc[idx].reset_index(drop=True), multiples, len(df)
+
+
+def river_chart(df, levels, title, multiples=None):
+    """河流圖 (altair)：倍數之間以色帶填滿，疊上股價"""
+    import altair as alt
+
+    # 只送出這張圖用到的欄位；倍數線以 transform_fold 在瀏覽器端轉長表格，不重複傳送資料
+    # 欄位名稱維持 PE_LEVELS / PB_LEVELS (倍數含小數點，放進欄位名稱會被 Vega-Lite 當成巢狀欄位)，倍數只顯示在圖例
+    df = df[['date', '股價'] + levels]
+    label_expr = "datum.label"
+    for name in reversed(levels):
+        if multiples and name in multiples:
+            label_expr = f"datum.label == '{name}' ? '{name} {multiples[name]}x' : {label_expr}"
+
+    base = alt.Chart(df).encode(x=alt.X('date:T', title=None))
+    colors = ['#16a34a', '#f59e0b']
+    layers = []
+    for (lo, hi), color in zip(zip(levels[:-1], levels[1:]), colors):
+        layers.append(base.mark_area(opacity=0.25, color=color).encode(y=alt.Y(f'{lo}:Q', title='價格'), y2=f'{hi}:Q'))
+
+    layers.append(base.transform_fold(levels, as_=['倍數', '價格']).mark_line(strokeWidth=1, strokeDash=[4, 3]).encode(
+        y='價格:Q',
+        color=alt.Color('倍數:N', sort=levels, scale=alt.Scale(range=['#16a34a', '#6b7280', '#dc2626']),
+                        legend=alt.Legend(orient='top', labelExpr=label_expr)),
+    ))
+    layers.append(base.mark_line(color='black', strokeWidth=1.5).encode(
+        y='股價:Q', tooltip=[alt.Tooltip('date:T', title='日期'), alt.Tooltip('股價:Q', format='.2f')]))
+    return alt.layer(*layers).properties(title=title, height=300)
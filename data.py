@@ -1,22 +1,160 @@
 # data.py
+import os
+import threading
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-from FinMind.data import DataLoader
+from frame_dtypes import compact_frame
+from fundamentals_cube import BALANCE, INCOME, get_cube
+from http_client import get_transport
+from mem_cache import get_mem_cache
+from pe_sketch import PE_YEARS, get_sketch_store, window_start
+from scheduler import data_as_of
+from warehouse import taipei_now
+
+# FinMind v4 API 位址，可用環境變數指向本機的替身服務做測試
+FINMIND_API_URL = os.environ.get('FINMIND_API_URL', 'https://api.finmindtrade.com/api/v4/data')
+# 全市場即時報價快照 (贊助方案)，與資料 API 同一主機
+FINMIND_SNAPSHOT_URL = FINMIND_API_URL.rsplit('/', 1)[0] + '/taiwan_stock_tick_snapshot'
 
 class StockData:
-    def __init__(self, token):
-        self.dl = DataLoader()
-        self.dl.token = token
+    def __init__(self, token, warehouse=None, scheduler=None, compact=True):
+        # 直接呼叫 FinMind API，所有請求共用同一個連線池 (見 http_client.py)
+        self.token = token
+        self.http = get_transport()
+        # 有指定資料倉儲時，每次抓到的原始資料都寫入本機 SQLite (見 warehouse.py)
+        self.warehouse = warehouse
+        # 有指定排程器時，未到發布時間的資料直接讀取資料倉儲，不呼叫 API (見 scheduler.py)
+        self.scheduler = scheduler
+        self.fetch_stats = {'api': 0, 'cache': 0, 'memory': 0}
+        # 同一個程序中的所有客戶端共用記憶體快取 (見 mem_cache.py)
+        self.mem_cache = get_mem_cache()
+        # get_* 回傳的資料表改用精簡型別 (見 frame_dtypes.py)
+        self.compact = compact
+        # 財報以 股票 × 季度 × 科目 的陣列保存，同一個資料倉儲共用 (見 fundamentals_cube.py)
+        self.cube = get_cube(warehouse)
+        self._security_master = None
+        self._lock = threading.Lock()
+        # fetch_stats 會由流水線的資料集節點、API 服務的執行緒同時更新；與 _lock 分開 (抓取證券主檔時會持有 _lock)
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.fetch_stats[key] += 1
+
+    def _compact(self, df):
+        return compact_frame(df) if self.compact else df
+
+    def _fetch(self, dataset, data_id="", start_date="", end_date="", timeout=60):
+        """
+        先查程序內的記憶體快取，鍵為 (資料集, 代號, 起訖日, 資料時間版本)
+        同一版本內其他使用者已抓過的資料直接複製一份回傳，同時抓取同一筆資料時只抓一次
+        沒有排程器 (強制更新) 時不讀記憶體快取，但抓到的新資料仍會放入
+        """
+        as_of = data_as_of(dataset)
+        if as_of is None:
+            return self._fetch_source(dataset, data_id, start_date, end_date, timeout)
+        key = (dataset, data_id, start_date, end_date, as_of)
+        if self.scheduler is None:
+            df = self._fetch_source(dataset, data_id, start_date, end_date, timeout)
+            self.mem_cache.put(key, df)
+            return df
+
+        loaded = []
+
+        def load():
+            loaded.append(True)
+            return self._fetch_source(dataset, data_id, start_date, end_date, timeout)
+
+        df = self.mem_cache.get_or_load(key, load)
+        if not loaded:
+            self._count('memory')
+        return df
+
+    def _fetch_source(self, dataset, data_id="", start_date="", end_date="", timeout=60):
+        """
+        呼叫 FinMind 資料 API，回傳 DataFrame
+        資料未到更新時間時改讀資料倉儲中的快取
+        回應中沒有 data 欄位時 (額度用盡、token 錯誤等) 直接拋出錯誤訊息
+        """
+        if self.scheduler is not None and self.warehouse is not None:
+            try:
+                if not self.scheduler.is_due(dataset, data_id, start_date):
+                    df = self.warehouse.load_dataset(dataset, data_id=data_id, start_date=start_date)
+                    if end_date and 'date' in df.columns:
+                        df = df[df['date'] <= end_date].reset_index(drop=True)
+                    self._count('cache')
+                    return df
+            except Exception as e:
+                print(f"讀取資料倉儲失敗，改由 API 取得 ({dataset} {data_id}): {e}")
+
+        df = self._request(dataset, data_id, start_date, end_date, timeout)
+        if self.warehouse is not None:
+            try:
+                self.warehouse.save_dataset(dataset, df, data_id=data_id, start_date=start_date)
+            except Exception as e:
+                # 快取寫入失敗不影響本次分析
+                print(f"寫入資料倉儲失敗 ({dataset} {data_id}): {e}")
+        return df
+
+    def _request(self, dataset, data_id="", start_date="", end_date="", timeout=60):
+        """
+        直接呼叫 FinMind 資料 API，不經過快取與資料倉儲
+        回應中沒有 data 欄位時 (額度用盡、token 錯誤等) 直接拋出錯誤訊息
+        """
+        params = {"dataset": dataset}
+        if data_id: params["data_id"] = data_id
+        if start_date: params["start_date"] = start_date
+        if end_date: params["end_date"] = end_date
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else None
+
+        response = self.http.get(FINMIND_API_URL, params=params, headers=headers, timeout=timeout)
+        payload = response.json()
+        if "data" not in payload:
+            raise Exception(f"FinMind API 回應異常: {payload.get('msg') or payload}")
+        self._count('api')
+        return pd.DataFrame(payload["data"])
+
+    def _load_statement(self, dataset, stock_id, start_date):
+        """
+        把財報更新到立方體
+        未到發布時間、立方體已涵蓋起始日，且 fetch_log 沒有更新的抓取時 (其他程序共用同一個資料倉儲)，連資料倉儲都不必讀取
+        """
+        last, stale = None, False
+        if self.scheduler is not None:
+            try:
+                last = self.scheduler.last_fetch(dataset, stock_id)
+                if self.cube.covers(dataset, stock_id, start_date):
+                    stale = last is None or not self.cube.covers(dataset, stock_id, start_date, fetched_at=last)
+                    if not stale and not self.scheduler.is_due(dataset, stock_id, start_date):
+                        self._count('cache')
+                        return
+            except Exception as e:
+                print(f"讀取發布行事曆失敗，改由 API 取得 ({dataset} {stock_id}): {e}")
+        # 其他程序已抓到更新的報表時，記憶體快取中同一版本的資料也是舊的，直接從資料倉儲 / API 讀取
+        fetch = self._fetch_source if stale else self._fetch
+        df = fetch(dataset, data_id=stock_id, start_date=start_date)
+        self.cube.update(dataset, stock_id, df, start_date, fetched_at=last)
+
+    def get_security_master(self):
+        """
+        台股基本資料 (證券主檔)，每個客戶端只抓一次
+        以 stock_id 為索引，查詢單檔不需掃描整張表
+        """
+        if self._security_master is None:
+            with self._lock:
+                if self._security_master is None:
+                    df_info = self._fetch("TaiwanStockInfo")
+                    # 同一代號可能有多筆 (不同產業分類)，保留第一筆
+                    self._security_master = df_info.drop_duplicates('stock_id').set_index('stock_id')
+        return self._security_master
 
     def get_stock_info(self, stock_id):
         """取得股票名稱"""
         try:
-            # 抓取台灣股票基本資料
-            df_info = self.dl.taiwan_stock_info()
-            # 篩選出對應的代號
-            name = df_info[df_info['stock_id'] == stock_id]['stock_name'].values[0]
-            industry = df_info[df_info['stock_id'] == stock_id]['industry_category'].values[0]
+            # 從證券主檔查詢對應的代號
+            row = self.get_security_master().loc[stock_id]
+            name = row['stock_name']
+            industry = row['industry_category']
 
             return {
                 "name": name,
@@ -35,7 +173,9 @@ class StockData:
     def get_revenue(self, stock_id, start_date="2023-01-01"):
 
         # 1. 抓取資料
-        df = self.dl.taiwan_stock_month_revenue(stock_id=stock_id, start_date=start_date)
+        # 月營收資料集的 date 為公布月份 (營收月份的下個月)，起始日需往後推一個月
+        api_start = (pd.Period(start_date, 'M') + 1).start_time.strftime('%Y-%m-%d')
+        df = self._fetch("TaiwanStockMonthRevenue", data_id=stock_id, start_date=api_start)
         
         if df is None or len(df) < 24:
             return pd.DataFrame()
@@ -52,182 +192,63 @@ class StockData:
         #累計年增 
         df['Cum_YoY'] = (df['Cum_Rev'].pct_change(periods=12)).round(3)
         
-        return df
+        return self._compact(df)
     
     def get_profitability(self, stock_id, start_date="2022-01-01"):
         """
-        抓取季度損益表並計算毛利率、營業利益率
+        季度毛利率、營業利益率 (近八季)，由財報立方體切片計算
         """
         try:
-            # 1. 抓取綜合損益表資料
-            df = self.dl.taiwan_stock_financial_statement(
-                stock_id=stock_id, 
-                start_date=start_date
-            )
-            
-            if df.empty:
+            # 1. 更新綜合損益表
+            self._load_statement(INCOME, stock_id, start_date)
+
+            # 2. 取出各季的營收與利潤率 (毛利率 = 營業毛利 / 營業收入，營業利益率 = 營業利益 / 營業收入)
+            df = self.cube.quarterly(stock_id, ['Revenue', 'GPM', 'OPM'], start_date=start_date)
+            if df.empty or df['Revenue'].isna().all():
                 return pd.DataFrame()
 
-            # 2. 轉置表格
-            df_pivot = df.pivot_table(
-                index=['date', 'stock_id'], 
-                columns='type', 
-                values='value'
-            ).reset_index()
-
-            # 3. 計算獲利能力指標
-            # 毛利率 = 營業毛利 / 營業收入
-            if 'GrossProfit' in df_pivot.columns and 'Revenue' in df_pivot.columns:
-                df_pivot['GPM'] = (df_pivot['GrossProfit'] / df_pivot['Revenue']).round(4)
-
-            # 營業利益率 = 營業利益 / 營業收入
-            if 'OperatingIncome' in df_pivot.columns:
-                df_pivot['OPM'] = (df_pivot['OperatingIncome'] / df_pivot['Revenue']).round(4)
-            
-            # 4. 排序並過濾
-            df_pivot['date'] = pd.to_datetime(df_pivot['date'])
-            df_pivot = df_pivot.sort_values('date')
+            # 該科目完全沒有資料時不輸出對應欄位
+            df = df.dropna(axis=1, how='all')
+            df['date'] = pd.to_datetime(df['date'])
+            df.insert(1, 'stock_id', stock_id)
+            for c in ['GPM', 'OPM']:
+                if c in df.columns:
+                    df[c] = df[c].round(4)
 
-            # 5. 回傳近八季資料
+            # 3. 回傳近八季資料
             target_cols = ['date', 'stock_id', 'GPM', 'OPM']
-            existing_cols = [c for c in target_cols if c in df_pivot.columns]
-            
-            return df_pivot[existing_cols].tail(8)
-            
+            existing_cols = [c for c in target_cols if c in df.columns]
+
+            return self._compact(df[existing_cols].tail(8).reset_index(drop=True))
+
         except Exception as e:
             print(f"抓取獲利指標時發生錯誤: {e}")
             return pd.DataFrame()
         
     def get_shareholder_return(self, stock_id, start_date="2019-01-01", logger=None):
-
+        """
+        年度 EPS 與 ROE (歸屬母公司淨利 / 母公司業主權益)
+        當年未滿四季時年化推估；平均權益取 (去年Q4 + 今年各季) 的平均
+        計算在財報立方體上進行 (FundamentalsCube.annual)
+        """
         try:
             if logger: logger(f"    [Data] 正在從報表手動計算 {stock_id} 股東報酬率...")
 
-            # 損益表
-            df = self.dl.taiwan_stock_financial_statement(
-                stock_id=stock_id, 
-                start_date=start_date
-            )
-            #資產負債表
-            #取EquityAttributableToOwnersOfParent 歸屬於母公司業主之權益合計
-            df_bl = self.dl.taiwan_stock_balance_sheet(
-                stock_id=stock_id, 
-                start_date=start_date
-            )
-
-            # 表格轉置
-            df_pivot = df.pivot_table(
-                index=['date'], 
-                columns='type', 
-                values='value'
-            ).reset_index()
-
-            df_bl_pivot = df_bl.pivot_table(
-                index=['date'], 
-                columns='type', 
-                values='value'
-            ).reset_index()
-
-            df_all = pd.merge(df_pivot, df_bl_pivot, on='date', how='outer')
-            df_all['date'] = pd.to_datetime(df_all['date'])
-            df_all = df_all.sort_values('date')
-            df_all['year'] = df_all['date'].dt.year
-
-
-            # print(f"df_all 欄位清單: {df_all.columns.tolist()}")
-            # print(f"2. 筆資料內容 (最新一季):\n{df_all.iloc[-1].to_string()}")
-            # print(f"2. 筆資料內容 (最新一季):\n{df_all.iloc[-1]['EquityAttributableToOwnersOfParent_x']}")
-  
-            #稅後淨利
-            ni_col = "EquityAttributableToOwnersOfParent_x"
-
-            #歸屬於母公司業主之權益合計
-            eq_col = "EquityAttributableToOwnersOfParent_y"
- 
-            # --- 年度數據處理邏輯 ---
-            annual_list = []
-            years = sorted(df_all['year'].unique())
- 
-            for i, year in enumerate(years):
-                year_data = df_all[df_all['year'] == year].copy()
-                q_count = len(year_data) # 該年公佈了幾季
-                    
-                if q_count == 0: continue
-
-                # A. 取得該年「累計」淨利與 EPS (加總單季值)
-                raw_ni = year_data[ni_col].sum() if ni_col in year_data.columns else 0
-                raw_eps = year_data['EPS'].sum() if 'EPS' in year_data.columns else 0
-
-                #print(raw_ni)
-
-                # B. 年度化推估 (Extrapolation)
-                # 1季: *4, 2季: *2, 3季: *4/3, 4季: *1
-                factor = 4 / q_count if q_count > 0 else 0
-                projected_ni = raw_ni * factor
-                projected_eps = raw_eps * factor
-
-                # 取得今年所有已公佈季度的權益清單
-                curr_equities = year_data[eq_col].tolist() if eq_col in year_data.columns else [0]
-                
-                # 找尋去年的 Q4 (最後一季) 權益
-                prev_q4_equity = None
-                if i > 0:
-                    prev_year_data = df_all[df_all['year'] == years[i-1]]
-                    if not prev_year_data.empty:
-                        # 去年的最後一筆即為 Q4
-                        prev_q4_equity = prev_year_data.iloc[-1][eq_col] if eq_col in prev_year_data.columns else None
-
-                # 組成平均點位清單：[去年Q4, 今年Q1, 今年Q2, ...]
-                avg_points = []
-                if prev_q4_equity is not None:
-                    avg_points.append(prev_q4_equity)
-                avg_points.extend(curr_equities)
-
-                # 計算平均值
-                if len(avg_points) > 0:
-                    avg_equity = sum(avg_points) / len(avg_points)
-                else:
-                    avg_equity = curr_equities[0] if curr_equities else 0
-
-                # D. 計算 ROE
-                roe = (projected_ni / avg_equity) if avg_equity != 0 else 0
-
-                # 取得該年最後一季的資料作為記錄
-                latest_row = year_data.iloc[-1]
-
-                annual_list.append({
-                    'year': year,
-                    'stock_id': stock_id,
-                    'ROE': roe,
-                    'EPS': round(projected_eps, 2),
-                    'date': latest_row['date'],
-                    'q_count': q_count,
-                    'avg_points_used': len(avg_points), # 記錄用了幾個點平均
-                    'is_projected': q_count < 4
-                })
-
-            annual_data = pd.DataFrame(annual_list)
+            # 損益表、資產負債表
+            self._load_statement(INCOME, stock_id, start_date)
+            self._load_statement(BALANCE, stock_id, start_date)
+            for dataset in (INCOME, BALANCE):
+                if self.cube.quarterly(stock_id, [], dataset=dataset, start_date=start_date).empty:
+                    raise ValueError(f"缺少 {dataset} 資料")
+
+            annual_data = self.cube.annual([stock_id], start_date=start_date)
 
             print("\n" + "="*20 + f" [ROE 多點平均對帳: {stock_id}] " + "="*20)
             print(f"計算邏輯：(去年Q4 + 今年各季) / 總點數")
             print(annual_data.to_string(index=False))
             print("="*60 + "\n")
 
-            return annual_data
-        
-        
-            #print(len(df_pivot))
-
-            #EquityAttributableToOwnersOfParent 稅後淨利
-            #print(f"2. 筆資料內容 (最新一季):\n{df_pivot.iloc[-1].to_string()}")
-            #print(f"2. :{df_pivot["EquityAttributableToOwnersOfParent"].iloc[-1]}")
-
-
-
-            #print(f"df_pivot 欄位清單: {df_bl_pivot.columns.tolist()}")
-            #print(len(df_bl_pivot))
-            #print(f"2. 最後一筆資料內容 (最新一季):\n{df_bl_pivot.iloc[-1].to_string()}")
-
+            return self._compact(annual_data)
 
         except Exception as e:
             if logger: logger(f"    [Data] ❌ 手動計算 ROE 失敗: {str(e)}")
@@ -242,10 +263,7 @@ class StockData:
         try:
             start_date = (datetime.now() - timedelta(days=years*365)).strftime('%Y-%m-%d')
             
-            df = self.dl.taiwan_stock_per_pbr(
-                stock_id=stock_id, 
-                start_date=start_date
-            )
+            df = self._fetch("TaiwanStockPER", data_id=stock_id, start_date=start_date)
 
             if df.empty: return pd.DataFrame()
             
@@ -255,12 +273,35 @@ class StockData:
                     df[c] = pd.to_numeric(df[c], errors='coerce')
             
             df['date'] = pd.to_datetime(df['date'])
-            return df.sort_values('date')
+            return self._compact(df.sort_values('date'))
             
         except Exception as e:
             if logger: logger(f"    [Data] ❌ 估價數據抓取失敗: {str(e)}")
             return pd.DataFrame()
 
+    def get_pe_band(self, stock_id, years=PE_YEARS, logger=None):
+        """
+        近 N 年本益比區間 (見 pe_sketch.py)
+        只抓取上次更新後的新交易日，再移除超出窗口的舊資料，不重新讀取 N 年的日資料
+        """
+        try:
+            store = get_sketch_store(self.warehouse)
+            sketch = store.get(stock_id)
+            start = window_start(years)
+            fetch_start = start
+            if sketch.last_date is not None:
+                fetch_start = max(start, (pd.Timestamp(sketch.last_date) + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+            df = self._fetch("TaiwanStockPER", data_id=stock_id, start_date=fetch_start)
+            for c in ('PER', 'PBR'):
+                if c in df.columns:
+                    df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
+            return store.update(stock_id, df, start)
+
+        except Exception as e:
+            if logger: logger(f"    [Data] ❌ 本益比區間更新失敗: {str(e)}")
+            return None
+
     def get_latest_price(self, stock_id, logger=None):
         """
         抓取最新收盤價 (TaiwanStockPrice)
@@ -268,10 +309,7 @@ class StockData:
         try:
 
             start_date = (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d')
-            df = self.dl.taiwan_stock_daily(
-                stock_id=stock_id, 
-                start_date=start_date
-            )
+            df = self._fetch("TaiwanStockPrice", data_id=stock_id, start_date=start_date)
             
             if not df.empty:
                 latest = df.iloc[-1]
@@ -284,6 +322,59 @@ class StockData:
         except:
             return None
 
+    def get_price_history(self, stock_id, years=5, logger=None):
+        """
+        抓取過去 N 年的日收盤價 (TaiwanStockPrice)，回傳 date、close
+        """
+        try:
+            start_date = (datetime.now() - timedelta(days=years*365)).strftime('%Y-%m-%d')
+            df = self._fetch("TaiwanStockPrice", data_id=stock_id, start_date=start_date)
+            if df.empty: return pd.DataFrame()
+
+            df = df[['date', 'close']].copy()
+            df['close'] = pd.to_numeric(df['close'], errors='coerce')
+            df['date'] = pd.to_datetime(df['date'])
+            return df.sort_values('date', ignore_index=True)
+        except Exception as e:
+            if logger: logger(f"    [Data] ❌ 歷史股價抓取失敗: {str(e)}")
+            return pd.DataFrame()
+
+    def get_price_snapshot(self, days=7, logger=None):
+        """
+        全市場最新價格，一次請求取得所有股票 (stock_id, date, close)
+        先取即時報價快照；沒有權限或失敗時改抓最近一個交易日的全市場日收盤價
+        (TaiwanStockPrice 不指定代號)，最多回溯 days 天
+        全市場資料不經過資料倉儲：raw_TaiwanStockPrice 依代號存放，整表寫入會覆蓋各股的日資料
+        改用日收盤價時只有收盤資料公布後 (約 13:30 後) 才會更新，回傳的 df.attrs['end_of_day'] 為 True
+        """
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else None
+            response = self.http.get(FINMIND_SNAPSHOT_URL, headers=headers, timeout=30)
+            payload = response.json()
+            if not payload.get("data"):
+                raise Exception(payload.get('msg') or "無資料")
+            self._count('api')
+            df = pd.DataFrame(payload["data"])
+            df['close'] = pd.to_numeric(df['close'], errors='coerce')
+            return df[['stock_id', 'date', 'close']]
+        except Exception as e:
+            if logger: logger(f"    [Data] ⚠️ 即時報價快照無法取得 ({str(e)})，改用日收盤價 (收盤後才更新，盤中看不到價格變動)")
+
+        try:
+            today = taipei_now()
+            for back in range(days):
+                day = (today - timedelta(days=back)).strftime('%Y-%m-%d')
+                df = self._request("TaiwanStockPrice", start_date=day, end_date=day)
+                if not df.empty:
+                    df['close'] = pd.to_numeric(df['close'], errors='coerce')
+                    df = df[['stock_id', 'date', 'close']].drop_duplicates('stock_id', keep='last')
+                    df.attrs['end_of_day'] = True
+                    return df
+            return pd.DataFrame()
+        except Exception as e:
+            if logger: logger(f"    [Data] ❌ 全市場收盤價抓取失敗: {str(e)}")
+            return pd.DataFrame()
+
     def get_us_bond_yield(self, logger=None):
         """
         抓取 10 年期美債殖利率 (USGovernmentBondYield)
@@ -291,11 +382,7 @@ class StockData:
 
         try:
             start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-            df = self.dl.get_data(
-                dataset="GovernmentBondsYield",
-                data_id="United States 10-Year",
-                start_date=start_date
-            )
+            df = self._fetch("GovernmentBondsYield", data_id="United States 10-Year", start_date=start_date)
                         
 
             if not df.empty:
@@ -310,18 +397,17 @@ class StockData:
         except:
             return 4.0
         
-    def get_stock_news(self, stock_id, days=90, logger=None):
+    def get_stock_news(self, stock_id, days=90, logger=None, start_date=None):
         """
         抓取個股新聞數據
+        start_date：指定起始日 (增量匯入時使用)，未指定則回溯 days 天
+        抓取失敗 (額度用盡、網路錯誤等) 時回傳 None，與「沒有新聞」區分
         """
         try:
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            start_date = start_date or (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
             if logger: logger(f"📡 正在從 FinMind 獲取 {stock_id} 新聞 (自 {start_date})...")
             
-            df = self.dl.taiwan_stock_news(
-                stock_id=stock_id,
-                start_date=start_date
-            )
+            df = self._fetch("TaiwanStockNews", data_id=stock_id, start_date=start_date)
             
             if not df.empty:
                 df['date'] = pd.to_datetime(df['date'])
@@ -329,4 +415,4 @@ class StockData:
             return pd.DataFrame()
         except Exception as e:
             if logger: logger(f"⚠️ 新聞抓取異常: {str(e)}")
-            return pd.DataFrame()
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -0,0 +1,73 @@
+# frame_dtypes.py
+"""
+StockData 各資料表的精簡型別
+- 代號、報表科目、產業等重複字串 → category
+- 比率欄 (本益比、毛利率、年增率…) 在來源或計算時已四捨五入到固定小數位，
+  float32 還原後再四捨五入可得到完全相同的 float64 值，才改存 float32
+- 年、月、季數等小整數 → 最小的整數型別
+- 日期一律為 datetime64，不保留字串
+
+策略計算前以 widen_frame 還原成 float64 / int64，評分結果與原始型別完全相同
+"""
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLS = {'stock_id', 'type', 'origin_name', 'industry', 'industry_category', 'country', 'name'}
+
+# 比率欄與其小數位數
+RATIO_DECIMALS = {
+    'PER': 2, 'PBR': 2, 'dividend_yield': 2,
+    'GPM': 4, 'OPM': 4,
+    'Mon_YoY': 3, 'Cum_YoY': 3,
+}
+
+SMALL_INT_COLS = {'revenue_year', 'revenue_month', 'year', 'q_count', 'avg_points_used'}
+
+
+def _float32_exact(s, decimals):
+    """float32 還原後四捨五入是否與原值相同 (缺值視為相同)"""
+    values = s.to_numpy(dtype='float64')
+    back = values.astype('float32').astype('float64').round(decimals)
+    return np.array_equal(back, values.round(decimals), equal_nan=True) and np.array_equal(
+        values.round(decimals), values, equal_nan=True)
+
+
+def compact_frame(df):
+    """回傳精簡型別的新 DataFrame (不修改原表)；無法無損轉換的欄位維持原型別"""
+    if df is None or df.empty:
+        return df
+    df = df.copy(deep=False)
+    for col in df.columns:
+        s = df[col]
+        if col in CATEGORY_COLS and s.dtype == object:
+            df[col] = s.astype('category')
+        elif col == 'date' and s.dtype == object:
+            df[col] = pd.to_datetime(s, errors='coerce')
+        elif col in RATIO_DECIMALS and s.dtype == 'float64' and _float32_exact(s, RATIO_DECIMALS[col]):
+            df[col] = s.astype('float32')
+        elif col in SMALL_INT_COLS and s.dtype.kind in 'iu':
+            df[col] = pd.to_numeric(s, downcast='integer')
+    return df
+
+
+def widen_frame(df):
+    """把 compact_frame 縮小的數值欄還原成 float64 / int64 (比率欄依小數位數還原為原值)"""
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return df
+    narrow = [c for c in df.columns if df[c].dtype == 'float32' or (c in SMALL_INT_COLS and df[c].dtype.kind in 'iu' and df[c].dtype.itemsize < 8)]
+    if not narrow:
+        return df
+    df = df.copy(deep=False)
+    for col in narrow:
+        if df[col].dtype == 'float32':
+            df[col] = df[col].astype('float64').round(RATIO_DECIMALS.get(col, 6))
+        else:
+            df[col] = df[col].astype('int64')
+    return df
+
+
+def frame_nbytes(df):
+    """DataFrame 實際佔用的記憶體 (含字串物件)"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True, index=True).sum())
@@ -0,0 +1,274 @@
+# fundamentals_cube.py
+"""
+財報資料立方體：股票 × 季度 × 科目 的 NumPy 陣列 (float64)，以標籤索引定位
+- 損益表、資產負債表的長表格 (date, stock_id, type, value) 直接散佈 (scatter) 到陣列，不需 pivot_table
+- 啟動時從資料倉儲的原始資料表一次建立，之後每次抓到新報表只替換該股票在起始日之後的切片
+  (與 Warehouse.save_dataset 的替換規則相同)
+- 毛利率、營益率、EPS、年度 ROE 等序列對任意股票集合都是陣列切片與向量運算
+
+兩張報表都有 EquityAttributableToOwnersOfParent (損益表為歸屬母公司淨利、資產負債表為母公司業主權益)，
+立方體中分別命名為 NetIncome 與 Equity
+"""
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+INCOME = 'TaiwanStockFinancialStatements'
+BALANCE = 'TaiwanStockBalanceSheet'
+DATASETS = [INCOME, BALANCE]
+
+# 科目名稱 → (資料集, FinMind type)
+CUBE_ITEMS = {
+    'Revenue': (INCOME, 'Revenue'),
+    'GrossProfit': (INCOME, 'GrossProfit'),
+    'OperatingIncome': (INCOME, 'OperatingIncome'),
+    'EPS': (INCOME, 'EPS'),
+    'NetIncome': (INCOME, 'EquityAttributableToOwnersOfParent'),
+    'Equity': (BALANCE, 'EquityAttributableToOwnersOfParent'),
+}
+
+# 衍生比率：名稱 → (分子, 分母)
+RATIOS = {
+    'GPM': ('GrossProfit', 'Revenue'),
+    'OPM': ('OperatingIncome', 'Revenue'),
+}
+
+
+class FundamentalsCube:
+    """
+    values[股票, 季度, 科目]：沒有資料為 NaN
+    present[股票, 季度, 資料集]：該季是否有這份報表 (對應原本 pivot 後的列)
+    coverage[(資料集, 股票)]：立方體中已載入的最早起始日
+    fetched[(資料集, 股票)]：載入時 fetch_log 的最後抓取時間；其他程序抓到新報表後兩者不同，需重新載入
+    """
+
+    def __init__(self):
+        self.items = list(CUBE_ITEMS)
+        self.stock_ids = []
+        self.quarters = []
+        self.values = np.full((0, 0, len(self.items)), np.nan)
+        self.present = np.zeros((0, 0, len(DATASETS)), dtype=bool)
+        self.coverage = {}
+        self.fetched = {}
+        self._stock_pos = {}
+        self._quarter_pos = {}
+        self._dataset_items = {
+            d: (pd.Index([t for ds, t in CUBE_ITEMS.values() if ds == d]),
+                np.array([i for i, (ds, _) in enumerate(CUBE_ITEMS.values()) if ds == d]))
+            for d in DATASETS
+        }
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_warehouse(cls, warehouse):
+        """從資料倉儲的原始報表一次建立 (每個資料集一次查詢)"""
+        cube = cls()
+        for dataset in DATASETS:
+            types, _ = cube._dataset_items[dataset]
+            marks = ', '.join('?' * len(types))
+            try:
+                # 先讀抓取紀錄再讀報表：兩次查詢之間有新的抓取時，紀錄的時間較舊，下次使用會重新載入
+                starts = warehouse.query(
+                    "SELECT data_id, MIN(start_date) AS start_date, MAX(fetched_at) AS fetched_at FROM fetch_log "
+                    "WHERE dataset = ? AND data_id != '' GROUP BY data_id", (dataset,))
+                df = warehouse.query(
+                    f'SELECT stock_id, date, type, value FROM "raw_{dataset}" WHERE type IN ({marks})', tuple(types))
+            except Exception:
+                continue
+            with cube._lock:
+                cube._scatter(dataset, df)
+                for sid, start, fetched in zip(starts['data_id'], starts['start_date'], starts['fetched_at']):
+                    cube.coverage[(dataset, str(sid))] = start or ""
+                    cube.fetched[(dataset, str(sid))] = datetime.fromisoformat(fetched) if fetched else None
+        return cube
+
+    # ---------- 標籤索引 ----------
+
+    def _ensure(self, stock_ids, quarters):
+        """補上新的股票與季度；季度維持排序 (新季度一年只出現幾次，重排整個陣列的成本可忽略)"""
+        new_q = sorted(set(quarters) - self._quarter_pos.keys())
+        if new_q:
+            old = self.quarters
+            self.quarters = sorted(old + new_q)
+            self._quarter_pos = {q: i for i, q in enumerate(self.quarters)}
+            idx = np.array([self._quarter_pos[q] for q in old], dtype='int64')
+            values = np.full((self.values.shape[0], len(self.quarters), len(self.items)), np.nan)
+            present = np.zeros((self.values.shape[0], len(self.quarters), len(DATASETS)), dtype=bool)
+            values[:, idx] = self.values
+            present[:, idx] = self.present
+            self.values, self.present = values, present
+
+        new_s = [s for s in dict.fromkeys(stock_ids) if s not in self._stock_pos]
+        if new_s:
+            for s in new_s:
+                self._stock_pos[s] = len(self.stock_ids)
+                self.stock_ids.append(s)
+            n = len(self.stock_ids)
+            if n > self.values.shape[0]:
+                # 股票軸以倍增方式預留空間
+                cap = max(n, self.values.shape[0] * 2, 64)
+                values = np.full((cap, len(self.quarters), len(self.items)), np.nan)
+                present = np.zeros((cap, len(self.quarters), len(DATASETS)), dtype=bool)
+                values[:self.values.shape[0]] = self.values
+                present[:self.present.shape[0]] = self.present
+                self.values, self.present = values, present
+
+    def _scatter(self, dataset, df):
+        if df.empty:
+            return
+        types, item_idx = self._dataset_items[dataset]
+        pos = types.get_indexer(df['type'])
+        df = df[pos >= 0]
+        item = item_idx[pos[pos >= 0]]
+        stock = df['stock_id'].astype(str).to_numpy()
+        date = df['date'].astype(str).str[:10].to_numpy()
+        self._ensure(stock, date)
+
+        s = np.fromiter((self._stock_pos[x] for x in stock), dtype='int64', count=len(stock))
+        q = np.fromiter((self._quarter_pos[x] for x in date), dtype='int64', count=len(date))
+        self.values[s, q, item] = pd.to_numeric(df['value'], errors='coerce').to_numpy(dtype='float64')
+        self.present[s, q, DATASETS.index(dataset)] = True
+
+    def update(self, dataset, stock_id, df, start_date="", fetched_at=None):
+        """
+        以一次抓取的報表 (長表格) 替換該股票 start_date 之後的資料
+        fetched_at：讀取報表前 fetch_log 的最後抓取時間
+        """
+        with self._lock:
+            self._ensure([stock_id], [])
+            s = self._stock_pos[stock_id]
+            q0 = np.searchsorted(self.quarters, start_date[:10]) if start_date else 0
+            _, item_idx = self._dataset_items[dataset]
+            self.values[s, q0:, item_idx] = np.nan
+            self.present[s, q0:, DATASETS.index(dataset)] = False
+            if not df.empty:
+                self._scatter(dataset, df.assign(stock_id=stock_id))
+            key = (dataset, stock_id)
+            self.coverage[key] = min(self.coverage.get(key, start_date), start_date)
+            self.fetched[key] = fetched_at
+
+    def covers(self, dataset, stock_id, start_date="", fetched_at=None):
+        """已涵蓋起始日；有指定 fetched_at 時還需與載入時的最後抓取時間相同 (沒有其他程序抓到更新的報表)"""
+        with self._lock:
+            key = (dataset, stock_id)
+            start = self.coverage.get(key)
+            if start is None or start > start_date:
+                return False
+            return fetched_at is None or self.fetched.get(key) == fetched_at
+
+    # ---------- 切片 ----------
+
+    def _slice(self, stock_ids, start_date=""):
+        """(股票位置, 季度位置, 季度標籤)；不在立方體中的股票位置為 -1"""
+        s = np.array([self._stock_pos.get(x, -1) for x in stock_ids], dtype='int64')
+        q0 = np.searchsorted(self.quarters, start_date[:10]) if start_date else 0
+        return s, q0, self.quarters[q0:]
+
+    def series(self, stock_ids, name, start_date=""):
+        """
+        一組股票的科目或比率 (GPM/OPM) 序列，回傳 (陣列 (股票, 季度), 季度標籤)
+        沒有資料的格子為 NaN
+        """
+        with self._lock:
+            s, q0, quarters = self._slice(stock_ids, start_date)
+            block = self.values[s, q0:]
+            if name in RATIOS:
+                num, den = RATIOS[name]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    out = block[:, :, self.items.index(num)] / block[:, :, self.items.index(den)]
+            else:
+                out = block[:, :, self.items.index(name)]
+            out[s < 0] = np.nan
+            return out, quarters
+
+    def quarterly(self, stock_id, names, dataset=INCOME, start_date=""):
+        """單一股票有 dataset 報表的各季資料 (date, 各科目/比率)，取代 pivot_table 的結果"""
+        with self._lock:
+            if stock_id not in self._stock_pos:
+                return pd.DataFrame()
+            s, q0, quarters = self._slice([stock_id], start_date)
+            rows = self.present[s[0], q0:, DATASETS.index(dataset)]
+            out = pd.DataFrame({'date': np.asarray(quarters, dtype=object)[rows]})
+            for name in names:
+                out[name] = self.series([stock_id], name, start_date)[0][0][rows]
+            return out
+
+    def annual(self, stock_ids, start_date=""):
+        """
+        年度 EPS 與 ROE (與 StockData.get_shareholder_return 原本的逐年計算相同)：
+        - 季度為任一報表有資料的季度；未滿四季以 4 / 季數 年化
+        - ROE = 年化淨利 / 平均權益，平均權益取 [去年最後一季, 今年各季] 的權益
+        回傳長表格 (stock_id, year, ROE, EPS, date, q_count, avg_points_used, is_projected)
+        逐年迴圈 (年數很少)，每一年對所有股票同時計算
+        """
+        with self._lock:
+            s, q0, quarters = self._slice(stock_ids, start_date)
+            keep = s >= 0
+            s, ids = s[keep], np.asarray(stock_ids, dtype=object)[keep]
+            present = self.present[s, q0:].any(axis=2)
+            block = self.values[s, q0:]
+            ni = block[:, :, self.items.index('NetIncome')]
+            eps = block[:, :, self.items.index('EPS')]
+            eq = block[:, :, self.items.index('Equity')]
+
+        years = np.array([int(q[:4]) for q in quarters], dtype='int64')
+        n = len(s)
+        prev_eq = np.full(n, np.nan)
+        has_prev = np.zeros(n, dtype=bool)
+        uniq = np.unique(years)
+        out = {k: np.zeros((n, len(uniq)), dtype=t) for k, t in
+               [('ROE', 'float64'), ('EPS', 'float64'), ('q_count', 'int64'), ('points', 'int64'), ('last_q', 'int64')]}
+        for k, year in enumerate(uniq):
+            cols = np.nonzero(years == year)[0]
+            q_count = present[:, cols].sum(axis=1)
+            raw_ni, raw_eps = np.zeros(n), np.zeros(n)
+            eq_sum = np.where(has_prev, prev_eq, 0.0)
+            last_q = np.full(n, -1)
+            # 依季度順序逐一累加 (與原本 Python sum 的加總順序相同，結果逐位元一致)
+            for c in cols:
+                p = present[:, c]
+                raw_ni = np.where(p & ~np.isnan(ni[:, c]), raw_ni + ni[:, c], raw_ni)
+                raw_eps = np.where(p & ~np.isnan(eps[:, c]), raw_eps + eps[:, c], raw_eps)
+                eq_sum = np.where(p, eq_sum + eq[:, c], eq_sum)
+                last_q = np.where(p, c, last_q)
+
+            rows = q_count > 0
+            factor = 4 / np.where(rows, q_count, 1)
+            points = q_count + has_prev
+            avg_eq = eq_sum / np.where(points > 0, points, 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out['ROE'][:, k] = np.where(avg_eq != 0, raw_ni * factor / avg_eq, 0.0)
+            out['EPS'][:, k] = np.round(raw_eps * factor, 2)
+            out['q_count'][:, k] = q_count
+            out['points'][:, k] = points
+            out['last_q'][:, k] = last_q
+
+            prev_eq = np.where(rows, eq[np.arange(n), last_q], prev_eq)
+            has_prev |= rows
+
+        # (股票, 年) 依列展開，順序即為 股票 → 年度
+        mask = out['q_count'] > 0
+        si, yi = np.nonzero(mask)
+        return pd.DataFrame({
+            'year': uniq[yi], 'stock_id': ids[si], 'ROE': out['ROE'][mask],
+            'EPS': out['EPS'][mask],
+            'date': pd.to_datetime(np.asarray(quarters, dtype=object)[out['last_q'][mask]]) if mask.any() else pd.to_datetime([]),
+            'q_count': out['q_count'][mask], 'avg_points_used': out['points'][mask],
+            'is_projected': out['q_count'][mask] < 4,
+        })
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def get_cube(warehouse=None):
+    """同一個資料倉儲共用一個立方體 (第一次使用時從原始資料表建立)；沒有資料倉儲時每次建立新的空立方體"""
+    if warehouse is None:
+        return FundamentalsCube()
+    with _cubes_lock:
+        if warehouse.path not in _cubes:
+            _cubes[warehouse.path] = FundamentalsCube.from_warehouse(warehouse)
+        return _cubes[warehouse.path]
@@ -0,0 +1,122 @@
+# http_client.py
+"""
+共用 HTTP 傳輸層：FinMind 與 Gemini 的請求都經由同一個連線池，
+以 keep-alive 重用 TLS 連線，避免每次請求都重新握手
+
+環境變數：
+- HTTP_POOL_CONNECTIONS：保留連線池的主機數 (預設 8)
+- HTTP_POOL_MAXSIZE：每個主機的最大連線數 (預設 32)
+- HTTP2=1：改用 httpx 的 HTTP/2 (需安裝 httpx[http2]，未安裝時退回 requests)
+"""
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 8))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 32))
+USE_HTTP2 = os.environ.get('HTTP2', '0') == '1'
+
+
+class HttpTransport:
+    """
+    以連線池發送請求，並記錄每個主機的請求數與新建連線數
+    GET 遇到連線錯誤或 502/503/504 會自動重試，POST 不重試 (避免重複送出 AI 請求)
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, http2=USE_HTTP2, retries=3):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._streams = defaultdict(set)
+        self.http2 = False
+
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=pool_maxsize * pool_connections, max_keepalive_connections=pool_maxsize),
+                    transport=httpx.HTTPTransport(http2=True, retries=retries),
+                )
+                self.http2 = True
+                return
+            except ImportError:
+                pass
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry, pool_block=True)
+        self._client = requests.Session()
+        self._client.mount('https://', adapter)
+        self._client.mount('http://', adapter)
+        self._adapter = adapter
+
+    def _count(self, url, response):
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._requests[host] += 1
+            # httpx 可由 network_stream 辨識是否為同一條連線
+            stream = getattr(response, 'extensions', {}).get('network_stream')
+            if stream is not None:
+                self._streams[host].add(id(stream))
+
+    def get(self, url, params=None, headers=None, timeout=60):
+        response = self._client.get(url, params=params, headers=headers, timeout=timeout)
+        self._count(url, response)
+        return response
+
+    def post(self, url, json=None, headers=None, timeout=60):
+        response = self._client.post(url, json=json, headers=headers, timeout=timeout)
+        self._count(url, response)
+        return response
+
+    def _new_connections(self):
+        """每個主機實際建立過的連線數"""
+        if self.http2:
+            return {host: len(ids) for host, ids in self._streams.items()}
+        counts = defaultdict(int)
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            counts[host] += pool.num_connections
+        return counts
+
+    def stats(self):
+        """
+        各主機連線重用統計
+        回傳 {host: {'requests', 'connections', 'reused', 'reuse_ratio'}}
+        """
+        with self._lock:
+            conns = self._new_connections()
+            out = {}
+            for host, n in self._requests.items():
+                c = conns.get(host, 0)
+                reused = max(n - c, 0)
+                out[host] = {
+                    'requests': n,
+                    'connections': c,
+                    'reused': reused,
+                    'reuse_ratio': round(reused / n, 3) if n else 0.0,
+                }
+            return out
+
+    def close(self):
+        self._client.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """整個程序共用的傳輸層 (第一次使用時建立)"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
@@ -0,0 +1,63 @@
+# leaderboard.py
+import pandas as pd
+
+# 排行榜需要的欄位 (皆為結果表中固定型別的欄位)
+BOARD_COLS = ['股票代號', '股票名稱', '產業別', 'MasterScore', '目前股價', '目標價', '便宜價', '合理價', '昂貴價', '最終總評']
+RENAME_MAP = {'MasterScore': '綜合評分', '最終總評': '分析評語', '目標價': '實力保底價'}
+
+# 可供排序的欄位 (皆為預先計算好的數值欄)
+SORTABLE_COLS = ['實力保底價', '綜合評分', '保底潛在空間', '目前股價', '便宜價', '合理價', '昂貴價']
+
+
+def build_leaderboard(result_set, ranks=None):
+    """
+    由結果表的欄式陣列組出排行榜，只在結果表版本變動時建立一次
+    保底潛在空間 以數值保存，格式化交給顯示層，排序才不會變成字串排序
+    ranks：ranking.compute_industry_ranks 的結果；有提供時改以產業相對分作為綜合評分
+    """
+    return leaderboard_frame(result_set.frame(BOARD_COLS), ranks=ranks)
+
+
+def leaderboard_frame(df, ranks=None):
+    """以已取出 BOARD_COLS 欄位的 DataFrame (結果表或資料倉儲 scores 表) 組出排行榜"""
+    df = df[BOARD_COLS].copy()
+    df['股票'] = df['股票名稱'].astype(str) + " (" + df['股票代號'].astype(str) + ")"
+
+    # 計算公式：(目標價 / 目前股價 - 1) * 100
+    price = df['目前股價'].where(df['目前股價'] > 0)
+    df['保底潛在空間'] = ((df['目標價'] / price - 1) * 100).round(1)
+
+    if ranks is not None:
+        aligned = ranks.reindex(df['股票代號'].astype(str))
+        df['MasterScore'] = aligned['產業相對分'].to_numpy()
+        df.insert(df.columns.get_loc('MasterScore') + 1, '產業排名', aligned['產業排名'].to_numpy())
+
+    return df.drop(columns=['股票名稱']).rename(columns=RENAME_MAP)
+
+
+def filter_leaderboard(df, industries=None, min_score=None, keyword=""):
+    """依產業、分數門檻與關鍵字篩選排行榜"""
+    mask = pd.Series(True, index=df.index)
+
+    if industries:
+        mask &= df['產業別'].isin(industries)
+    if min_score:
+        mask &= df['綜合評分'] >= min_score
+    if keyword:
+        mask &= df['股票'].str.contains(keyword, case=False, regex=False, na=False)
+
+    return df[mask]
+
+
+def page_leaderboard(view, sort_by='實力保底價', ascending=False, page=1, page_size=50):
+    """排序後只回傳當頁資料"""
+    if sort_by in view.columns:
+        # 只需要前 N 名時用 nlargest/nsmallest，避免整表排序
+        n = page * page_size
+        if n < view[sort_by].count():
+            view = view.nsmallest(n, sort_by) if ascending else view.nlargest(n, sort_by)
+        else:
+            view = view.sort_values(sort_by, ascending=ascending, na_position='last')
+
+    start = (page - 1) * page_size
+    return view.iloc[start:start + page_size]
@@ -0,0 +1,154 @@
+# mem_cache.py
+"""
+程序內共用的記憶體快取 (資料倉儲之上的一層)
+- 同一個程序中的所有使用者 (各自的 session_state)、執行緒共用，熱門股票直接由記憶體取得
+- 以實際佔用的位元組 (DataFrame.memory_usage(deep=True)) 計算，超過上限時淘汰最久未使用的項目 (LRU)
+- 同一個鍵同時有多個請求時只載入一次，其餘請求等待同一個結果
+- 取出與放入時都複製 DataFrame，呼叫端修改資料不會影響快取內容
+- 統計命中率、淘汰次數與目前用量
+
+上限以環境變數 MEM_CACHE_MB 設定 (預設 256 MB)
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+MEM_CACHE_BYTES = int(float(os.environ.get('MEM_CACHE_MB', 256)) * 1024 * 1024)
+
+
+def nbytes(value):
+    """物件實際佔用的位元組數 (DataFrame 含字串內容)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    return value.copy() if isinstance(value, (pd.DataFrame, pd.Series)) else value
+
+
+class MemCache:
+    def __init__(self, budget=MEM_CACHE_BYTES):
+        self.budget = budget
+        self._items = OrderedDict()     # key → (value, size)
+        self._bytes = 0
+        self._inflight = {}             # key → threading.Event
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'coalesced': 0, 'evictions': 0, 'evicted_bytes': 0, 'rejected': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def _lookup(self, key):
+        """已持有鎖時呼叫；命中時移到最新並回傳項目"""
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def get(self, key):
+        """回傳 (是否命中, 值的複本)"""
+        with self._lock:
+            item = self._lookup(key)
+            self._stats['hits' if item is not None else 'misses'] += 1
+        return (True, _copy(item[0])) if item is not None else (False, None)
+
+    def put(self, key, value):
+        """放入快取；單一項目超過整個上限時不保存"""
+        size = nbytes(value)
+        value = _copy(value)
+        with self._lock:
+            if size > self.budget:
+                self._stats['rejected'] += 1
+                return False
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            self._evict()
+        return True
+
+    def _evict(self):
+        while self._bytes > self.budget and self._items:
+            _, (_, size) = self._items.popitem(last=False)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+            self._stats['evicted_bytes'] += size
+
+    def get_or_load(self, key, loader):
+        """
+        命中時直接回傳；未命中時呼叫 loader() 並放入快取
+        同一個鍵已有執行緒在載入時等待其結果 (載入失敗時改由自己載入)
+        """
+        while True:
+            with self._lock:
+                item = self._lookup(key)
+                if item is not None:
+                    self._stats['hits'] += 1
+                    return _copy(item[0])
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+                    self._stats['misses'] += 1
+                else:
+                    self._stats['coalesced'] += 1
+            if not owner:
+                # 等待後重新查詢 (命中計入 hits)
+                event.wait()
+                continue
+            try:
+                value = loader()
+                with self._lock:
+                    self._stats['loads'] += 1
+                self.put(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def invalidate(self, match):
+        """移除符合條件的項目；match 為鍵或 callable(key) -> bool"""
+        with self._lock:
+            keys = [k for k in self._items if (match(k) if callable(match) else k == match)]
+            for k in keys:
+                self._bytes -= self._items.pop(k)[1]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            lookups = out['hits'] + out['misses']
+            out.update({
+                'entries': len(self._items), 'bytes': self._bytes, 'budget': self.budget,
+                'hit_ratio': round(out['hits'] / lookups, 3) if lookups else 0.0,
+            })
+            return out
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_mem_cache():
+    """程序內唯一的記憶體快取"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MemCache()
+        return _cache
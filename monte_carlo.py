@@ -0,0 +1,115 @@
+# monte_carlo.py
+"""
+目標價的蒙地卡羅分布
+以各股票自己的歷史波動抽樣明年成長率與營業利益率，代入與策略相同的公式：
+    成長率 ~ N(推估下一年度成長率, 近六月標準差)，超過 50% 依 strategy_growth 的規則收斂
+    營業利益率 ~ N(最新 OPM, 近 8 季 OPM 標準差)，高於近 4 季平均 → EPS × 1.05，否則 × 0.95
+    推估 EPS = 最新 EPS × (1 + 成長率) × OPM 調整係數
+    便宜/合理價 = (平均 PE - σ / 平均 PE) × 推估 EPS
+    ROE 隨 EPS 相對模型推估 EPS 等比例變動 (權益一年內視為不變)，上限 25%
+    內在價值 = 淨值 × (1 + (ROE - 美債殖利率)) ^ 10
+
+全部以 (股票, 路徑) 的陣列運算，依股票分批以控制記憶體，不逐條路徑迴圈
+"""
+import numpy as np
+import pandas as pd
+
+from scenario import DEFAULT_ROE_CAP, scenario_inputs
+
+MC_PATHS = 100_000
+MC_QUANTILES = (5, 25, 50, 75, 95)
+
+# 每批最多 (股票數 × 路徑數) 個元素，float32 約 16 MB / 陣列
+MC_BATCH_CELLS = 4_000_000
+
+# 沒有歷史波動時的預設標準差
+MIN_GROWTH_STD = 0.01
+MIN_OPM_STD = 0.001
+
+
+def mc_inputs(df):
+    """從結果表取出模擬所需欄位 (在 scenario_inputs 之外加上成長率與利潤率的波動)"""
+    inputs = scenario_inputs(df)
+    df = df.reindex(columns=['近六月標準差', 'latest_opm', 'avg_4q_opm', 'std_opm_8q'])
+    inputs['growth_std'] = np.fmax(df['近六月標準差'].to_numpy(dtype='float64'), MIN_GROWTH_STD)
+    inputs['opm'] = df['latest_opm'].to_numpy(dtype='float64')
+    inputs['opm_avg'] = df['avg_4q_opm'].to_numpy(dtype='float64')
+    inputs['opm_std'] = np.fmax(df['std_opm_8q'].to_numpy(dtype='float64'), MIN_OPM_STD)
+    return inputs
+
+
+def _simulate_batch(inp, paths, rng, roe_cap):
+    """一批股票的模擬，回傳各路徑的 (便宜價, 合理價, 內在價值)，shape = (股票, 路徑)"""
+    f4 = lambda a: a.astype('float32')[:, None]
+    n = len(inp['price'])
+
+    growth = f4(inp['growth']) + f4(inp['growth_std']) * rng.standard_normal((n, paths), dtype='float32')
+    growth = np.where(growth > 0.5, 0.30 + (growth - 0.5) * 0.1, growth)
+
+    opm = f4(inp['opm']) + f4(inp['opm_std']) * rng.standard_normal((n, paths), dtype='float32')
+    factor = np.where(opm > f4(inp['opm_avg']), np.float32(1.05), np.float32(0.95))
+
+    eps0 = f4(inp['eps'])
+    eps = eps0 * (1 + growth) * factor
+    pe_avg, pe_std = f4(inp['pe_avg']), f4(inp['pe_std'])
+
+    # 波動為 0 時 ROE 即為模型使用的最新 ROE
+    eps_model = eps0 * (1 + f4(inp['growth'])) * f4(inp['opm_factor'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roe = np.where(eps_model > 0, f4(inp['roe']) * eps / eps_model, f4(inp['roe']))
+    roe = np.minimum(roe, np.float32(roe_cap))
+    intrinsic = f4(inp['nav']) * (1 + roe - f4(inp['bond']) / 100) ** 10
+    return (pe_avg - pe_std) * eps, pe_avg * eps, intrinsic
+
+
+def simulate(inputs, paths=MC_PATHS, quantiles=MC_QUANTILES, roe_cap=DEFAULT_ROE_CAP, seed=None):
+    """
+    回傳每檔股票一列 (以股票代號為索引)：
+    合理價 / 內在價值的分位數、股價低於便宜價的機率、低於內在價值的機率、兩者同時成立的機率
+    """
+    rng = np.random.default_rng(seed)
+    n = len(inputs['price'])
+    batch = max(1, MC_BATCH_CELLS // paths)
+    q = np.asarray(quantiles, dtype='float64')
+
+    fair_q = np.full((n, len(q)), np.nan)
+    iv_q = np.full((n, len(q)), np.nan)
+    p_cheap = np.full(n, np.nan)
+    p_iv = np.full(n, np.nan)
+    p_both = np.full(n, np.nan)
+
+    for start in range(0, n, batch):
+        sl = slice(start, start + batch)
+        inp = {k: v[sl] for k, v in inputs.items()}
+        cheap, fair, intrinsic = _simulate_batch(inp, paths, rng, roe_cap)
+        price = inp['price'].astype('float32')[:, None]
+
+        fair_q[sl] = np.percentile(fair, q, axis=1).T
+        iv_q[sl] = np.percentile(intrinsic, q, axis=1).T
+        below_cheap = price <= cheap
+        below_iv = price < intrinsic
+        p_cheap[sl] = below_cheap.mean(axis=1)
+        p_iv[sl] = below_iv.mean(axis=1)
+        p_both[sl] = (below_cheap & below_iv).mean(axis=1)
+
+    out = pd.DataFrame(index=pd.Index(inputs['stock_id'], name='股票代號'))
+    for j, p in enumerate(quantiles):
+        out[f'合理價P{p}'] = fair_q[:, j].round(2)
+    for j, p in enumerate(quantiles):
+        out[f'內在價值P{p}'] = iv_q[:, j].round(2)
+    out['低於便宜價機率'] = p_cheap.round(4)
+    out['低於內在價值機率'] = p_iv.round(4)
+    out['雙重低估機率'] = p_both.round(4)
+
+    # 資料不足 (缺價格或估值欄位) 的股票不給結果
+    invalid = ~(np.isfinite(inputs['price']) & np.isfinite(inputs['eps']) & np.isfinite(inputs['growth'])
+                & np.isfinite(inputs['pe_avg']) & np.isfinite(inputs['pe_std']))
+    out.loc[invalid] = np.nan
+    return out
+
+
+def sample_paths(inputs, i, paths=20_000, roe_cap=DEFAULT_ROE_CAP, seed=None):
+    """單一股票 (inputs 中第 i 檔) 的抽樣結果，供畫分布圖：欄位 便宜價、合理價、內在價值"""
+    inp = {k: v[i:i + 1] for k, v in inputs.items()}
+    cheap, fair, intrinsic = _simulate_batch(inp, paths, np.random.default_rng(seed), roe_cap)
+    return pd.DataFrame({'便宜價': cheap[0], '合理價': fair[0], '內在價值': intrinsic[0]})
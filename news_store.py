@@ -0,0 +1,169 @@
+# news_store.py
+"""
+個股新聞庫 (存放於資料倉儲同一個 SQLite 檔)
+- 增量匯入：只抓取上次看到的最新時間之後的新聞
+- 去重：正規化後的標題與連結各建一個雜湊唯一索引，任一相同即視為重複
+- 全文檢索：以 FTS5 (trigram) 索引標題與摘要，可跨所有股票搜尋「CoWoS」、「降價」等關鍵字
+"""
+import hashlib
+import re
+import unicodedata
+from datetime import timedelta
+
+import pandas as pd
+
+from warehouse import taipei_now
+
+# 同一檔股票在這段時間內已檢查過新聞時，不再呼叫 API
+NEWS_POLL = timedelta(hours=1)
+NEWS_DAYS = 90
+
+NEWS_COLS = ['stock_id', 'date', 'title', 'description', 'link', 'source']
+
+
+def normalize_title(title):
+    """全半形統一、轉小寫、去除空白與標點，讓不同來源轉載的同一則新聞得到相同的鍵"""
+    text = unicodedata.normalize('NFKC', str(title or '')).lower()
+    return re.sub(r'[\W_]+', '', text)
+
+
+def normalize_link(link):
+    """去除協定、www、查詢參數與結尾斜線"""
+    text = str(link or '').strip().lower()
+    text = re.sub(r'^https?://(www\.)?', '', text)
+    return text.split('?', 1)[0].split('#', 1)[0].rstrip('/')
+
+
+def _key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest() if text else None
+
+
+class NewsStore:
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        with warehouse.connect() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS news (
+                    id INTEGER PRIMARY KEY,
+                    stock_id TEXT, date TEXT, title TEXT, description TEXT, link TEXT, source TEXT,
+                    title_key TEXT, link_key TEXT
+                )
+            """)
+            con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_news_title ON news (stock_id, title_key)")
+            con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_news_link ON news (stock_id, link_key)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_news_date ON news (stock_id, date)")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS news_cursor (
+                    stock_id TEXT PRIMARY KEY, last_date TEXT, checked_at TEXT
+                )
+            """)
+
+            # trigram 可搜尋中文任意片段 (需 SQLite 3.34 以上)，舊版退回 unicode61
+            exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'news_fts'").fetchone()
+            if not exists:
+                try:
+                    con.execute("CREATE VIRTUAL TABLE news_fts USING fts5(title, description, content='news', content_rowid='id', tokenize='trigram')")
+                except Exception:
+                    con.execute("CREATE VIRTUAL TABLE news_fts USING fts5(title, description, content='news', content_rowid='id')")
+            con.execute("""
+                CREATE TRIGGER IF NOT EXISTS news_ai AFTER INSERT ON news BEGIN
+                    INSERT INTO news_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+                END
+            """)
+
+    def cursor(self, stock_id):
+        """(最後一則新聞的時間, 最後檢查時間)"""
+        with self.warehouse.connect(readonly=True) as con:
+            row = con.execute("SELECT last_date, checked_at FROM news_cursor WHERE stock_id = ?", (stock_id,)).fetchone()
+        return row or (None, None)
+
+    def add(self, stock_id, df):
+        """寫入新聞並回傳實際新增的筆數 (重複的標題或連結會被唯一索引略過)"""
+        if df is None or df.empty:
+            return 0
+        df = df.reindex(columns=NEWS_COLS)
+        dates = pd.to_datetime(df['date'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+        rows = [
+            (stock_id, d, t, desc, link, src, _key(normalize_title(t)), _key(normalize_link(link)))
+            for d, t, desc, link, src in zip(dates, df['title'], df['description'], df['link'], df['source'])
+        ]
+        count = "SELECT COUNT(*) FROM news WHERE stock_id = ?"
+        with self.warehouse._lock, self.warehouse.connect() as con:
+            before = con.execute(count, (stock_id,)).fetchone()[0]
+            con.executemany(
+                "INSERT OR IGNORE INTO news (stock_id, date, title, description, link, source, title_key, link_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            return con.execute(count, (stock_id,)).fetchone()[0] - before
+
+    def ingest(self, data_loader, stock_id, days=NEWS_DAYS, force=False, logger=None):
+        """
+        增量匯入：從上次看到的最新時間 (當天) 開始抓取，最多回溯 days 天
+        NEWS_POLL 內檢查過則直接略過；抓取失敗時不更新檢查時間，下次會重新抓取
+        """
+        now = taipei_now()
+        last_date, checked_at = self.cursor(stock_id)
+        if not force and checked_at and now - pd.Timestamp(checked_at) < NEWS_POLL:
+            return 0
+
+        start = now - timedelta(days=days)
+        if last_date:
+            # 同一天可能還有稍晚的新聞，從最後一則的日期當天開始抓，重複的會被去重
+            start = max(start, pd.Timestamp(last_date).to_pydatetime().replace(hour=0, minute=0, second=0))
+
+        df = data_loader.get_stock_news(stock_id, start_date=start.strftime('%Y-%m-%d'), logger=logger)
+        if df is None:
+            return 0
+        added = self.add(stock_id, df)
+        newest = self._newest(stock_id)
+        with self.warehouse._lock, self.warehouse.connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO news_cursor VALUES (?, ?, ?)",
+                (stock_id, newest, now.isoformat(timespec='seconds'))
+            )
+        if logger: logger(f"📰 {stock_id} 新聞：取得 {len(df)} 則，新增 {added} 則")
+        return added
+
+    def _newest(self, stock_id):
+        with self.warehouse.connect(readonly=True) as con:
+            return con.execute("SELECT MAX(date) FROM news WHERE stock_id = ?", (stock_id,)).fetchone()[0]
+
+    def latest(self, stock_id, limit=10, days=NEWS_DAYS):
+        """某檔股票最近的新聞 (新到舊)"""
+        since = (taipei_now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        df = self.warehouse.query(
+            "SELECT stock_id, date, title, description, link, source FROM news "
+            "WHERE stock_id = ? AND date >= ? ORDER BY date DESC LIMIT ?",
+            (stock_id, since, limit)
+        )
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+    def search(self, query, stock_ids=None, limit=50):
+        """
+        跨所有股票全文搜尋標題與摘要 (不呼叫 API)，結果依時間新到舊
+        trigram 需至少 3 個字元，較短的關鍵字 (例如「降價」) 改用 LIKE 比對
+        """
+        query = (query or '').strip()
+        if not query:
+            return pd.DataFrame(columns=NEWS_COLS)
+
+        if len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            sql = ("SELECT n.stock_id, n.date, n.title, n.description, n.link, n.source FROM news_fts f "
+                   "JOIN news n ON n.id = f.rowid WHERE news_fts MATCH ?")
+            params = [phrase]
+        else:
+            sql = ("SELECT stock_id, date, title, description, link, source FROM news n "
+                   "WHERE (title LIKE ? OR description LIKE ?)")
+            params = [f"%{query}%", f"%{query}%"]
+
+        if stock_ids:
+            sql += f" AND n.stock_id IN ({', '.join('?' * len(stock_ids))})"
+            params += list(stock_ids)
+        sql += " ORDER BY n.date DESC LIMIT ?"
+        params.append(int(limit))
+
+        df = self.warehouse.query(sql, params)
+        df['date'] = pd.to_datetime(df['date'])
+        return df
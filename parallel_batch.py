@@ -0,0 +1,219 @@
+# parallel_batch.py
+"""
+多程序批次評分
+1. 主程序從資料倉儲一次載入各資料集的原始面板 (全部股票)
+2. 面板轉成欄式陣列放進共享記憶體：數值欄直接放，文字欄以字典編碼 (codes + 詞彙表)，
+   並依代號排序，每檔股票是一段連續的列
+3. 工作程序只收到共享記憶體名稱與各代號的列範圍，直接以 numpy 視圖讀取，不需序列化 DataFrame
+4. 股票分片交給各工作程序，分析流程與單程序完全相同 (PanelData 取代 API 來源)，最後併回一個 ResultSet
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from data import StockData
+from frame_dtypes import compact_frame
+from result_store import ResultSet
+from scheduler import STOCK_DATASETS, SHARED_DATASETS
+from warehouse import ID_COLUMNS
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+
+# 每個工作程序平均分到的分片數，分片越多負載越平均
+SHARDS_PER_WORKER = 4
+
+
+class SharedPanel:
+    """
+    一個資料集的欄式面板，資料放在共享記憶體
+    spec 只含共享記憶體名稱、型別、詞彙表與各代號的列範圍，可直接傳給工作程序
+    """
+
+    def __init__(self, spec, blocks):
+        self.spec = spec
+        self._blocks = blocks
+        self._arrays = {}
+        self._vocab = {}
+        for col, info in spec['columns'].items():
+            shm = blocks[col]
+            self._arrays[col] = np.ndarray((spec['rows'],), dtype=np.dtype(info['dtype']), buffer=shm.buf)
+            if info['vocab'] is not None:
+                self._vocab[col] = np.array(info['vocab'] + [None], dtype=object)
+
+    @classmethod
+    def create(cls, df, key_col):
+        """依 key_col 排序後把每一欄複製到共享記憶體"""
+        df = df.sort_values([key_col] + (['date'] if 'date' in df.columns else []), kind='stable').reset_index(drop=True)
+        keys = df[key_col].astype(str).to_numpy()
+        bounds = {}
+        if len(keys):
+            change = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            starts = np.concatenate([[0], change])
+            stops = np.concatenate([change, [len(keys)]])
+            bounds = {keys[a]: (int(a), int(b)) for a, b in zip(starts, stops)}
+
+        spec = {'rows': len(df), 'bounds': bounds, 'order': list(df.columns), 'columns': {}}
+        blocks = {}
+        for col in df.columns:
+            s = df[col]
+            if s.dtype.kind in 'biuf':
+                arr, vocab = s.to_numpy(), None
+            else:
+                # 文字欄：-1 (缺值) 對應詞彙表最後一格的 None
+                codes, uniques = pd.factorize(s)
+                arr, vocab = codes.astype('int32'), list(uniques)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            blocks[col] = shm
+            spec['columns'][col] = {'shm': shm.name, 'dtype': arr.dtype.str, 'vocab': vocab}
+        return cls(spec, blocks)
+
+    @classmethod
+    def attach(cls, spec):
+        blocks = {col: shared_memory.SharedMemory(name=info['shm']) for col, info in spec['columns'].items()}
+        return cls(spec, blocks)
+
+    def frame(self, key=None):
+        """取出一檔股票的列 (key 為 None 時取整張表)，只複製這一段"""
+        if key is None:
+            a, b = 0, self.spec['rows']
+        else:
+            a, b = self.spec['bounds'].get(str(key), (0, 0))
+        data = {}
+        for col in self.spec['order']:
+            arr = self._arrays[col][a:b]
+            data[col] = self._vocab[col][arr] if col in self._vocab else arr.copy()
+        return pd.DataFrame(data)
+
+    def close(self):
+        self._arrays.clear()
+        for shm in self._blocks.values():
+            shm.close()
+
+    def unlink(self):
+        for shm in self._blocks.values():
+            shm.unlink()
+
+
+class PanelData(StockData):
+    """以共享記憶體面板取代 FinMind API 的資料來源，轉換邏輯沿用 StockData 的各個 get_* 方法"""
+
+    def __init__(self, panels):
+        super().__init__(token="")
+        self.panels = panels
+
+    def _fetch(self, dataset, data_id="", start_date="", end_date="", timeout=60):
+        panel = self.panels.get(dataset)
+        if panel is None:
+            return pd.DataFrame()
+        df = panel.frame(data_id if data_id else None)
+        if 'date' in df.columns:
+            if start_date:
+                df = df[df['date'] >= start_date]
+            if end_date:
+                df = df[df['date'] <= end_date]
+        return df.reset_index(drop=True)
+
+
+_worker_panels = {}
+_worker_archive = {}
+
+
+def _init_worker(specs, archive_dir=None):
+    """工作程序啟動時連上共享記憶體；策略流程在程序內改為單執行緒，避免與多程序重複搶 CPU"""
+    import analysis
+    analysis.STOCK_PIPELINE.max_workers = 1
+    for dataset, spec in specs.items():
+        _worker_panels[dataset] = SharedPanel.attach(spec)
+    _worker_archive['dir'] = archive_dir
+
+
+def _score_shard(jobs):
+    """
+    分析一個分片的股票，回傳 (ResultSet, 日誌, 寫入的輸入切片數)
+    有封存目錄時輸入切片在工作程序內寫出，ResultSet 只帶回參照
+    """
+    from analysis import analyze_stock
+
+    loader = PanelData(_worker_panels)
+    results = ResultSet(capacity=max(len(jobs), 1))
+    recorder = None
+    if _worker_archive.get('dir'):
+        from run_archive import InputRecorder
+        recorder = InputRecorder(_worker_archive['dir'])
+    logs = []
+    for stock_id, name, industry, ui_key in jobs:
+        try:
+            record, err_msg = analyze_stock(loader, stock_id, name, industry, ui_key, results, recorder=recorder)
+            logs.append(err_msg or f"✅ {stock_id} 分析完成，綜合評分：{record.get('MasterScore', 'N/A')}")
+        except Exception as e:
+            logs.append(f"❌ {stock_id} 分析失敗: {str(e)}")
+    written = 0
+    if recorder is not None:
+        try:
+            written = recorder.flush()
+        except Exception as e:
+            # 參照指向未寫出的檔案，重現時會回報缺少輸入切片
+            logs.append(f"⚠️ 輸入切片封存失敗: {str(e)}")
+    return results, logs, written
+
+
+def load_panels(warehouse, stock_ids):
+    """從資料倉儲載入各資料集的原始面板並放入共享記憶體"""
+    wanted = set(stock_ids)
+    panels = {}
+    for dataset in STOCK_DATASETS + list(SHARED_DATASETS):
+        df = warehouse.load_dataset(dataset)
+        if df.empty:
+            continue
+        key_col = ID_COLUMNS.get(dataset, 'stock_id')
+        if dataset in STOCK_DATASETS:
+            df = df[df[key_col].astype(str).isin(wanted)]
+        # 比率欄改存 float32；日期維持字串，與 API 回傳的原始格式一致
+        date = df.pop('date') if 'date' in df.columns else None
+        df = compact_frame(df)
+        if date is not None:
+            df['date'] = date
+        panels[dataset] = SharedPanel.create(df, key_col)
+    return panels
+
+
+def score_universe(jobs, warehouse, workers=BATCH_WORKERS, logger=None, archive_dir=None):
+    """
+    jobs：[(股票代號, 名稱, 產業別, ui_key)]，原始資料需已在資料倉儲中
+    archive_dir：有指定時各工作程序把輸入切片寫入封存目錄 (見 run_archive.py)
+    回傳合併後的 ResultSet
+    """
+    start = time.perf_counter()
+    panels = load_panels(warehouse, [j[0] for j in jobs])
+    specs = {dataset: p.spec for dataset, p in panels.items()}
+    mem = sum(p.spec['rows'] * sum(np.dtype(c['dtype']).itemsize for c in p.spec['columns'].values()) for p in panels.values())
+    if logger: logger(f"🧱 共享記憶體面板：{len(panels)} 個資料集，{mem / 1024 / 1024:.1f} MB ({time.perf_counter() - start:.1f}s)")
+
+    n_shards = max(1, min(len(jobs), workers * SHARDS_PER_WORKER))
+    shards = [jobs[i::n_shards] for i in range(n_shards)]
+    merged = ResultSet(capacity=max(len(jobs), 1))
+    written = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=_init_worker, initargs=(specs, archive_dir)) as pool:
+            futures = [pool.submit(_score_shard, shard) for shard in shards if shard]
+            for fut in as_completed(futures):
+                part, logs, n = fut.result()
+                merged.extend(part)
+                written += n
+                if logger:
+                    for msg in logs:
+                        logger(msg)
+    finally:
+        for p in panels.values():
+            p.close()
+            p.unlink()
+
+    if logger: logger(f"⚙️ {workers} 個工作程序完成 {len(merged)} / {len(jobs)} 檔 ({time.perf_counter() - start:.1f}s)")
+    if logger and archive_dir: logger(f"🗄️ 工作程序寫入 {written} 份輸入切片")
+    return merged
@@ -0,0 +1,237 @@
+# pe_sketch.py
+"""
+本益比區間 (便宜/合理/昂貴 PE) 的增量統計
+- 每檔股票保存 5 年滾動窗口內的正本益比：依日期的佇列 (用來過期) + 排序好的多重集合 (用來取分位數)
+- 本益比報價只到小數第二位，以「分」為單位的整數保存，總和與平方和可精確增減
+- 每天只需加入新的交易日、移除超出窗口的舊交易日；95% 縮尾、平均、標準差只看超過上限的尾端，
+  不必重新掃描 5 年的日資料
+- 區間在更新時算好，查詢為 O(1)
+- 狀態存在資料倉儲的 pe_sketch 表，重啟後從上次的最後日期接續
+
+與 strategy_valuation 原本以 pandas 全量計算的結果一致 (差異僅在浮點數捨入誤差範圍)
+"""
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from warehouse import taipei_now
+
+PE_YEARS = 5
+# 縮尾上限 (分位數)
+CLIP_QUANTILE = 0.95
+
+
+def _ordinal(d):
+    return pd.Timestamp(d).toordinal()
+
+
+def _quantile(sorted_values, q):
+    """與 numpy/pandas 預設 (linear) 相同的分位數內插"""
+    n = len(sorted_values)
+    index = (n - 1) * q
+    lo = min(max(int(math.floor(index)), 0), n - 1)
+    hi = min(lo + 1, n - 1)
+    gamma = index - math.floor(index)
+    a, b = sorted_values[lo] / 100, sorted_values[hi] / 100
+    if gamma >= 0.5:
+        return b - (b - a) * (1 - gamma)
+    return a + (b - a) * gamma
+
+
+def band_from_frame(df_val):
+    """以完整的日資料計算區間 (沒有增量狀態時使用)，格式與 PESketch.band() 相同"""
+    if df_val is None or df_val.empty:
+        return None
+    pe_series = df_val[df_val['PER'] > 0]['PER']
+    if pe_series.empty:
+        return None
+    valid_pe = pe_series.clip(upper=pe_series.quantile(CLIP_QUANTILE))
+    latest_row = df_val.iloc[-1]
+    return {
+        'pe_max': valid_pe.max(), 'pe_min': valid_pe.min(),
+        'pe_avg': valid_pe.mean(), 'pe_std': valid_pe.std(),
+        'days': len(pe_series),
+        'current_pe': float(latest_row['PER']), 'current_pb': float(latest_row['PBR']),
+        'last_date': pd.Timestamp(latest_row['date']).strftime('%Y-%m-%d'),
+    }
+
+
+class PESketch:
+    """單一股票的滾動窗口本益比統計"""
+
+    def __init__(self):
+        self.days = array('i')      # 交易日 (ordinal)，依日期排序
+        self.cents = array('i')     # 對應的本益比 (分)
+        self.sorted = array('i')    # 同一批本益比，由小到大
+        self.total = 0              # 本益比總和 (分)
+        self.total_sq = 0           # 本益比平方和 (分²)
+        self.last_date = None       # 已加入的最後交易日 (含本益比 <= 0 的日子)
+        self.current_pe = None
+        self.current_pb = None
+        self._band = None
+
+    def add(self, day, per, pbr):
+        """加入一個交易日；早於或等於 last_date 的資料會被略過"""
+        day = pd.Timestamp(day).strftime('%Y-%m-%d')
+        if self.last_date is not None and day <= self.last_date:
+            return False
+        self.last_date = day
+        self.current_pe, self.current_pb = float(per), float(pbr)
+        if per > 0:
+            c = int(round(per * 100))
+            self.days.append(_ordinal(day))
+            self.cents.append(c)
+            insort(self.sorted, c)
+            self.total += c
+            self.total_sq += c * c
+        self._band = None
+        return True
+
+    def expire(self, window_start):
+        """移除窗口開始日之前的交易日，回傳移除筆數"""
+        start = _ordinal(window_start)
+        n = bisect_left(self.days, start)
+        for c in self.cents[:n]:
+            del self.sorted[bisect_left(self.sorted, c)]
+            self.total -= c
+            self.total_sq -= c * c
+        if n:
+            del self.days[:n]
+            del self.cents[:n]
+            self._band = None
+        return n
+
+    def band(self):
+        """95% 縮尾後的最高、最低、平均、標準差與最新本益比/淨值比；無有效資料時回傳 None"""
+        if self._band is None and len(self.sorted):
+            x, n = self.sorted, len(self.sorted)
+            upper = _quantile(x, CLIP_QUANTILE)
+            # 超過上限的尾端以上限取代
+            tail = bisect_right(x, math.floor(upper * 100))
+            while tail < n and x[tail] / 100 <= upper:
+                tail += 1
+            k = n - tail
+            tail_sum = sum(x[tail:])
+            tail_sq = sum(c * c for c in x[tail:])
+            mean = ((self.total - tail_sum) / 100 + k * upper) / n
+            sq = (self.total_sq - tail_sq) / 10000 + k * upper * upper
+            std = math.sqrt(max(sq - n * mean * mean, 0) / (n - 1)) if n > 1 else float('nan')
+            self._band = {
+                'pe_max': upper if k else x[-1] / 100, 'pe_min': x[0] / 100,
+                'pe_avg': mean, 'pe_std': std,
+                'days': n,
+                'current_pe': self.current_pe, 'current_pb': self.current_pb,
+                'last_date': self.last_date,
+            }
+        return self._band
+
+    def to_row(self):
+        return (self.last_date, self.current_pe, self.current_pb, self.days.tobytes(), self.cents.tobytes())
+
+    @classmethod
+    def from_row(cls, row):
+        sketch = cls()
+        sketch.last_date, sketch.current_pe, sketch.current_pb = row[0], row[1], row[2]
+        sketch.days.frombytes(row[3])
+        sketch.cents.frombytes(row[4])
+        sketch.sorted = array('i', sorted(sketch.cents))
+        values = np.frombuffer(row[4], dtype=np.int32).astype(np.int64)
+        sketch.total, sketch.total_sq = int(values.sum()), int((values * values).sum())
+        return sketch
+
+
+class PESketchStore:
+    """
+    各股票的 PESketch；有資料倉儲時保存於 pe_sketch 表，否則只放在記憶體
+    """
+
+    def __init__(self, warehouse=None):
+        self.warehouse = warehouse
+        self._sketches = {}
+        self._stock_locks = {}
+        self._lock = threading.Lock()
+        if warehouse is not None:
+            with warehouse.connect() as con:
+                con.execute("""
+                    CREATE TABLE IF NOT EXISTS pe_sketch (
+                        stock_id TEXT PRIMARY KEY, last_date TEXT, current_pe REAL, current_pb REAL,
+                        days BLOB, cents BLOB, updated_at TEXT
+                    )
+                """)
+
+    def get(self, stock_id):
+        with self._lock:
+            sketch = self._sketches.get(stock_id)
+            if sketch is None:
+                row = None
+                if self.warehouse is not None:
+                    with self.warehouse.connect(readonly=True) as con:
+                        row = con.execute(
+                            "SELECT last_date, current_pe, current_pb, days, cents FROM pe_sketch WHERE stock_id = ?",
+                            (stock_id,)
+                        ).fetchone()
+                sketch = PESketch.from_row(row) if row else PESketch()
+                self._sketches[stock_id] = sketch
+            return sketch
+
+    def _stock_lock(self, stock_id):
+        """每檔股票一把鎖，同一個 PESketch 的讀寫須串行"""
+        with self._lock:
+            return self._stock_locks.setdefault(stock_id, threading.Lock())
+
+    def save(self, stock_id):
+        if self.warehouse is None:
+            return
+        sketch = self._sketches[stock_id]
+        with self.warehouse._lock, self.warehouse.connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO pe_sketch VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stock_id, *sketch.to_row(), taipei_now().isoformat(timespec='seconds'))
+            )
+
+    def reset(self, stock_id):
+        """丟棄某檔股票的狀態 (例如歷史資料被修正時)，下次更新會從窗口開始日重建"""
+        with self._stock_lock(stock_id):
+            with self._lock:
+                self._sketches.pop(stock_id, None)
+            if self.warehouse is not None:
+                with self.warehouse._lock, self.warehouse.connect() as con:
+                    con.execute("DELETE FROM pe_sketch WHERE stock_id = ?", (stock_id,))
+
+    def update(self, stock_id, df_new, window_start):
+        """加入新的交易日並過期窗口外的資料，有變動時寫回資料倉儲；回傳區間"""
+        if df_new is not None and not df_new.empty:
+            df_new = df_new.sort_values('date')
+        with self._stock_lock(stock_id):
+            sketch = self.get(stock_id)
+            changed = False
+            if df_new is not None and not df_new.empty:
+                for day, per, pbr in zip(df_new['date'], df_new['PER'], df_new['PBR']):
+                    changed |= sketch.add(day, per, pbr)
+            changed |= sketch.expire(window_start) > 0
+            if changed:
+                self.save(stock_id)
+            return sketch.band()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_sketch_store(warehouse=None):
+    """同一個資料倉儲共用一個 PESketchStore (沒有資料倉儲時為程序內共用的記憶體版本)"""
+    key = getattr(warehouse, 'path', None)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = PESketchStore(warehouse)
+        return _stores[key]
+
+
+def window_start(years=PE_YEARS, now=None):
+    """滾動窗口開始日，與 StockData.get_valuation_history 相同"""
+    return ((now or datetime.now()) - timedelta(days=years * 365)).strftime('%Y-%m-%d')
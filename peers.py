@@ -0,0 +1,191 @@
+# peers.py
+"""
+營收動能同儕分析
+- 以資料倉儲中所有股票的月營收建立 股票 × 月份 的年增率 (YoY) 矩陣
+- 兩兩相關係數以矩陣乘法一次算完 (缺值月份逐對排除，等同 pandas DataFrame.corr 的 pairwise complete)
+- 以 k-means 把走勢相近的股票分成動能群組 (各股 YoY 先標準化，歐氏距離即對應相關係數)
+- 個股的最相近同儕 = 相關係數最高的 k 檔
+
+全部是陣列運算，沒有逐對股票的 Python 迴圈；1,500 檔 × 120 個月約在一秒內完成
+"""
+import numpy as np
+import pandas as pd
+
+# 矩陣涵蓋的月份數 (10 年)
+PEER_MONTHS = 120
+# 兩檔股票共同有資料的月份少於此數時不計算相關係數
+MIN_OVERLAP = 24
+# 動能群組數上限 (股票少時依家數縮小)
+MAX_COHORTS = 12
+PEER_COUNT = 5
+
+
+def load_revenue_panel(warehouse):
+    """資料倉儲中快取的月營收原始資料 (stock_id, revenue_year, revenue_month, revenue)"""
+    return warehouse.query(
+        'SELECT stock_id, revenue_year, revenue_month, revenue FROM "raw_TaiwanStockMonthRevenue"'
+    )
+
+
+def yoy_matrix(df_rev, months=PEER_MONTHS):
+    """
+    月營收長表格 → (股票代號, 月份標籤, YoY 矩陣 (股票, 月份))
+    YoY 依日曆月份對齊 (今年本月 / 去年同月 - 1)，缺月份為 NaN
+    """
+    if df_rev is None or df_rev.empty:
+        return np.array([], dtype=object), [], np.empty((0, 0))
+
+    stock_codes, stock_ids = pd.factorize(df_rev['stock_id'].astype(str), sort=True)
+    month = df_rev['revenue_year'].astype('int64').to_numpy() * 12 + df_rev['revenue_month'].astype('int64').to_numpy() - 1
+    last = int(month.max())
+    first = last - months - 12 + 1
+    keep = month >= first
+
+    revenue = np.full((len(stock_ids), months + 12), np.nan)
+    revenue[stock_codes[keep], month[keep] - first] = pd.to_numeric(df_rev['revenue'], errors='coerce').to_numpy(dtype='float64')[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yoy = revenue[:, 12:] / np.where(revenue[:, :-12] > 0, revenue[:, :-12], np.nan) - 1
+
+    labels = [f"{m // 12}-{m % 12 + 1:02d}" for m in range(first + 12, last + 1)]
+    return np.asarray(stock_ids, dtype=object), labels, yoy
+
+
+def correlation_matrix(yoy, min_overlap=MIN_OVERLAP):
+    """
+    逐對排除缺值的 Pearson 相關係數，以 6 次矩陣乘法 (BLAS) 計算：
+    共同月份數、各自在共同月份的總和與平方和、交叉乘積
+    """
+    w = np.isfinite(yoy).astype('float64')
+    x = np.where(w > 0, yoy, 0.0)
+    x2 = x * x
+
+    n = w @ w.T
+    sx = x @ w.T           # sx[i, j]：i 在 i、j 共同月份的總和
+    sxx = x2 @ w.T
+    sxy = x @ x.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_x = sxx - sx * sx / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < min_overlap] = np.nan
+    np.fill_diagonal(corr, np.where(np.diag(n) >= min_overlap, 1.0, np.nan))
+    return np.clip(corr, -1.0, 1.0)
+
+
+def _standardize(yoy, min_overlap=MIN_OVERLAP):
+    """每檔股票的 YoY 減去平均、除以標準差與 √月份數，缺值補 0；列向量長度為 1，距離² = 2 × (1 - 相關係數)"""
+    valid = np.isfinite(yoy)
+    count = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 不用 np.nanmean：沒有任何有效月份的列會發出 RuntimeWarning (errstate 擋不住)
+        mean = np.where(count > 0, np.where(valid, yoy, 0.0).sum(axis=1) / np.maximum(count, 1), np.nan)
+        z = np.where(valid, yoy - mean[:, None], 0.0)
+        norm = np.sqrt((z * z).sum(axis=1))
+        z = z / np.where(norm > 0, norm, 1)[:, None]
+    return z, (count >= min_overlap) & (norm > 0)
+
+
+def kmeans(x, k, iters=50, seed=0):
+    """k-means (k-means++ 初始化)，距離以矩陣乘法計算；回傳 (各列群組, 群心)"""
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    sq = (x * x).sum(axis=1)
+    centers = [x[rng.integers(n)]]
+    d2 = np.maximum(sq - 2 * x @ centers[0] + centers[0] @ centers[0], 0)
+    for _ in range(1, k):
+        p = d2 / d2.sum() if d2.sum() > 0 else None
+        c = x[rng.choice(n, p=p)]
+        centers.append(c)
+        d2 = np.minimum(d2, np.maximum(sq - 2 * x @ c + c @ c, 0))
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iters):
+        dist = sq[:, None] - 2 * x @ centers.T + (centers * centers).sum(axis=1)[None, :]
+        new = dist.argmin(axis=1)
+        if labels is not None and (new == labels).all():
+            break
+        labels = new
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, x)
+        # 空群組保留原本的群心
+        centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+    return labels, centers
+
+
+def build_peer_model(df_rev, months=PEER_MONTHS, cohorts=None, min_overlap=MIN_OVERLAP, seed=0):
+    """
+    回傳 dict：
+    stock_ids、months、yoy (股票 × 月份)、corr (股票 × 股票)、
+    cohort (各股動能群組，-1 為資料不足)、cohorts (群組摘要 DataFrame)
+    群組依近 3 個月平均 YoY 由高到低編號 (A、B、C…)
+    """
+    stock_ids, labels, yoy = yoy_matrix(df_rev, months)
+    corr = correlation_matrix(yoy, min_overlap)
+
+    z, valid = _standardize(yoy, min_overlap)
+    cohort = np.full(len(stock_ids), -1)
+    k = min(cohorts or MAX_COHORTS, max(int(np.sqrt(valid.sum() / 2)), 1))
+    summary = pd.DataFrame(columns=['群組', '家數', '近3月平均YoY', '近12月平均YoY', '代表股票'])
+    if valid.sum() >= 2:
+        raw, centers = kmeans(z[valid], k, seed=seed)
+
+        # 依群組近 3 個月的平均 YoY 排序編號
+        recent = np.array([np.nanmean(yoy[valid][raw == c, -3:]) if (raw == c).any() else -np.inf for c in range(k)])
+        order = np.argsort(-recent)
+        rank = np.empty(k, dtype='int64')
+        rank[order] = np.arange(k)
+        cohort[valid] = rank[raw]
+
+        rows = []
+        idx_valid = np.nonzero(valid)[0]
+        for c in order:
+            members = idx_valid[raw == c]
+            if not len(members):
+                continue
+            # 代表股票：最接近群心的 3 檔
+            d = ((z[members] - centers[c]) ** 2).sum(axis=1)
+            rows.append({
+                '群組': _cohort_name(rank[c]), '家數': len(members),
+                '近3月平均YoY': round(float(np.nanmean(yoy[members, -3:])), 4),
+                '近12月平均YoY': round(float(np.nanmean(yoy[members, -12:])), 4),
+                '代表股票': ', '.join(stock_ids[members[np.argsort(d)[:3]]]),
+            })
+        summary = pd.DataFrame(rows)
+
+    return {
+        'stock_ids': stock_ids, 'months': labels, 'yoy': yoy, 'corr': corr,
+        'cohort': cohort, 'cohorts': summary,
+        'index': {sid: i for i, sid in enumerate(stock_ids)},
+    }
+
+
+def _cohort_name(c):
+    return f"動能群組 {chr(ord('A') + int(c))}" if c >= 0 else "資料不足"
+
+
+def closest_peers(model, stock_id, k=PEER_COUNT):
+    """
+    相關係數最高的 k 檔同儕，回傳 DataFrame：股票代號、相關係數、共同群組
+    不在矩陣中 (沒有月營收快取) 的股票回傳空表格
+    """
+    i = model['index'].get(str(stock_id))
+    if i is None:
+        return pd.DataFrame(columns=['股票代號', '相關係數', '動能群組'])
+    row = model['corr'][i].copy()
+    row[i] = np.nan
+    row = np.where(np.isfinite(row), row, -np.inf)
+    k = min(k, int(np.isfinite(row).sum()))
+    top = np.argpartition(-row, k - 1)[:k] if k > 0 else np.array([], dtype='int64')
+    top = top[np.argsort(-row[top])]
+    return pd.DataFrame({
+        '股票代號': model['stock_ids'][top],
+        '相關係數': np.round(row[top], 3),
+        '動能群組': [_cohort_name(c) for c in model['cohort'][top]],
+    })
+
+
+def cohort_of(model, stock_id):
+    i = model['index'].get(str(stock_id))
+    return _cohort_name(model['cohort'][i]) if i is not None else None
@@ -0,0 +1,206 @@
+# pipeline.py
+"""
+小型 DAG 執行器
+- 每個節點宣告輸入 (資料集或上游節點)，沒有相依關係的節點以執行緒池平行執行
+- 策略節點的輸出依「輸入內容的雜湊」快取：輸入沒變就直接沿用上次結果，不重新計算
+  例如只有股價更新時，只會重跑估值；新的一個月營收進來時，重跑成長性及其下游
+"""
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 4))
+MEMO_SIZE = int(os.environ.get('PIPELINE_MEMO_SIZE', 4096))
+
+
+def _update(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(b'D')
+        h.update(repr([(str(c), str(t)) for c, t in obj.dtypes.items()]).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(b'S' + str(obj.dtype).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for k in sorted(obj, key=str):
+            _update(h, k)
+            _update(h, obj[k])
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for v in obj:
+            _update(h, v)
+        h.update(b']')
+    else:
+        h.update(type(obj).__name__.encode() + b':' + repr(obj).encode())
+
+
+def content_hash(obj):
+    """依內容計算雜湊 (DataFrame 以 pandas 的逐列雜湊，dict 依鍵排序)"""
+    h = hashlib.sha1()
+    _update(h, obj)
+    return h.hexdigest()
+
+
+class Node:
+    """
+    name：節點名稱
+    func：資料集節點為 func(context)；策略節點為 func(*inputs, logger=...)
+    inputs：上游節點名稱，可用 "節點.鍵" 只取輸出 dict 中的單一欄位
+    memo：是否依輸入雜湊快取輸出 (資料集節點每次都重新取得，作為變動偵測的來源)
+    version：邏輯修改時調高，讓舊的快取失效
+    """
+
+    def __init__(self, name, func, inputs=(), memo=True, version=1, label=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.memo = memo
+        self.version = version
+        self.label = label or name
+
+    @property
+    def upstream(self):
+        return {ref.split('.', 1)[0] for ref in self.inputs}
+
+
+class PipelineRun:
+    """一次執行的結果：各節點輸出、實際執行與沿用快取的節點、各節點耗時"""
+
+    def __init__(self):
+        self.outputs = {}
+        self.hashes = {}
+        self.executed = []
+        self.cached = []
+        self.timings = {}
+
+    def __getitem__(self, name):
+        return self.outputs[name]
+
+
+class Pipeline:
+    def __init__(self, nodes, max_workers=PIPELINE_WORKERS, memo_size=MEMO_SIZE):
+        self.nodes = {n.name: n for n in nodes}
+        self.max_workers = max_workers
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        for n in nodes:
+            missing = n.upstream - self.nodes.keys()
+            if missing:
+                raise ValueError(f"節點 {n.name} 的輸入不存在: {sorted(missing)}")
+
+    def _resolve(self, ref, run):
+        name, _, key = ref.partition('.')
+        value = run.outputs[name]
+        if key:
+            value = (value or {}).get(key)
+            return value, content_hash(value)
+        return value, run.hashes[name]
+
+    def _memo_get(self, key):
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return True, self._memo[key]
+        return False, None
+
+    def _memo_put(self, key, value):
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def _execute(self, node, args, context):
+        """在工作執行緒中執行節點；日誌先暫存，回到主執行緒再輸出"""
+        logs = []
+        start = time.perf_counter()
+        if node.inputs:
+            # 傳入複本，避免策略函式修改共用的上游資料
+            args = [a.copy() if isinstance(a, (pd.DataFrame, dict)) else a for a in args]
+            out = node.func(*args, logger=logs.append)
+        else:
+            out = node.func(context)
+        return out, logs, time.perf_counter() - start
+
+    def run(self, context=None, logger=None, targets=None, seed=None):
+        """
+        依相依順序執行節點，沒有相依關係的節點平行執行
+        context：傳給資料集節點的參數 (例如 data_loader、stock_id)
+        targets：只需要的節點 (連同其上游)，預設全部
+        seed：已取得的節點輸出 {名稱: 值}，這些節點不再執行
+        """
+        needed = set(targets or self.nodes)
+        stack = list(needed)
+        while stack:
+            for up in self.nodes[stack.pop()].upstream:
+                if up not in needed:
+                    needed.add(up)
+                    stack.append(up)
+
+        run = PipelineRun()
+        for name, value in (seed or {}).items():
+            run.outputs[name] = value
+            run.hashes[name] = content_hash(value)
+        pending = needed - run.outputs.keys()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                progressed = False
+                for name in [n for n in pending if self.nodes[n].upstream <= run.outputs.keys()]:
+                    node = self.nodes[name]
+                    pending.discard(name)
+                    progressed = True
+                    resolved = [self._resolve(ref, run) for ref in node.inputs]
+                    args = [v for v, _ in resolved]
+
+                    if node.memo:
+                        key = content_hash([name, node.version, [h for _, h in resolved]])
+                        hit, entry = self._memo_get(key)
+                        if hit:
+                            value, digest = entry
+                            run.outputs[name] = copy.copy(value)
+                            run.hashes[name] = digest
+                            run.cached.append(name)
+                            run.timings[name] = 0.0
+                            continue
+                    else:
+                        key = None
+                    running[pool.submit(self._execute, node, args, context)] = (name, key)
+
+                if not running:
+                    if pending and progressed:
+                        # 剛才全部命中快取，回頭檢查新解鎖的節點
+                        continue
+                    if pending:
+                        raise ValueError(f"節點之間有循環相依: {sorted(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name, key = running.pop(fut)
+                    out, logs, elapsed = fut.result()
+                    if logger:
+                        for msg in logs:
+                            logger(msg)
+                    run.outputs[name] = out
+                    run.hashes[name] = content_hash(out)
+                    run.executed.append(name)
+                    run.timings[name] = elapsed
+                    if key is not None:
+                        self._memo_put(key, (copy.copy(out), run.hashes[name]))
+
+        return run
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
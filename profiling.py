@@ -0,0 +1,255 @@
+# profiling.py
+"""
+分析流程的取樣式效能剖析 (需要時才開啟)
+- 背景執行緒每隔固定時間 (預設 5 ms) 讀取 sys._current_frames()，記錄正在分析的執行緒呼叫堆疊
+- 取樣的執行緒：啟動剖析的主執行緒，以及正在執行同一次流水線 (pipeline.py) 節點的工作執行緒
+- 工作執行緒的堆疊最上層標上流水線階段名稱 (節點名稱)，主執行緒的其餘時間歸在「主流程」
+- 等待鎖 / 等待工作完成的樣本視為閒置，不列入報告 (網路 I/O 仍會列入)
+- 報告：火焰圖 (SVG)、文字呼叫樹、各階段耗時、collapsed stacks (可匯入 speedscope、flamegraph.pl)
+
+不開啟時完全不會載入本模組，分析流程沒有任何額外負擔
+
+    profiler = SamplingProfiler().start()
+    ...  # 一次分析
+    report = profiler.stop()
+"""
+import html
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+import pandas as pd
+
+SAMPLE_INTERVAL = 0.005
+MAX_DEPTH = 128
+MAIN_STAGE = '主流程'
+
+# 這些函式是堆疊最內層時表示執行緒在等待 (閒置)
+_IDLE = {('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock')}
+
+
+def _frame_label(code):
+    """函式名稱 (模組路徑)，第三方套件只保留 site-packages 之後的路徑"""
+    path = code.co_filename
+    if 'site-packages' in path:
+        path = path.split('site-packages' + os.sep, 1)[-1]
+    else:
+        path = os.path.basename(path)
+    # co_qualname 需 Python 3.11 以上，舊版只有函式名稱
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({path})"
+
+
+def _is_pipeline_frame(frame, name):
+    return frame.f_code.co_name == name and os.path.basename(frame.f_code.co_filename) == 'pipeline.py'
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.elapsed = 0.0
+        self._owner = None
+        self._base = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, _base=None):
+        """從呼叫端所在的執行緒開始剖析；呼叫端以外的外層堆疊 (例如 Streamlit 執行環境) 不列入"""
+        self._owner = threading.current_thread()
+        self._base = _base or sys._getframe(1)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止取樣並回傳報告"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        self._base = None
+        return ProfileReport(self.stacks, self.interval, self.elapsed, self.idle)
+
+    def __enter__(self):
+        return self.start(sys._getframe(1))
+
+    def __exit__(self, *exc):
+        self.report = self.stop()
+        return False
+
+    def _loop(self):
+        owner_id = self._owner.ident
+        while not self._stop.wait(self.interval):
+            if not self._owner.is_alive():
+                break
+            frames = sys._current_frames()
+            owner = frames.get(owner_id)
+            if owner is None:
+                continue
+            context = self._run_context(owner)
+            self._sample_owner(owner)
+            if context is None:
+                continue
+            for tid, frame in frames.items():
+                if tid != owner_id and tid != threading.get_ident():
+                    self._sample_worker(frame, context)
+
+    def _run_context(self, frame):
+        """主執行緒正在執行的 Pipeline.run 的 context (用來辨識同一次執行的工作執行緒)"""
+        while frame is not None:
+            if _is_pipeline_frame(frame, 'run'):
+                return frame.f_locals.get('context')
+            frame = frame.f_back
+        return None
+
+    def _record(self, stage, frames):
+        if not frames:
+            return
+        leaf = frames[0].f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE:
+            self.idle += 1
+            return
+        labels = [_frame_label(f.f_code) for f in reversed(frames[:MAX_DEPTH])]
+        self.stacks[(stage, *labels)] += 1
+        self.samples += 1
+
+    def _sample_owner(self, frame):
+        frames = []
+        base = self._base
+        while frame is not None and frame is not base:
+            frames.append(frame)
+            frame = frame.f_back
+        if frame is None:
+            # 已離開 start() 的呼叫端 (例外中斷)
+            return
+        self._record(MAIN_STAGE, frames)
+
+    def _sample_worker(self, frame, context):
+        frames = []
+        while frame is not None:
+            if _is_pipeline_frame(frame, '_execute'):
+                local = frame.f_locals
+                if local.get('context') is not context:
+                    return
+                node = local.get('node')
+                self._record(f"階段:{getattr(node, 'name', '?')}", frames)
+                return
+            frames.append(frame)
+            frame = frame.f_back
+
+
+class ProfileReport:
+    """取樣結果：stacks 為 {(階段, 外層函式, ..., 最內層函式): 樣本數}"""
+
+    def __init__(self, stacks, interval, elapsed, idle=0):
+        self.stacks = dict(stacks)
+        self.interval = interval
+        self.elapsed = elapsed
+        self.idle = idle
+        self.samples = sum(self.stacks.values())
+
+    def folded(self):
+        """collapsed stacks：每行「階段;外層;...;內層 樣本數」"""
+        lines = [';'.join(s.replace(';', ',') for s in stack) + f" {n}" for stack, n in self.stacks.items()]
+        return "\n".join(sorted(lines)) + "\n"
+
+    def stage_summary(self):
+        """各階段的樣本數、估計耗時 (樣本數 × 取樣間隔) 與占比"""
+        counts = Counter()
+        for stack, n in self.stacks.items():
+            counts[stack[0]] += n
+        df = pd.DataFrame(counts.most_common(), columns=['階段', '樣本數'])
+        df['估計耗時(秒)'] = (df['樣本數'] * self.interval).round(3)
+        df['占比'] = (df['樣本數'] / max(self.samples, 1)).round(4)
+        return df
+
+    def hot_functions(self, top=20):
+        """自身耗時 (堆疊最內層) 最多的函式"""
+        own, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            own[stack[-1]] += n
+            for label in set(stack[1:]):
+                total[label] += n
+        df = pd.DataFrame(own.most_common(top), columns=['函式', '自身樣本'])
+        df['累計樣本'] = df['函式'].map(total)
+        df['自身占比'] = (df['自身樣本'] / max(self.samples, 1)).round(4)
+        return df
+
+    def _tree(self):
+        root = {'n': 0, 'children': {}}
+        for stack, n in self.stacks.items():
+            node = root
+            node['n'] += n
+            for label in stack:
+                node = node['children'].setdefault(label, {'n': 0, 'children': {}})
+                node['n'] += n
+        return root
+
+    def call_tree(self, min_share=0.005):
+        """文字呼叫樹：累計占比、自身占比，占比低於 min_share 的分支省略"""
+        total = max(self.samples, 1)
+        lines = [f"取樣 {self.samples} 次 (每 {self.interval * 1000:.0f} ms，閒置 {self.idle} 次)，總耗時 {self.elapsed:.2f} 秒",
+                 "累計%   自身%   函式"]
+
+        def walk(label, node, depth):
+            own = node['n'] - sum(c['n'] for c in node['children'].values())
+            lines.append(f"{node['n'] / total:6.1%}  {own / total:6.1%}  {'  ' * depth}{label}")
+            for child_label, child in sorted(node['children'].items(), key=lambda kv: -kv[1]['n']):
+                if child['n'] / total >= min_share:
+                    walk(child_label, child, depth + 1)
+
+        for label, node in sorted(self._tree()['children'].items(), key=lambda kv: -kv[1]['n']):
+            walk(label, node, 0)
+        return "\n".join(lines) + "\n"
+
+    def flamegraph_svg(self, width=1200, row=17, title="分析流程火焰圖"):
+        """火焰圖 (SVG，滑鼠移到方塊上顯示函式與占比)"""
+        root = self._tree()
+        total = max(root['n'], 1)
+        rects = []
+        depth_max = 0
+
+        def color(label):
+            h = zlib.crc32(label.split(' (')[-1].encode())
+            if 'pandas' in label or 'numpy' in label:
+                return f"rgb({200 + h % 55},{120 + h % 60},{40 + h % 40})"
+            return f"rgb({230 + h % 25},{90 + h % 90},{50 + h % 30})"
+
+        def walk(label, node, x, depth):
+            nonlocal depth_max
+            w = node['n'] / total * width
+            if w < 0.3:
+                return
+            depth_max = max(depth_max, depth)
+            text = html.escape(label)
+            share = node['n'] / total
+            fill = '#7c9cbf' if depth == 0 else color(label)
+            chars = int(w / 7)
+            shown = html.escape(label if len(label) <= chars else label[:max(chars - 2, 0)] + '..') if chars >= 3 else ''
+            rects.append((depth, f'<g><title>{text} ({node["n"]} 樣本，{share:.1%})</title>'
+                                 f'<rect x="{x:.1f}" y="{{y}}" width="{w:.1f}" height="{row - 1}" fill="{fill}" rx="2"/>'
+                                 f'<text x="{x + 3:.1f}" y="{{ty}}">{shown}</text></g>'))
+            for child_label, child in sorted(node['children'].items()):
+                walk(child_label, child, x, depth + 1)
+                x += child['n'] / total * width
+
+        x = 0.0
+        for label, node in sorted(root['children'].items()):
+            walk(label, node, x, 0)
+            x += node['n'] / total * width
+
+        height = (depth_max + 1) * row + 30
+        body = []
+        for depth, g in rects:
+            # 由下往上堆疊，最外層在底部
+            y = height - (depth + 1) * row
+            body.append(g.replace('{y}', str(y)).replace('{ty}', str(y + row - 5)))
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">'
+                f'<text x="4" y="16" font-size="13">{html.escape(title)}：{self.samples} 樣本，{self.elapsed:.2f} 秒</text>'
+                + "".join(body) + '</svg>')
@@ -0,0 +1,91 @@
+# ranking.py
+"""
+產業內相對排名
+策略模組的門檻都是絕對值 (例如營益率 >= 3.5%、ROE >= 15%)，薄利的代工廠與 IC 設計會被同一把尺衡量
+這裡改以同產業的百分位數 (PR) 評分：每項指標在同產業中贏過多少比例的公司
+"""
+import numpy as np
+import pandas as pd
+
+# 排名指標：欄位 → (顯示名稱, 權重)，皆為數值越大越好
+RANK_METRICS = {
+    '近三月平均YoY': ('營收動能', 0.25),
+    'latest_opm': ('營益率', 0.20),
+    '最新ROE': ('ROE', 0.20),
+    '三年EPS複合成長率': ('EPS成長', 0.15),
+    'PE折價': ('本益比折價', 0.20),
+}
+
+# 同產業少於此家數時，改用全市場百分位數 (樣本太少的 PR 沒有意義)
+MIN_PEERS = 3
+
+RANK_SOURCE_COLS = ['股票代號', '產業別', '近三月平均YoY', 'latest_opm', '最新ROE', '三年EPS複合成長率', '目前本益比', '歷史平均PE']
+
+
+def compute_industry_ranks(df, stock_map=None, min_peers=MIN_PEERS):
+    """
+    df：每檔股票一列，需有 RANK_SOURCE_COLS 欄位 (ResultSet.frame() 或資料倉儲 scores 表)
+    stock_map：權值股白名單，有列入的股票以白名單的產業別為準
+    回傳以 股票代號 為索引的 DataFrame：各指標 PR (0~100)、產業相對分、產業排名
+    """
+    df = df.reset_index(drop=True)
+    industry = df['產業別'].astype(object)
+    if stock_map:
+        listed = df['股票代號'].map(lambda s: (stock_map.get(s) or {}).get('industry'))
+        industry = listed.where(listed.notna(), industry)
+    industry = industry.fillna('未知產業')
+
+    # 本益比折價：目前本益比低於自身歷史平均的幅度 (越便宜越大)
+    avg_pe = df['歷史平均PE'].where(df['歷史平均PE'] > 0)
+    cur_pe = df['目前本益比'].where(df['目前本益比'] > 0)
+    values = pd.DataFrame({
+        '近三月平均YoY': df['近三月平均YoY'],
+        'latest_opm': df['latest_opm'],
+        '最新ROE': df['最新ROE'],
+        '三年EPS複合成長率': df['三年EPS複合成長率'],
+        'PE折價': 1 - cur_pe / avg_pe,
+    }).astype('float64')
+
+    # 一次對所有指標做分組排名
+    pct = values.groupby(industry.values).rank(pct=True)
+    peers = industry.map(industry.value_counts())
+    small = (peers < min_peers).to_numpy()
+    if small.any():
+        pct.loc[small] = values.rank(pct=True).loc[small]
+
+    weights = np.array([w for _, w in RANK_METRICS.values()])
+    pr = pct[list(RANK_METRICS)].to_numpy()
+    valid = ~np.isnan(pr)
+    # 缺值指標不計入，權重依剩餘指標重新分配
+    w_sum = (valid * weights).sum(axis=1)
+    score = np.where(w_sum > 0, np.nansum(pr * weights, axis=1) / np.where(w_sum > 0, w_sum, 1) * 100, np.nan)
+
+    out = (pct * 100).round(1).rename(columns={k: f"{label}PR" for k, (label, _) in RANK_METRICS.items()})
+    out.insert(0, '排名產業', industry.values)
+    out['同業家數'] = peers.values
+    out['產業相對分'] = np.round(score, 1)
+    rank = pd.Series(score).groupby(industry.values).rank(ascending=False, method='min')
+    out['產業排名'] = [f"{int(r)}/{n}" if r == r else None for r, n in zip(rank, peers)]
+    out.index = df['股票代號'].astype(str).values
+    out.index.name = '股票代號'
+    return out
+
+
+def rank_universe(result_set, warehouse=None, stock_map=None):
+    """
+    以資料倉儲中所有分析過的股票作為比較母體 (本次結果優先)，沒有資料倉儲時只用本次結果
+    回傳 compute_industry_ranks 的結果，只保留本次結果中的股票
+    """
+    df = result_set.frame(RANK_SOURCE_COLS)
+    if warehouse is not None:
+        try:
+            cols = ', '.join(f'"{c}"' for c in RANK_SOURCE_COLS)
+            stored = warehouse.query(f"SELECT {cols} FROM scores")
+            stored = stored[~stored['股票代號'].isin(result_set.stock_ids)]
+            if not stored.empty:
+                df = pd.concat([df.astype({'產業別': object}), stored], ignore_index=True)
+        except Exception:
+            pass
+
+    ranks = compute_industry_ranks(df, stock_map=stock_map)
+    return ranks.loc[ranks.index.isin(result_set.stock_ids)]
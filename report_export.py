@@ -0,0 +1,185 @@
+# report_export.py
+import os
+import tempfile
+
+import pandas as pd
+import xlsxwriter
+
+from result_store import RESULT_SCHEMA
+
+# 各維度分頁對應的結果表階段
+STAGE_SHEETS = {
+    '成長性': 'growth',
+    '獲利性': 'profit',
+    '股東報酬': 'shareholder',
+    '估值': 'valuation',
+}
+
+SUMMARY_COLS = ['股票代號', '股票名稱', '產業別', 'MasterScore', '成長總分', 'total_score', '股東報酬與獲利分',
+                '目前股價', '便宜價', '合理價', '昂貴價', '目標價', '價值評估', '最終總評']
+
+# 英文欄位在報表上的顯示名稱
+HEADER_MAP = {
+    'MasterScore': '綜合評分',
+    'total_score': '獲利總分',
+    'latest_gpm': '最新毛利率',
+    'gpm_growth': '毛利率季增(%)',
+    'latest_opm': '最新營益率',
+    'opm_growth': '營益率季增(%)',
+    'avg_4q_gpm': '近4季平均毛利率',
+    'avg_4q_opm': '近4季平均營益率',
+    'slope_gpm_8q': '毛利率8季斜率',
+    'slope_opm_8q': '營益率8季斜率',
+    'profit_improvement': '利潤改善幅度',
+    'opm_gpm_trend': '獲利效率檢核',
+    'four_q': '成長品質矩陣',
+    'four_r': '利潤率趨勢導航',
+    'profit_score': '利潤分',
+    'profitImp_score': '利潤改善分',
+    'action': '獲利含金量總評',
+}
+
+# 以比率 (0.123 = 12.3%) 保存的欄位，套用百分比格式
+PCT_COLS = {
+    '最新單月營收年增', '近三月平均YoY', '近六月平均YoY', '近六月標準差', '趨勢值', '爆發值', '體質值', '推估下一年度成長率',
+    'latest_gpm', 'latest_opm', 'avg_4q_gpm', 'avg_4q_opm', 'profit_improvement',
+    '最新ROE', '近四年平均ROE', '三年EPS複合成長率', '美債殖利率',
+    '單月年增', '累計年增', 'GPM', 'OPM', 'ROE',
+}
+INT_COLS = {'營收', '年度', '已公佈季數', '趨勢分', '爆發分', '體質分', '穩定分', 'profit_score', 'profitImp_score'}
+PRICE_COLS = {'目前股價', '股票目前淨值', '便宜價', '合理價', '昂貴價', '目標價', '推估eps', '最新EPS', 'EPS'}
+
+# 原始序列分頁：分頁名稱 → (payload 種類, [(來源欄位, 顯示名稱)])
+SERIES_SHEETS = {
+    '月營收': ('revenue', [('date', '日期'), ('revenue', '營收'), ('Mon_YoY', '單月年增'), ('Cum_YoY', '累計年增')]),
+    '季利潤率': ('margin', [('date', '日期'), ('GPM', 'GPM'), ('OPM', 'OPM')]),
+    '年度ROE_EPS': ('annual', [('year', '年度'), ('ROE', 'ROE'), ('EPS', 'EPS'), ('q_count', '已公佈季數'), ('is_projected', '年度化推估')]),
+}
+
+
+# Excel 日期序號的起點
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+
+def _column_values(s):
+    """
+    把一整欄轉成可直接寫入的 Python 值 (整欄一次轉換，不逐格判斷)
+    日期轉為 Excel 日期序號，缺值轉為 None
+    """
+    if s.dtype.kind == 'M':
+        s = (s - EXCEL_EPOCH) / pd.Timedelta(days=1)
+    return s.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def _write(ws, r, c, value, fmt=None):
+    """依值的型別寫入儲存格，缺值不寫 (保持空白)"""
+    if value is None:
+        return
+    if isinstance(value, bool):
+        ws.write_boolean(r, c, value)
+    elif isinstance(value, (int, float)):
+        ws.write_number(r, c, value, fmt)
+    else:
+        ws.write_string(r, c, str(value), fmt)
+
+
+class ExcelReport:
+    """
+    以 xlsxwriter constant_memory 串流模式輸出多分頁報表 (前期為 0 的成長率 inf 寫成 #DIV/0! 等錯誤值，不中斷輸出)
+    每個分頁依列順序寫完才換下一頁，記憶體只保留當前一列
+    """
+
+    def __init__(self, path):
+        self.wb = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+        self.fmt_header = self.wb.add_format({'bold': True, 'bg_color': '#DCE6F1', 'border': 1})
+        self.fmt_pct = self.wb.add_format({'num_format': '0.0%'})
+        self.fmt_price = self.wb.add_format({'num_format': '#,##0.00'})
+        self.fmt_int = self.wb.add_format({'num_format': '#,##0'})
+        self.fmt_num = self.wb.add_format({'num_format': '0.00'})
+        self.fmt_date = self.wb.add_format({'num_format': 'yyyy-mm-dd'})
+
+    def _col_format(self, col):
+        if col in PCT_COLS:
+            return self.fmt_pct
+        if col in PRICE_COLS:
+            return self.fmt_price
+        if col in INT_COLS:
+            return self.fmt_int
+        if col == '日期':
+            return self.fmt_date
+        return self.fmt_num
+
+    def write_table(self, name, columns, rows, headers=None):
+        """columns：欄位名稱；rows：依序產生每一列值的 iterable"""
+        ws = self.wb.add_worksheet(name)
+        headers = headers or [HEADER_MAP.get(c, c) for c in columns]
+        fmts = [self._col_format(c) for c in columns]
+
+        for c, h in enumerate(headers):
+            ws.write_string(0, c, h, self.fmt_header)
+            ws.set_column(c, c, max(10, min(len(h) * 2 + 2, 40)))
+        ws.freeze_panes(1, 1)
+
+        r = 0
+        for r, values in enumerate(rows, start=1):
+            for c, value in enumerate(values):
+                _write(ws, r, c, value, fmts[c])
+        if r:
+            ws.autofilter(0, 0, r, len(columns) - 1)
+        return r
+
+    def close(self):
+        self.wb.close()
+
+
+def _frame_rows(df):
+    """逐列產生 DataFrame 的值"""
+    return zip(*[_column_values(df[c]) for c in df.columns])
+
+
+def _series_rows(result_set, kind, fields):
+    """依股票順序逐檔展開原始序列，一次只取一檔的資料"""
+    for stock_id in result_set.stock_ids:
+        df = result_set.payloads.get(kind, stock_id)
+        if df is None or df.empty:
+            continue
+        cols = [_column_values(df[f]) if f in df.columns else [None] * len(df) for f, _ in fields]
+        for values in zip(*cols):
+            yield (stock_id, *values)
+
+
+def write_report(result_set, path, logger=None):
+    """
+    輸出完整報表：總表、各策略維度分頁、月營收/季利潤率/年度 ROE 與 EPS 原始序列
+    回傳各分頁寫入的列數
+    """
+    report = ExcelReport(path)
+    counts = {}
+    try:
+        summary = result_set.frame(SUMMARY_COLS)
+        counts['總表'] = report.write_table('總表', SUMMARY_COLS, _frame_rows(summary))
+
+        for sheet, stage in STAGE_SHEETS.items():
+            cols = ['股票代號', '股票名稱'] + [c for c, (s, _) in RESULT_SCHEMA.items() if s == stage]
+            counts[sheet] = report.write_table(sheet, cols, _frame_rows(result_set.frame(cols)))
+
+        for sheet, (kind, fields) in SERIES_SHEETS.items():
+            cols = ['股票代號'] + [label for _, label in fields]
+            counts[sheet] = report.write_table(sheet, cols, _series_rows(result_set, kind, fields))
+            if logger: logger(f"📑 報表分頁 {sheet} 寫入 {counts[sheet]} 列")
+    finally:
+        report.close()
+
+    return counts
+
+
+def export_report_bytes(result_set, logger=None):
+    """寫到暫存檔後讀回位元組 (constant_memory 模式不支援直接寫入記憶體)"""
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_report(result_set, path, logger=logger)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
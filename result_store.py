@@ -0,0 +1,298 @@
+# result_store.py
+import numpy as np
+import pandas as pd
+
+# 結果表欄位定義：欄位名稱 → (來源階段, 型別)
+# 欄位名稱必須唯一，各階段輸出若出現同名欄位會在寫入時直接報錯，不再被 {**a, **b} 默默覆蓋
+# 型別：float64 / int16 為固定數值型別，cat 為字典編碼的文字 (評語類文字重複度高)
+RESULT_SCHEMA = {
+    # 基本資料
+    '股票代號': ('info', 'str'),
+    '股票名稱': ('info', 'str'),
+    '產業別': ('info', 'cat'),
+    'ui_key': ('info', 'str'),
+
+    # 策略 A：成長性 (strategy_growth)
+    '最新單月營收年增': ('growth', 'float64'),
+    '營收年增成長': ('growth', 'float64'),
+    '日期': ('growth', 'cat'),
+    '近三月平均YoY': ('growth', 'float64'),
+    '近六月平均YoY': ('growth', 'float64'),
+    '近六月標準差': ('growth', 'float64'),
+    '趨勢值': ('growth', 'float64'),
+    '趨勢txt': ('growth', 'cat'),
+    '趨勢分': ('growth', 'int16'),
+    '爆發值': ('growth', 'float64'),
+    '爆發力txt': ('growth', 'cat'),
+    '爆發分': ('growth', 'int16'),
+    '體質值': ('growth', 'float64'),
+    '體質txt': ('growth', 'cat'),
+    '體質分': ('growth', 'int16'),
+    '狀態診斷': ('growth', 'cat'),
+    '投資含金量': ('growth', 'cat'),
+    '穩定分': ('growth', 'int16'),
+    '成長總分': ('growth', 'float64'),
+    '成長總分建議': ('growth', 'cat'),
+    '推估下一年度成長率': ('growth', 'float64'),
+
+    # 策略 B：獲利性 (strategy_profit)
+    'latest_gpm': ('profit', 'float64'),
+    'gpm_growth': ('profit', 'float64'),
+    'latest_opm': ('profit', 'float64'),
+    'opm_growth': ('profit', 'float64'),
+    'avg_4q_gpm': ('profit', 'float64'),
+    'avg_4q_opm': ('profit', 'float64'),
+    'slope_gpm_8q': ('profit', 'float64'),
+    'slope_opm_8q': ('profit', 'float64'),
+    'std_opm_8q': ('profit', 'float64'),
+    'profit_improvement': ('profit', 'float64'),
+    'opm_gpm_trend': ('profit', 'cat'),
+    'four_q': ('profit', 'cat'),
+    'four_r': ('profit', 'cat'),
+    'profit_score': ('profit', 'int16'),
+    'profitImp_score': ('profit', 'int16'),
+    'total_score': ('profit', 'float64'),
+    'action': ('profit', 'cat'),
+
+    # 策略 C：股東報酬 (strategy_shareholder)
+    '最新ROE': ('shareholder', 'float64'),
+    'ROE成長': ('shareholder', 'float64'),
+    '最新EPS': ('shareholder', 'float64'),
+    'EPS成長': ('shareholder', 'float64'),
+    '近四年平均ROE': ('shareholder', 'float64'),
+    '三年EPS複合成長率': ('shareholder', 'float64'),
+    '獲利轉化效率偵測': ('shareholder', 'cat'),
+    '推估eps': ('shareholder', 'float64'),
+    '股東報酬與獲利分': ('shareholder', 'float64'),
+    'MasterScore': ('shareholder', 'float64'),
+    '最終總評': ('shareholder', 'cat'),
+
+    # 策略 D：估值 (strategy_valuation)
+    '目前股價': ('valuation', 'float64'),
+    '股票目前淨值': ('valuation', 'float64'),
+    '目前本益比': ('valuation', 'float64'),
+    '歷史最高PE': ('valuation', 'float64'),
+    '歷史最低PE': ('valuation', 'float64'),
+    '歷史平均PE': ('valuation', 'float64'),
+    '歷史PE標準差': ('valuation', 'float64'),
+    '便宜價': ('valuation', 'float64'),
+    '合理價': ('valuation', 'float64'),
+    '昂貴價': ('valuation', 'float64'),
+    '美債殖利率': ('valuation', 'float64'),
+    '目標價': ('valuation', 'float64'),
+    '價值評估': ('valuation', 'cat'),
+}
+
+# 策略的狀態訊息 (例如獲利性「資料不足」)，不寫入結果表
+IGNORED_KEYS = {'status'}
+
+# 缺值表示方式：int16 沒有 NaN，用最小值當作缺值標記
+INT_NA = np.iinfo(np.int16).min
+
+
+class PayloadStore:
+    """
+    大型資料 (原始序列等) 的存放區，不放進結果表
+    以 "種類/股票代號" 作為代號 (ref)，需要時再依代號取用
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    def put(self, kind, stock_id, obj):
+        ref = f"{kind}/{stock_id}"
+        self._items[ref] = obj
+        return ref
+
+    def get(self, kind, stock_id, default=None):
+        return self._items.get(f"{kind}/{stock_id}", default)
+
+    def update(self, other):
+        self._items.update(other._items)
+
+    def memory_usage(self):
+        """所有 DataFrame 實際佔用的位元組數"""
+        return int(sum(obj.memory_usage(deep=True).sum() for obj in self._items.values() if isinstance(obj, pd.DataFrame)))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class StockResult:
+    """單一股票結果的輕量視圖，數值實際存放在 ResultSet 的欄式陣列中"""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    @property
+    def stock_id(self):
+        return self._table.value(self._row, '股票代號')
+
+    def get(self, key, default=None):
+        if key == '股票':
+            return f"{self.get('股票名稱')} ({self.get('股票代號')})"
+        if key not in RESULT_SCHEMA:
+            return default
+        value = self._table.value(self._row, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key != '股票' and key not in RESULT_SCHEMA:
+            raise KeyError(key)
+        return self.get(key)
+
+    def to_dict(self):
+        return {k: self.get(k) for k in ['股票', *self._table.columns]}
+
+
+class ResultSet:
+    """
+    一次分析的所有結果，以欄式陣列保存
+    數值欄為固定型別的 numpy 陣列，文字欄以字典編碼 (codes + 詞彙表) 保存
+    """
+
+    def __init__(self, capacity=64):
+        self.columns = list(RESULT_SCHEMA.keys())
+        self.payloads = PayloadStore()
+        self.version = 0
+        self._n = 0
+        self._index = {}
+        self._vocab = {}
+        self._categories = {}
+        self._arrays = {}
+        for col, (_, kind) in RESULT_SCHEMA.items():
+            self._arrays[col] = self._empty(kind, capacity)
+            if kind == 'cat':
+                self._vocab[col] = {}
+                self._categories[col] = []
+
+    @staticmethod
+    def _empty(kind, size):
+        if kind == 'float64':
+            return np.full(size, np.nan, dtype='float64')
+        if kind == 'int16':
+            return np.full(size, INT_NA, dtype='int16')
+        if kind == 'cat':
+            return np.full(size, -1, dtype='int32')
+        return np.empty(size, dtype=object)
+
+    def _grow(self):
+        for col, (_, kind) in RESULT_SCHEMA.items():
+            old = self._arrays[col]
+            new = self._empty(kind, len(old) * 2)
+            new[:len(old)] = old
+            self._arrays[col] = new
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return (StockResult(self, i) for i in range(self._n))
+
+    def __contains__(self, stock_id):
+        return stock_id in self._index
+
+    @property
+    def stock_ids(self):
+        return list(self._index.keys())
+
+    def append(self, info, **stages):
+        """
+        寫入一檔股票的結果
+        info：基本資料 (股票代號、股票名稱、產業別、ui_key)
+        stages：各策略階段輸出，例如 growth=res_growth, profit=res_profit
+        """
+        row = {}
+        for stage, values in [('info', info), *stages.items()]:
+            for key, value in (values or {}).items():
+                spec = RESULT_SCHEMA.get(key)
+                if spec is None:
+                    if key in IGNORED_KEYS:
+                        continue
+                    raise ValueError(f"欄位 {key} ({stage} 階段) 不在 RESULT_SCHEMA 中，新增的策略輸出請先加入欄位定義")
+                if spec[0] != stage:
+                    raise ValueError(f"欄位 {key} 屬於 {spec[0]} 階段，不可由 {stage} 階段寫入")
+                row[key] = value
+
+        stock_id = row.get('股票代號')
+        if stock_id in self._index:
+            raise ValueError(f"{stock_id} 已存在於結果表中")
+
+        if self._n == len(self._arrays['股票代號']):
+            self._grow()
+
+        i = self._n
+        for key, value in row.items():
+            self._arrays[key][i] = self._encode(key, value)
+
+        self._index[stock_id] = i
+        self._n += 1
+        self.version += 1
+        return StockResult(self, i)
+
+    def extend(self, other):
+        """併入另一個 ResultSet (例如多程序批次中各工作程序的結果)，含 payloads"""
+        for rec in other:
+            values = rec.to_dict()
+            stages = {}
+            for key, (stage, _) in RESULT_SCHEMA.items():
+                stages.setdefault(stage, {})[key] = values[key]
+            info = stages.pop('info')
+            self.append(info, **stages)
+        self.payloads.update(other.payloads)
+
+    def _encode(self, key, value):
+        kind = RESULT_SCHEMA[key][1]
+        if value is None:
+            return self._empty(kind, 1)[0]
+        if kind == 'cat':
+            vocab = self._vocab[key]
+            text = str(value)
+            if text not in vocab:
+                vocab[text] = len(vocab)
+                self._categories[key].append(text)
+            return vocab[text]
+        if kind == 'int16':
+            return int(value)
+        if kind == 'float64':
+            return float(value)
+        return value
+
+    def value(self, row, key):
+        kind = RESULT_SCHEMA[key][1]
+        raw = self._arrays[key][row]
+        if kind == 'cat':
+            return self._categories[key][raw] if raw >= 0 else None
+        if kind == 'int16':
+            return None if raw == INT_NA else int(raw)
+        if kind == 'float64':
+            return None if np.isnan(raw) else float(raw)
+        return raw
+
+    def record(self, stock_id):
+        i = self._index.get(stock_id)
+        return None if i is None else StockResult(self, i)
+
+    def frame(self, columns=None):
+        """
+        以欄式陣列直接組成 DataFrame
+        數值欄直接引用底層陣列切片 (不複製)，文字欄轉成 Categorical
+        """
+        n = self._n
+        data = {}
+        for col in columns or self.columns:
+            kind = RESULT_SCHEMA[col][1]
+            arr = self._arrays[col][:n]
+            if kind == 'cat':
+                data[col] = pd.Categorical.from_codes(arr, categories=self._categories[col])
+            elif kind == 'int16':
+                data[col] = pd.arrays.IntegerArray(arr, arr == INT_NA)
+            else:
+                data[col] = arr
+        return pd.DataFrame(data, copy=False)
+
+    def memory_usage(self):
+        """結果表實際佔用的位元組數 (不含 payloads)"""
+        return int(self.frame().memory_usage(deep=True).sum())
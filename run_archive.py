@@ -0,0 +1,364 @@
+# run_archive.py
+"""
+分析結果封存 (Parquet，zstd 壓縮)
+- 每次分析寫成一個檔案：archive/results/date=YYYY-MM-DD/run_<run_id>.parquet
+  內容為完整結果表 + run_id / run_at / source，以及各資料集輸入切片的參照 (input_<節點>)
+- 輸入切片 (策略實際使用的資料集節點輸出) 在分析過程中由 InputRecorder 收集，以 Arrow IPC 序列化，
+  每個節點合併寫成 archive/inputs/<節點>/<檔案代號>.parquet (digest, data)；內容雜湊與 pipeline.content_hash 相同，
+  之前封存過的切片不再重複寫入，結果表中的 input_<節點> 為切片參照 "<檔案代號>/<雜湊>"
+  結果表的 payloads 只存參照，切片本身寫出後就釋放，不留在工作階段的記憶體中
+- 結果表依股票代號排序、每 ROW_GROUP_SIZE 檔一個 row group：
+  查詢單檔股票的歷史時，日期分區與 row group 的最小/最大值統計讓每個檔案只讀取一個 row group
+- 重新開啟歷史分析 (open_run) 時還原成 ResultSet，原始序列依需要才從輸入切片載入；
+  replay_stock 以封存的輸入重新執行策略，可確認過去的建議是否可重現
+
+以環境變數 STOCK_ARCHIVE_DIR 指定封存目錄，設為空字串則停用
+"""
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from result_store import RESULT_SCHEMA, PayloadStore, ResultSet
+from warehouse import taipei_now
+
+ARCHIVE_DIR = os.environ.get('STOCK_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 64
+SLICE_ROW_GROUP_SIZE = 32
+# InputRecorder 暫存的新切片達到此數量就先寫出一個檔案
+FLUSH_SLICES = 2000
+
+# 與 analysis.INPUT_NODES 相同 (不在此匯入 analysis，避免載入策略模組)
+INPUT_NODES = ('revenue', 'profitability', 'annual', 'price', 'bond', 'pe_band')
+
+_ARROW_TYPES = {'float64': pa.float64(), 'int16': pa.int16(), 'cat': pa.string(), 'str': pa.string()}
+RUN_SCHEMA = pa.schema(
+    [('run_id', pa.string()), ('run_at', pa.timestamp('s')), ('source', pa.string())]
+    + [(c, _ARROW_TYPES[kind]) for c, (_, kind) in RESULT_SCHEMA.items()]
+    + [(f'input_{name}', pa.string()) for name in INPUT_NODES]
+)
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+
+def enabled(archive_dir=ARCHIVE_DIR):
+    return bool(archive_dir)
+
+
+def _write_atomic(table, path, **kwargs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    pq.write_table(table, tmp, compression=COMPRESSION, **kwargs)
+    os.replace(tmp, path)
+
+
+def _scalar(v):
+    """NumPy 純量轉成 Python 值 (NaN 保持 NaN，重現時才會與封存前相同)"""
+    return v.item() if isinstance(v, np.generic) else v
+
+
+def _encode(obj):
+    """輸入切片序列化為 Arrow IPC (保留 pandas 型別與索引)；dict / 純量轉成單列表格"""
+    if isinstance(obj, pd.DataFrame):
+        kind, table = 'frame', pa.Table.from_pandas(obj, preserve_index=True)
+    elif isinstance(obj, dict):
+        kind, table = 'dict', pa.Table.from_pandas(pd.DataFrame([obj]), preserve_index=False)
+    else:
+        kind, table = 'scalar', pa.table({'value': [_scalar(obj)]})
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'archive_kind': kind.encode()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _decode(buf):
+    table = pa.ipc.open_stream(buf).read_all()
+    kind = (table.schema.metadata or {}).get(b'archive_kind', b'frame').decode()
+    if kind == 'dict':
+        return {k: _scalar(v) for k, v in table.to_pandas().iloc[0].items()}
+    if kind == 'scalar':
+        return table['value'][0].as_py()
+    return table.to_pandas()
+
+
+# 已封存的輸入切片 {封存目錄: {節點: {雜湊: 參照}}}，第一次寫入時掃描既有檔案建立
+_known = {}
+_known_lock = threading.Lock()
+
+
+def _slice_path(archive_dir, node, file_id):
+    return os.path.join(archive_dir, 'inputs', node, f"{file_id}.parquet")
+
+
+def _known_slices(archive_dir, node):
+    """已封存的切片雜湊 → 參照 (呼叫端持有 _known_lock)"""
+    nodes = _known.setdefault(os.path.abspath(archive_dir), {})
+    if node not in nodes:
+        known = {}
+        folder = os.path.join(archive_dir, 'inputs', node)
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if name.endswith('.parquet'):
+                file_id = name[:-8]
+                for digest in pq.read_table(os.path.join(folder, name), columns=['digest'])['digest'].to_pylist():
+                    known.setdefault(digest, f"{file_id}/{digest}")
+        nodes[node] = known
+    return nodes[node]
+
+
+def _new_id(now=None):
+    return f"{(now or taipei_now()):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def known_ref(archive_dir, node, digest):
+    """已封存切片的參照，沒有時回傳 None"""
+    with _known_lock:
+        return _known_slices(archive_dir, node).get(digest)
+
+
+def write_slices(archive_dir, node, file_id, items):
+    """
+    items：{雜湊: 切片}，全部合併寫成 inputs/<節點>/<file_id>.parquet 一個檔案
+    依雜湊排序、小 row group，讀取單一切片時只讀到一個 row group
+    """
+    digests = sorted(items)
+    table = pa.table({'digest': digests, 'data': pa.array([_encode(items[d]) for d in digests], type=pa.binary())})
+    _write_atomic(table, _slice_path(archive_dir, node, file_id), row_group_size=SLICE_ROW_GROUP_SIZE)
+    with _known_lock:
+        known = _known_slices(archive_dir, node)
+        for d in digests:
+            known.setdefault(d, f"{file_id}/{d}")
+
+
+class InputRecorder:
+    """
+    收集一次分析的輸入切片 (analysis.analyze_stock 的 recorder)
+    record() 回傳各節點的參照；之前封存過的切片直接沿用舊參照，其餘暫存，
+    累積 FLUSH_SLICES 份或呼叫 flush() 時寫出 (每個節點一個檔案)，寫出後即釋放
+    多程序批次中每個工作程序各用一個，參照在寫出後即可跨程序使用
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, flush_at=FLUSH_SLICES):
+        self.archive_dir = archive_dir
+        self.flush_at = flush_at
+        self.written = 0
+        self._pending = {}
+        self._n_pending = 0
+        self._file_id = _new_id()
+        self._lock = threading.Lock()
+
+    def record(self, inputs):
+        """inputs：{節點: (雜湊, 切片)}；回傳 {節點: 參照}"""
+        refs = {}
+        with self._lock:
+            for name, (digest, obj) in inputs.items():
+                pending = self._pending.setdefault(name, {})
+                ref = None if digest in pending else known_ref(self.archive_dir, name, digest)
+                if ref is None:
+                    if digest not in pending:
+                        pending[digest] = obj
+                        self._n_pending += 1
+                    ref = f"{self._file_id}/{digest}"
+                refs[name] = ref
+            if self._n_pending >= self.flush_at:
+                self._flush()
+        return refs
+
+    def flush(self):
+        """寫出暫存的切片，回傳累計寫入的切片數"""
+        with self._lock:
+            self._flush()
+        return self.written
+
+    def _flush(self):
+        for name, items in self._pending.items():
+            if items:
+                write_slices(self.archive_dir, name, self._file_id, items)
+        self.written += self._n_pending
+        self._pending, self._n_pending = {}, 0
+        self._file_id = _new_id()
+
+
+def input_recorder(archive_dir=ARCHIVE_DIR):
+    """封存啟用時回傳新的 InputRecorder，停用時回傳 None (分析時不收集輸入)"""
+    return InputRecorder(archive_dir) if enabled(archive_dir) else None
+
+
+def load_slice(node, ref, archive_dir=ARCHIVE_DIR):
+    """依參照讀回輸入切片 (DataFrame、dict 或純量)，找不到時回傳 None"""
+    if not isinstance(ref, str) or '/' not in ref:
+        return None
+    file_id, digest = ref.split('/', 1)
+    path = _slice_path(archive_dir, node, file_id)
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path, filters=[('digest', '=', digest)])
+    return _decode(table['data'][0].as_py()) if table.num_rows else None
+
+
+def archive_run(results, source='app', recorder=None, archive_dir=ARCHIVE_DIR, run_at=None, logger=None):
+    """
+    封存一次分析的結果表，回傳 run_id；停用或沒有結果時回傳 None
+    recorder：分析時使用的 InputRecorder (先寫出暫存的輸入切片)；沒有時 input_<節點> 為空
+    """
+    if not enabled(archive_dir) or not len(results):
+        return None
+    written = recorder.flush() if recorder is not None else 0
+    run_at = (run_at or taipei_now()).replace(microsecond=0)
+    run_id = _new_id(run_at)
+
+    df = results.frame()
+    for c, (_, kind) in RESULT_SCHEMA.items():
+        if kind == 'cat':
+            df[c] = df[c].astype(object).where(df[c].notna(), None)
+
+    # 輸入切片的參照 (analyze_stock 以 recorder 記錄於 payloads)
+    refs = [results.payloads.get('inputs', sid) or {} for sid in df['股票代號']]
+    for name in INPUT_NODES:
+        df[f'input_{name}'] = [r.get(name) for r in refs]
+    df.insert(0, 'source', source)
+    df.insert(0, 'run_at', pd.Timestamp(run_at))
+    df.insert(0, 'run_id', run_id)
+    df = df.sort_values('股票代號', ignore_index=True)
+
+    table = pa.Table.from_pandas(df, schema=RUN_SCHEMA, preserve_index=False)
+    path = os.path.join(archive_dir, 'results', f"date={run_at:%Y-%m-%d}", f"run_{run_id}.parquet")
+    _write_atomic(table, path, row_group_size=ROW_GROUP_SIZE)
+    if logger:
+        logger(f"🗄️ 已封存本次分析 {run_id}：{len(df)} 檔結果" + (f"，新增 {written} 份輸入切片" if recorder is not None else ""))
+    return run_id
+
+
+def _dataset(archive_dir):
+    root = os.path.join(archive_dir, 'results')
+    if not os.path.isdir(root):
+        return None
+    return ds.dataset(root, format='parquet', partitioning=PARTITIONING, schema=RUN_SCHEMA.append(pa.field('date', pa.string())))
+
+
+def list_runs(archive_dir=ARCHIVE_DIR):
+    """所有封存的分析 (新到舊)：run_id、run_at、source、檔數、檔案大小；只讀取檔尾的統計資訊"""
+    rows = []
+    root = os.path.join(archive_dir, 'results')
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not (name.startswith('run_') and name.endswith('.parquet')):
+                continue
+            path = os.path.join(dirpath, name)
+            meta = pq.read_metadata(path)
+            # run_at、source 全檔相同，取第一個 row group 的統計值即可
+            info = {'run_at': None, 'source': None}
+            for i, col in enumerate(info, start=1):
+                stats = meta.row_group(0).column(i).statistics if meta.num_row_groups else None
+                info[col] = stats.min if stats is not None and stats.has_min_max else None
+            rows.append({'run_id': name[4:-8], **info, '檔數': meta.num_rows,
+                         '大小(KB)': round(os.path.getsize(path) / 1024, 1), 'path': path})
+    df = pd.DataFrame(rows, columns=['run_id', 'run_at', 'source', '檔數', '大小(KB)', 'path'])
+    return df.sort_values(['run_at', 'run_id'], ascending=False, ignore_index=True)
+
+
+def _run_path(run_id, archive_dir):
+    day = f"{run_id[:4]}-{run_id[4:6]}-{run_id[6:8]}"
+    return os.path.join(archive_dir, 'results', f"date={day}", f"run_{run_id}.parquet")
+
+
+def load_run(run_id, archive_dir=ARCHIVE_DIR, columns=None):
+    """讀出一次封存的結果表"""
+    return pq.read_table(_run_path(run_id, archive_dir), columns=columns).to_pandas()
+
+
+def stock_history(stock_id, start=None, end=None, columns=None, archive_dir=ARCHIVE_DIR):
+    """
+    單檔股票在各次封存分析中的結果 (依 run_at 排序)
+    start / end 為日期字串 (YYYY-MM-DD)，以日期分區過濾；股票代號以 row group 統計過濾
+    """
+    dataset = _dataset(archive_dir)
+    if dataset is None:
+        return pd.DataFrame()
+    expr = ds.field('股票代號') == str(stock_id)
+    if start:
+        expr &= ds.field('date') >= start
+    if end:
+        expr &= ds.field('date') <= end
+    cols = None if columns is None else list(dict.fromkeys(['run_id', 'run_at', '股票代號', *columns]))
+    df = dataset.to_table(columns=cols, filter=expr).to_pandas()
+    return df.sort_values('run_at', ignore_index=True)
+
+
+class ArchivedPayloads(PayloadStore):
+    """封存分析的 payloads：原始序列在第一次取用時才從輸入切片載入"""
+
+    def __init__(self, refs, archive_dir):
+        super().__init__()
+        self._refs = refs
+        self._archive_dir = archive_dir
+
+    def get(self, kind, stock_id, default=None):
+        ref = f"{kind}/{stock_id}"
+        if ref not in self._items and stock_id in self._refs:
+            self._load(stock_id)
+        return self._items.get(ref, default)
+
+    def _load(self, stock_id):
+        from analysis import put_payloads
+
+        refs = self._refs.pop(stock_id)
+        self._items[f"inputs/{stock_id}"] = refs
+        frames = [load_slice(name, refs[name], self._archive_dir) if name in refs else None
+                  for name in ('revenue', 'profitability', 'annual')]
+        if all(isinstance(f, pd.DataFrame) for f in frames):
+            put_payloads(_PayloadTarget(self), stock_id, *frames)
+
+
+class _PayloadTarget:
+    """讓 analysis.put_payloads 寫入 ArchivedPayloads"""
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+
+def open_run(run_id, archive_dir=ARCHIVE_DIR):
+    """把封存的分析還原成 ResultSet (排行榜、個股詳情與報表皆可直接使用)"""
+    df = load_run(run_id, archive_dir)
+    results = ResultSet(capacity=max(len(df), 1))
+    cols = list(RESULT_SCHEMA)
+    values = df[cols].astype(object).where(df[cols].notna(), None)
+    for row in values.to_dict('records'):
+        stages = {}
+        for key, (stage, _) in RESULT_SCHEMA.items():
+            stages.setdefault(stage, {})[key] = row[key]
+        results.append(stages.pop('info'), **stages)
+
+    refs = {sid: {name: df[f'input_{name}'].iat[i] for name in INPUT_NODES if isinstance(df[f'input_{name}'].iat[i], str)}
+            for i, sid in enumerate(df['股票代號'])}
+    results.payloads = ArchivedPayloads(refs, archive_dir)
+    return results
+
+
+def replay_stock(run_id, stock_id, archive_dir=ARCHIVE_DIR):
+    """
+    以封存的輸入切片重新執行策略節點，回傳 (重新計算的 StockResult, 封存的結果列)
+    輸入齊全時策略節點的結果應與封存時完全相同
+    """
+    from analysis import INPUT_NODES as NODES, STOCK_PIPELINE
+
+    df = load_run(run_id, archive_dir)
+    row = df[df['股票代號'] == str(stock_id)]
+    if row.empty:
+        raise ValueError(f"封存 {run_id} 中沒有 {stock_id}")
+    row = row.iloc[0]
+    seed = {name: load_slice(name, row[f'input_{name}'], archive_dir) for name in NODES}
+    missing = [name for name in NODES if seed[name] is None and row[f'input_{name}'] is not None]
+    if missing:
+        raise ValueError(f"封存 {run_id} 缺少輸入切片：{', '.join(missing)}")
+    run = STOCK_PIPELINE.run({}, seed=seed)
+
+    results = ResultSet(capacity=1)
+    info = {'股票代號': row['股票代號'], '股票名稱': row['股票名稱'], '產業別': row['產業別'], 'ui_key': row['ui_key']}
+    record = results.append(info, growth=run['growth'], profit=run['profit'], shareholder=run['shareholder'], valuation=run['valuation'])
+    return record, row
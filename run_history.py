@@ -0,0 +1,148 @@
+# run_history.py
+"""
+前後兩次分析的比較：綜合評分異動、總評變化、價位區間穿越
+- 每次 save_scores 都會在 score_history 留下快照 (見 warehouse.py)
+- 每檔股票的「本次」為 scores 中的最新結果，「前次」為 score_history 中早於本次的最後一份快照
+- 兩份快照以股票代號對齊成欄式陣列後逐欄比較，沒有逐檔的 Python 迴圈；全市場也只需數毫秒
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from warehouse import HISTORY_COLUMNS
+
+# 股價所在的價位區間 (依便宜價 / 合理價 / 昂貴價切分)
+ZONES = np.array(['便宜價以下', '便宜~合理', '合理~昂貴', '昂貴價以上'], dtype=object)
+TOP_MOVERS = 10
+
+_COLS = ', '.join(f'"{c}"' for c in ['股票代號'] + HISTORY_COLUMNS)
+
+
+def verdict_label(text):
+    """總評的簡短標籤：「📈【穩健成長】獲利支撐…」→ 穩健成長；「📉 動能衰退｜觀察名單…」→ 動能衰退"""
+    if not isinstance(text, str) or not text:
+        return None
+    m = re.search(r'【(.+?)】', text)
+    if m:
+        return m.group(1)
+    head = re.split(r'[｜：:]', text, maxsplit=1)[0]
+    return re.sub(r'^\W+', '', head).strip() or None
+
+
+def _labels(s):
+    """同樣的總評只解析一次"""
+    s = s.astype(object)
+    return s.map({v: verdict_label(v) for v in s.dropna().unique()})
+
+
+def band_zone(price, cheap, fair, expensive):
+    """股價所在的價位區間 (0~3，對應 ZONES)，任一值缺漏為 -1"""
+    price, cheap, fair, expensive = (np.asarray(a, dtype='float64') for a in (price, cheap, fair, expensive))
+    zone = (price >= cheap).astype('int8') + (price >= fair) + (price >= expensive)
+    valid = np.isfinite(price) & np.isfinite(cheap) & np.isfinite(fair) & np.isfinite(expensive) & (price > 0)
+    return np.where(valid, zone, -1)
+
+
+def _where_ids(stock_ids, alias):
+    if stock_ids is None:
+        return "", ()
+    ids = tuple(str(s) for s in stock_ids)
+    return f' AND {alias}."股票代號" IN ({", ".join("?" * len(ids))})', ids
+
+
+def load_latest(warehouse, stock_ids=None):
+    """每檔股票的最新結果 (scores)"""
+    where, params = _where_ids(stock_ids, 's')
+    return warehouse.query(f'SELECT updated_at AS run_at, {_COLS} FROM scores s WHERE 1 = 1{where}', params)
+
+
+def load_previous(warehouse, stock_ids=None):
+    """
+    每檔股票早於最新結果的最後一份快照
+    以 (股票代號, run_at) 主鍵逐檔定位；CROSS JOIN 固定以 scores 為外層，避免 SQLite 改為掃描整張歷史表
+    """
+    where, params = _where_ids(stock_ids, 's')
+    cols = ', '.join(f'h."{c}"' for c in ['股票代號'] + HISTORY_COLUMNS)
+    return warehouse.query(f'''
+        SELECT h.run_at, {cols} FROM (
+            SELECT s."股票代號",
+                   (SELECT MAX(x.run_at) FROM score_history x WHERE x."股票代號" = s."股票代號" AND x.run_at < s.updated_at) AS prev_at
+            FROM scores s WHERE 1 = 1{where}
+        ) p
+        CROSS JOIN score_history h ON h."股票代號" = p."股票代號" AND h.run_at = p.prev_at
+    ''', params)
+
+
+def diff_snapshots(prev, cur):
+    """
+    prev / cur：快照 (run_at、股票代號、HISTORY_COLUMNS)，以股票代號對齊 cur 後逐欄比較
+    回傳每檔股票一列：分數變化、總評改變、價位穿越等；沒有前次快照的股票「首次」為 True
+    """
+    cur = cur.drop_duplicates('股票代號', keep='last').set_index('股票代號')
+    prev = prev.drop_duplicates('股票代號', keep='last').set_index('股票代號').reindex(cur.index)
+
+    score_now = cur['MasterScore'].to_numpy(dtype='float64')
+    score_prev = prev['MasterScore'].to_numpy(dtype='float64')
+    verdict_now, verdict_prev = _labels(cur['最終總評']), _labels(prev['最終總評'])
+    zone_now = band_zone(cur['目前股價'], cur['便宜價'], cur['合理價'], cur['昂貴價'])
+    zone_prev = band_zone(prev['目前股價'], prev['便宜價'], prev['合理價'], prev['昂貴價'])
+    first = prev['run_at'].isna().to_numpy()
+
+    return pd.DataFrame({
+        '股票名稱': cur['股票名稱'],
+        '前次時間': prev['run_at'],
+        '本次時間': cur['run_at'],
+        '前次分數': score_prev,
+        '本次分數': score_now,
+        '分數變化': np.round(score_now - score_prev, 2),
+        '前次總評': verdict_prev,
+        '本次總評': verdict_now,
+        '總評改變': (verdict_now.notna() & verdict_prev.notna() & (verdict_now != verdict_prev)).to_numpy(),
+        '前次股價': prev['目前股價'].to_numpy(dtype='float64'),
+        '本次股價': cur['目前股價'].to_numpy(dtype='float64'),
+        '前次區間': np.where(zone_prev >= 0, ZONES[zone_prev], None),
+        '本次區間': np.where(zone_now >= 0, ZONES[zone_now], None),
+        '價位穿越': (zone_now >= 0) & (zone_prev >= 0) & (zone_now != zone_prev),
+        '首次': first,
+    }).reset_index()
+
+
+def diff_latest(warehouse, stock_ids=None):
+    """最新結果與前一次快照的比較 (stock_ids 為 None 時比較所有分析過的股票)"""
+    return diff_snapshots(load_previous(warehouse, stock_ids), load_latest(warehouse, stock_ids))
+
+
+def movers(diff, top=TOP_MOVERS):
+    """
+    回傳 dict：
+    上升 / 下降：綜合評分變化最大的股票；總評改變、價位穿越：所有發生變化的股票
+    """
+    changed = diff[diff['分數變化'].notna() & (diff['分數變化'] != 0)]
+    score_cols = ['股票代號', '股票名稱', '前次分數', '本次分數', '分數變化', '本次總評']
+    return {
+        '上升': changed[changed['分數變化'] > 0].nlargest(top, '分數變化')[score_cols],
+        '下降': changed[changed['分數變化'] < 0].nsmallest(top, '分數變化')[score_cols],
+        '總評改變': diff.loc[diff['總評改變'], ['股票代號', '股票名稱', '前次總評', '本次總評', '分數變化']],
+        '價位穿越': diff.loc[diff['價位穿越'], ['股票代號', '股票名稱', '前次股價', '本次股價', '前次區間', '本次區間']],
+    }
+
+
+def summary_lines(diff, top=3):
+    """日誌用的摘要"""
+    if diff.empty:
+        return []
+    compared = diff[~diff['首次']]
+    lines = [f"🔁 與前次比較：{len(compared)} 檔有前次結果，"
+             f"分數上升 {(compared['分數變化'] > 0).sum()} 檔、下降 {(compared['分數變化'] < 0).sum()} 檔，"
+             f"總評改變 {int(compared['總評改變'].sum())} 檔，價位穿越 {int(compared['價位穿越'].sum())} 檔"]
+    report = movers(compared, top)
+    for _, r in report['上升'].iterrows():
+        lines.append(f"   📈 {r['股票名稱']} ({r['股票代號']}) {r['前次分數']:.1f} → {r['本次分數']:.1f} ({r['分數變化']:+.1f})")
+    for _, r in report['下降'].iterrows():
+        lines.append(f"   📉 {r['股票名稱']} ({r['股票代號']}) {r['前次分數']:.1f} → {r['本次分數']:.1f} ({r['分數變化']:+.1f})")
+    for _, r in report['總評改變'].head(top).iterrows():
+        lines.append(f"   🔀 {r['股票名稱']} ({r['股票代號']}) {r['前次總評']} → {r['本次總評']}")
+    for _, r in report['價位穿越'].head(top).iterrows():
+        lines.append(f"   🎯 {r['股票名稱']} ({r['股票代號']}) {r['前次區間']} → {r['本次區間']}")
+    return lines
@@ -0,0 +1,182 @@
+# scenario.py
+"""
+估值情境分析 (敏感度)
+以 NumPy broadcasting 一次計算整個參數網格，不逐格呼叫策略函式
+
+模型與 strategy_shareholder / strategy_valuation 相同：
+    推估 EPS = 最新 EPS × (1 + 明年成長率) × OPM 調整係數
+    便宜/合理/昂貴價 = (平均 PE - σ / 平均 PE / 平均 PE + σ) × 推估 EPS
+    內在價值 = 淨值 × (1 + (min(ROE, ROE 上限) - 美債殖利率)) ^ 10
+
+- stock_scenarios：單一股票的兩張敏感度表 (成長率 × OPM 係數、ROE 上限 × 美債殖利率)
+- universe_scenarios：全市場在 成長率 × 美債殖利率 × ROE 上限 每一格的低估比例
+  價格區間只與成長率有關、內在價值只與 (殖利率, ROE 上限) 有關，
+  兩者的交集以矩陣乘法 (股票數為內積維度) 合併，不需要建立 股票 × 整個網格 的陣列
+"""
+import numpy as np
+import pandas as pd
+
+# 預設網格
+GROWTH_GRID = np.round(np.linspace(-0.30, 0.68, 50), 2)
+OPM_FACTOR_GRID = np.round(np.linspace(0.85, 1.15, 50), 3)
+ROE_CAP_GRID = np.round(np.linspace(0.07, 0.45, 20), 2)
+BOND_GRID = np.round(np.linspace(1.0, 5.9, 50), 2)
+
+# 模型預設的 ROE 上限 (strategy_valuation)
+DEFAULT_ROE_CAP = 0.25
+
+SCENARIO_COLS = ['股票代號', '最新EPS', '推估下一年度成長率', '推估eps', '歷史平均PE', '歷史PE標準差',
+                 '昂貴價', '股票目前淨值', '最新ROE', '目前股價', '美債殖利率']
+
+
+def scenario_inputs(df):
+    """
+    從結果表 (ResultSet.frame() 或資料倉儲 scores 表) 取出情境計算需要的欄位
+    OPM 調整係數由 推估eps 反推 (模型為 1.05 或 0.95)；缺少 PE 標準差的舊紀錄由昂貴價反推
+    """
+    df = df.reindex(columns=SCENARIO_COLS)
+    eps = df['最新EPS'].to_numpy(dtype='float64')
+    growth = df['推估下一年度成長率'].to_numpy(dtype='float64')
+    eps_next = df['推估eps'].to_numpy(dtype='float64')
+    pe_avg = df['歷史平均PE'].to_numpy(dtype='float64')
+    pe_std = df['歷史PE標準差'].to_numpy(dtype='float64')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.round(eps_next / (eps * (1 + growth)), 2)
+        pe_std = np.where(np.isnan(pe_std), df['昂貴價'].to_numpy(dtype='float64') / eps_next - pe_avg, pe_std)
+
+    return {
+        'stock_id': df['股票代號'].astype(str).to_numpy(),
+        'eps': eps,
+        'growth': growth,
+        'opm_factor': np.where(np.isfinite(factor), factor, 1.0),
+        'pe_avg': pe_avg,
+        'pe_std': pe_std,
+        'nav': df['股票目前淨值'].to_numpy(dtype='float64'),
+        'roe': df['最新ROE'].to_numpy(dtype='float64'),
+        'price': df['目前股價'].to_numpy(dtype='float64'),
+        'bond': df['美債殖利率'].to_numpy(dtype='float64') * 100,
+    }
+
+
+def band_prices(inputs, growth, opm_factor=None):
+    """
+    便宜/合理/昂貴價，shape = (股票, 成長率[, OPM 係數])
+    opm_factor 為 None 時沿用各股票的模型係數
+    """
+    eps = inputs['eps'][:, None] * (1 + np.asarray(growth))[None, :]
+    if opm_factor is None:
+        eps = eps * inputs['opm_factor'][:, None]
+        pe_avg, pe_std = inputs['pe_avg'][:, None], inputs['pe_std'][:, None]
+    else:
+        eps = eps[:, :, None] * np.asarray(opm_factor)[None, None, :]
+        pe_avg, pe_std = inputs['pe_avg'][:, None, None], inputs['pe_std'][:, None, None]
+    return {
+        'eps': eps,
+        'cheap': (pe_avg - pe_std) * eps,
+        'fair': pe_avg * eps,
+        'expensive': (pe_avg + pe_std) * eps,
+    }
+
+
+def intrinsic_values(inputs, roe_cap, bond_yield):
+    """內在價值，shape = (股票, ROE 上限, 美債殖利率 %)"""
+    roe = np.minimum(inputs['roe'][:, None, None], np.asarray(roe_cap)[None, :, None])
+    spread = roe - np.asarray(bond_yield)[None, None, :] / 100
+    return inputs['nav'][:, None, None] * (1 + spread) ** 10
+
+
+def stock_scenarios(inputs, i, growth=GROWTH_GRID, opm_factor=OPM_FACTOR_GRID,
+                    roe_cap=ROE_CAP_GRID, bond_yield=BOND_GRID):
+    """
+    單一股票 (inputs 中第 i 檔) 的敏感度表 (長表格，方便直接畫熱度圖)
+    回傳 (價格區間表, 內在價值表)，潛在空間 = 估計價 / 目前股價 - 1
+    """
+    one = {k: v[i:i + 1] for k, v in inputs.items()}
+    price = one['price'][0]
+    bands = band_prices(one, growth, opm_factor)
+    g, f = np.meshgrid(growth, opm_factor, indexing='ij')
+    df_band = pd.DataFrame({
+        '明年成長率': g.ravel(), 'OPM調整係數': f.ravel(),
+        '推估EPS': bands['eps'][0].ravel(),
+        '便宜價': bands['cheap'][0].ravel(), '合理價': bands['fair'][0].ravel(), '昂貴價': bands['expensive'][0].ravel(),
+    })
+    df_band['合理價潛在空間'] = df_band['合理價'] / price - 1 if price > 0 else np.nan
+
+    iv = intrinsic_values(one, roe_cap, bond_yield)[0]
+    r, y = np.meshgrid(roe_cap, bond_yield, indexing='ij')
+    df_iv = pd.DataFrame({'ROE上限': r.ravel(), '美債殖利率': y.ravel(), '內在價值': iv.ravel()})
+    df_iv['內在價值潛在空間'] = df_iv['內在價值'] / price - 1 if price > 0 else np.nan
+    return df_band, df_iv
+
+
+def universe_scenarios(inputs, growth=GROWTH_GRID, bond_yield=BOND_GRID, roe_cap=ROE_CAP_GRID):
+    """
+    全市場在每個情境 (成長率, 美債殖利率, ROE 上限) 下的比例，shape = (成長率, 殖利率, ROE 上限)
+    - 低於合理價：股價 <= 合理價
+    - 雙重低估：股價 <= 便宜價 且 股價 < 內在價值 (對應估值評語的「絕對低估」)
+    OPM 調整係數沿用各股票的模型係數
+    """
+    valid = np.isfinite(inputs['price']) & (inputs['price'] > 0) & np.isfinite(inputs['pe_std'])
+    inputs = {k: v[valid] for k, v in inputs.items()}
+    n = max(len(inputs['price']), 1)
+    price = inputs['price']
+
+    bands = band_prices(inputs, growth)
+    below_cheap = (price[:, None] <= bands['cheap']).astype('float64')       # (股票, 成長率)
+    below_fair = (price[:, None] <= bands['fair']).mean(axis=0)               # (成長率,)
+    below_iv = (price[:, None, None] < intrinsic_values(inputs, roe_cap, bond_yield))  # (股票, ROE, 殖利率)
+
+    # 交集比例 = Σ_股票 below_cheap[s, g] × below_iv[s, r, y] / n
+    both = below_cheap.T @ below_iv.reshape(len(price), -1).astype('float64') / n
+    both = both.reshape(len(growth), len(roe_cap), len(bond_yield)).transpose(0, 2, 1)
+    return {
+        'growth': np.asarray(growth), 'bond_yield': np.asarray(bond_yield), 'roe_cap': np.asarray(roe_cap),
+        'stocks': int(valid.sum()),
+        '低於合理價': below_fair,
+        '低於內在價值': below_iv.mean(axis=0).T,
+        '雙重低估': both,
+    }
+
+
+def universe_slice(grid, roe_cap=DEFAULT_ROE_CAP):
+    """取出最接近指定 ROE 上限的 成長率 × 美債殖利率 切面 (長表格)"""
+    k = int(np.abs(grid['roe_cap'] - roe_cap).argmin())
+    g, y = np.meshgrid(grid['growth'], grid['bond_yield'], indexing='ij')
+    return pd.DataFrame({
+        '明年成長率': g.ravel(), '美債殖利率': y.ravel(),
+        '雙重低估比例': grid['雙重低估'][:, :, k].ravel(),
+    })
+
+
+def heatmap(df, x, y, color, title=None, fmt='.1%', marker=None):
+    """
+    敏感度熱度圖 (altair)；marker = {x: 值, y: 值} 時以圓點標示目前模型假設
+    """
+    import altair as alt
+
+    scale = {'scheme': 'redyellowgreen'}
+    if df[color].min() < 0 < df[color].max():
+        scale['domainMid'] = 0
+    base = alt.Chart(df).mark_rect().encode(
+        x=alt.X(f'{x}:O', axis=alt.Axis(labelOverlap=True, format=_axis_format(df[x]))),
+        y=alt.Y(f'{y}:O', sort='descending', axis=alt.Axis(labelOverlap=True, format=_axis_format(df[y]))),
+        color=alt.Color(f'{color}:Q', scale=alt.Scale(**scale),
+                        legend=alt.Legend(format=fmt)),
+        tooltip=[alt.Tooltip(f'{x}:Q'), alt.Tooltip(f'{y}:Q'), alt.Tooltip(f'{color}:Q', format=fmt)],
+    )
+    chart = base
+    if marker:
+        point = pd.DataFrame({x: [_nearest(df[x], marker[x])], y: [_nearest(df[y], marker[y])]})
+        chart = base + alt.Chart(point).mark_point(shape='circle', size=120, color='black', filled=True).encode(
+            x=f'{x}:O', y=alt.Y(f'{y}:O', sort='descending'))
+    return chart.properties(title=title or color, height=320)
+
+
+def _nearest(values, target):
+    values = np.unique(np.asarray(values))
+    return values[np.abs(values - target).argmin()]
+
+
+def _axis_format(values):
+    return '.0%' if np.asarray(values).max() <= 1 and np.asarray(values).min() < 0 else ''
@@ -0,0 +1,194 @@
+# scheduler.py
+"""
+依發布行事曆決定資料是否需要重新抓取
+- 月營收：每月 10 日前公布，1~11 日為發布窗口
+- 季報 (損益表、資產負債表)：法定期限 Q4 3/31、Q1 5/15、Q2 8/14、Q3 11/14，期限前一個多月起為發布窗口
+- 本益比/股價：交易日收盤後更新
+- 美債殖利率：美國收盤後 (台灣早上) 更新
+- 新聞、證券主檔：沒有固定時間，依最長保存期限更新
+
+判斷規則 (以資料倉儲 fetch_log 的最後抓取時間為準)：
+1. 從未抓過、或超過最長保存期限 → 需更新
+2. 最近一次發布窗口開始後還沒抓過 → 需更新
+3. 在發布窗口內 → 依窗口內的輪詢間隔更新
+4. 窗口結束後，若最後一次抓取在窗口結束前 → 補抓一次，之後到下個窗口前都不再抓取
+"""
+from datetime import datetime, timedelta
+
+from warehouse import taipei_now
+
+
+class MonthlyWindow:
+    """每月 day_from 日 ~ day_to 日 (含) 的發布窗口"""
+
+    def __init__(self, day_from, day_to):
+        self.day_from = day_from
+        self.day_to = day_to
+
+    def latest(self, now):
+        start = now.replace(day=self.day_from, hour=0, minute=0, second=0, microsecond=0)
+        if start > now:
+            prev = (start.replace(day=1) - timedelta(days=1))
+            start = prev.replace(day=self.day_from)
+        return start, start.replace(day=self.day_to) + timedelta(days=1)
+
+
+class AnnualWindows:
+    """每年固定日期的發布窗口，例如季報法定期限：[((開始月, 日), (結束月, 日)), ...]"""
+
+    def __init__(self, windows):
+        self.windows = windows
+
+    def latest(self, now):
+        best = None
+        for year in (now.year - 1, now.year):
+            for (m1, d1), (m2, d2) in self.windows:
+                start = datetime(year, m1, d1)
+                if start <= now and (best is None or start > best[0]):
+                    best = (start, datetime(year, m2, d2) + timedelta(days=1))
+        return best
+
+
+class DailyWindow:
+    """交易日 (週一~週五) 每天 time_from ~ time_to 的更新窗口"""
+
+    def __init__(self, time_from, time_to, weekdays_only=True):
+        self.time_from = time_from
+        self.time_to = time_to
+        self.weekdays_only = weekdays_only
+
+    def latest(self, now):
+        day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for back in range(8):
+            d = day - timedelta(days=back)
+            if self.weekdays_only and d.weekday() >= 5:
+                continue
+            start = d + timedelta(hours=self.time_from[0], minutes=self.time_from[1])
+            if start <= now:
+                return start, d + timedelta(hours=self.time_to[0], minutes=self.time_to[1])
+        return None
+
+
+class ReleaseRule:
+    """
+    window：發布窗口 (可為 None)
+    poll：窗口內的輪詢間隔
+    max_age：最長保存期限，超過一律重新抓取
+    """
+
+    def __init__(self, window=None, poll=timedelta(hours=6), max_age=timedelta(days=35)):
+        self.window = window
+        self.poll = poll
+        self.max_age = max_age
+
+
+# 各資料集的發布行事曆 (台灣時間)
+RELEASE_CALENDAR = {
+    'TaiwanStockMonthRevenue': ReleaseRule(MonthlyWindow(1, 11), poll=timedelta(hours=6), max_age=timedelta(days=35)),
+    'TaiwanStockFinancialStatements': ReleaseRule(
+        AnnualWindows([((2, 15), (4, 1)), ((4, 20), (5, 16)), ((7, 20), (8, 15)), ((10, 20), (11, 15))]),
+        poll=timedelta(hours=12), max_age=timedelta(days=100)),
+    'TaiwanStockBalanceSheet': ReleaseRule(
+        AnnualWindows([((2, 15), (4, 1)), ((4, 20), (5, 16)), ((7, 20), (8, 15)), ((10, 20), (11, 15))]),
+        poll=timedelta(hours=12), max_age=timedelta(days=100)),
+    'TaiwanStockPER': ReleaseRule(DailyWindow((14, 30), (23, 59)), poll=timedelta(hours=2), max_age=timedelta(days=4)),
+    'TaiwanStockPrice': ReleaseRule(DailyWindow((13, 30), (23, 59)), poll=timedelta(hours=1), max_age=timedelta(days=4)),
+    'GovernmentBondsYield': ReleaseRule(DailyWindow((5, 0), (12, 0), weekdays_only=False), poll=timedelta(hours=2), max_age=timedelta(days=2)),
+    'TaiwanStockNews': ReleaseRule(None, max_age=timedelta(hours=1)),
+    'TaiwanStockInfo': ReleaseRule(None, max_age=timedelta(days=7)),
+}
+
+# 每檔股票分析時會用到的資料集 (美債與證券主檔不分股票，以空代號記錄)
+STOCK_DATASETS = ['TaiwanStockMonthRevenue', 'TaiwanStockFinancialStatements', 'TaiwanStockBalanceSheet',
+                  'TaiwanStockPER', 'TaiwanStockPrice']
+SHARED_DATASETS = {'GovernmentBondsYield': 'United States 10-Year', 'TaiwanStockInfo': ''}
+
+
+def check_due(rule, last, now):
+    """回傳 (是否需更新, 原因)"""
+    if last is None:
+        return True, "首次抓取"
+    if now - last >= rule.max_age:
+        return True, "超過最長保存期限"
+
+    window = rule.window.latest(now) if rule.window else None
+    if window:
+        start, end = window
+        if last < start:
+            return True, "發布窗口已開始"
+        if now < end:
+            if now - last >= rule.poll:
+                return True, f"發布窗口內 (每 {rule.poll} 輪詢)"
+            return False, "發布窗口內，未到輪詢時間"
+        if last < end:
+            return True, "發布窗口結束，補抓最終資料"
+    return False, "資料仍為最新"
+
+
+_EPOCH = datetime(2000, 1, 1)
+
+
+def data_as_of(dataset, now=None, calendar=None):
+    """
+    資料的時間版本 (記憶體快取的鍵)：同一版本內依規則不會有較新的資料
+    = (最近一次發布窗口的開始、窗口是否已結束、輪詢間隔的序號)；沒有窗口時以最長保存期限分段
+    不在行事曆中的資料集回傳 None
+    """
+    rule = (calendar or RELEASE_CALENDAR).get(dataset)
+    if rule is None:
+        return None
+    now = now or taipei_now()
+    window = rule.window.latest(now) if rule.window else None
+    if window is None:
+        return None, False, (now - _EPOCH) // rule.max_age
+    start, end = window
+    return start, now >= end, (now - _EPOCH) // rule.poll
+
+
+class RefreshScheduler:
+    def __init__(self, warehouse, calendar=None):
+        self.warehouse = warehouse
+        self.calendar = calendar or RELEASE_CALENDAR
+
+    def last_fetch(self, dataset, data_id="", start_date=None):
+        """
+        最後一次抓取時間；有指定 start_date 時只看涵蓋該起始日的抓取 (起始日更早或相同)
+        """
+        sql = "SELECT MAX(fetched_at) FROM fetch_log WHERE dataset = ? AND data_id = ?"
+        params = [dataset, data_id]
+        if start_date is not None:
+            sql += " AND start_date <= ?"
+            params.append(start_date)
+        with self.warehouse.connect(readonly=True) as con:
+            value = con.execute(sql, params).fetchone()[0]
+        return datetime.fromisoformat(value) if value else None
+
+    def is_due(self, dataset, data_id="", start_date=None, now=None):
+        rule = self.calendar.get(dataset)
+        if rule is None:
+            return True
+        now = now or taipei_now()
+        return check_due(rule, self.last_fetch(dataset, data_id, start_date), now)[0]
+
+    def plan(self, stock_ids, now=None):
+        """
+        列出需要更新的工作：[{'dataset', 'data_id', 'due', 'reason', 'last_fetched'}]
+        依 fetch_log 一次查出所有最後抓取時間，不逐筆查詢
+        """
+        import pandas as pd
+
+        now = now or taipei_now()
+        with self.warehouse.connect(readonly=True) as con:
+            rows = con.execute(
+                "SELECT dataset, data_id, MAX(fetched_at) FROM fetch_log GROUP BY dataset, data_id"
+            ).fetchall()
+        last = {(d, i): datetime.fromisoformat(t) for d, i, t in rows}
+
+        jobs = [(d, i) for d, i in SHARED_DATASETS.items()]
+        jobs += [(d, s) for s in stock_ids for d in STOCK_DATASETS]
+        out = []
+        for dataset, data_id in jobs:
+            fetched = last.get((dataset, data_id))
+            due, reason = check_due(self.calendar[dataset], fetched, now)
+            out.append({'dataset': dataset, 'data_id': data_id, 'due': due, 'reason': reason, 'last_fetched': fetched})
+        return pd.DataFrame(out, columns=['dataset', 'data_id', 'due', 'reason', 'last_fetched'])
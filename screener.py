@@ -0,0 +1,63 @@
+# screener.py
+"""
+以 SQL 條件在資料倉儲的 screen 檢視表上選股
+條件即 WHERE 子句，例如：MasterScore > 80 AND 目前股價 < 合理價 AND industry = '半導體業'
+常用條件以名稱保存於 screens.json
+"""
+import json
+import os
+
+SCREENS_PATH = os.environ.get('STOCK_SCREENS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'screens.json'))
+
+# 選股結果預設顯示的欄位
+SCREEN_COLS = ['stock_id', 'name', 'industry', 'MasterScore', '成長總分', 'total_score', '股東報酬與獲利分',
+               '目前股價', '便宜價', '合理價', '昂貴價', '目標價', '價值評估', 'updated_at']
+
+
+def load_screens(path=SCREENS_PATH):
+    """讀取已保存的選股條件 {名稱: WHERE 子句}"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def save_screen(name, where, path=SCREENS_PATH):
+    screens = load_screens(path)
+    screens[name] = where.strip()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(screens, f, ensure_ascii=False, indent=2)
+    return screens
+
+
+def delete_screen(name, path=SCREENS_PATH):
+    screens = load_screens(path)
+    screens.pop(name, None)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(screens, f, ensure_ascii=False, indent=2)
+    return screens
+
+
+def build_screen_sql(where, order_by='MasterScore DESC', limit=500):
+    """組出完整查詢；條件只能是單一 WHERE 子句 (不可含分號或註解)"""
+    where = (where or '').strip() or '1=1'
+    if ';' in where or '--' in where or '/*' in where:
+        raise ValueError("選股條件只能是單一 WHERE 子句")
+    cols = ', '.join(f'"{c}"' for c in SCREEN_COLS)
+    sql = f"SELECT {cols} FROM screen WHERE ({where})"
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
+
+def run_screen(warehouse, where, order_by='MasterScore DESC', limit=500):
+    """
+    在 scores (最新一次分析結果) 上執行選股條件，回傳 DataFrame
+    查詢走唯讀連線，條件寫錯只會拋出 SQL 錯誤，不會動到資料
+    """
+    return warehouse.query(build_screen_sql(where, order_by=order_by, limit=limit))
@@ -53,6 +53,8 @@ def analyze_profit_stage(df_profit, res_growth, logger=None):
     
     slope_gpm_8q = calculate_slope(df['GPM'])
     slope_opm_8q = calculate_slope(df['OPM'])
+    # 營業利益率 8 季標準差 (蒙地卡羅模擬的利潤率波動)
+    std_opm_8q = round(float(df['OPM'].tail(8).std()), 4)
 
     if logger: logger(f" ({row['stock_id']}) 毛利率趨勢(斜率,8季)計算完成: {slope_gpm_8q} ")
     if logger: logger(f" ({row['stock_id']}) 營業利益率趨勢(斜率,8季)計算完成: {slope_opm_8q} ")
@@ -134,6 +136,7 @@ def analyze_profit_stage(df_profit, res_growth, logger=None):
         "avg_4q_opm": round(avg_4q_opm, 3),
         "slope_gpm_8q": slope_gpm_8q,
         "slope_opm_8q": slope_opm_8q,
+        "std_opm_8q": std_opm_8q,
         "profit_improvement": round(profit_improvement, 2),
         "opm_gpm_trend": opm_gpm_trend,
         "four_q": four_q,
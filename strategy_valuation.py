@@ -1,12 +1,17 @@
 import pandas as pd
 import numpy as np
 
-def analyze_valuation_stage(df_val, current_price, us_bond,eps,df_annual, logger=None):
+from pe_sketch import band_from_frame
+
+def analyze_valuation_stage(pe_band, current_price, us_bond,eps,df_annual, logger=None):
     """
     計算估值相關指標：
     使用縮尾處理 (Winsorization) 來優化歷史本益比區間的準確性，並推算目標價位。
+    pe_band：近 5 年本益比區間 (由 pe_sketch.py 增量維護)，也可直接傳入本益比日資料 (DataFrame)
     """
-    if df_val.empty: 
+    if isinstance(pe_band, pd.DataFrame):
+        pe_band = band_from_frame(pe_band)
+    if not pe_band: 
         if logger: logger("    [Valuation] ❌ 數據不足，無法進行估價")
         return {}
     
@@ -16,27 +21,15 @@ def analyze_valuation_stage(df_val, current_price, us_bond,eps,df_annual, logger
     else:
         price_val = float(current_price or 0)
 
-    # 1. 數據初步清洗：排除虧損狀態 (PE <= 0)
-    pe_series = df_val[df_val['PER'] > 0]['PER'].copy()
-    
-    if pe_series.empty:
-        if logger: logger("    [Valuation] ⚠️ 無有效正本益比數據，無法計算區間")
-        return {}
-
-    # 2. 執行縮尾處理 (Winsorization)
-    upper_limit = pe_series.quantile(0.95)
-    valid_pe = pe_series.clip(upper=upper_limit)
-    
-    # 3. 計算統計指標
-    pe_max = round(valid_pe.max(), 2)
-    pe_min = round(valid_pe.min(), 2)
-    pe_avg = round(valid_pe.mean(), 2)
-    pe_std = valid_pe.std() 
+    # 1~3. 排除虧損 (PE <= 0)、95% 縮尾後的統計指標，已在 pe_sketch 中隨每日資料更新
+    pe_max = round(pe_band['pe_max'], 2)
+    pe_min = round(pe_band['pe_min'], 2)
+    pe_avg = round(pe_band['pe_avg'], 2)
+    pe_std = pe_band['pe_std']
 
     # 4. 取得目前數據與推算淨值
-    latest_row = df_val.iloc[-1]
-    current_pe = round(latest_row['PER'], 2)
-    current_pb = latest_row['PBR']
+    current_pe = round(pe_band['current_pe'], 2)
+    current_pb = pe_band['current_pb']
     
     # 反推淨值 (NAV = Price / PBR)
     nav = round(price_val / current_pb, 2) if current_pb > 0 else 0
@@ -90,6 +83,7 @@ def analyze_valuation_stage(df_val, current_price, us_bond,eps,df_annual, logger
         "歷史最高PE": pe_max,
         "歷史最低PE": pe_min,
         "歷史平均PE": pe_avg,
+        "歷史PE標準差": pe_std,
         "便宜價": target_cheap,
         "合理價": target_fair,
         "昂貴價": target_expensive,
@@ -0,0 +1,193 @@
+# warehouse.py
+"""
+本機 SQLite 資料倉儲
+- raw_<dataset>：FinMind 原始資料，依 (代號, 日期) 建索引
+- fetch_log：每次向 FinMind 抓取的紀錄
+- scores：每檔股票最新一次的分析結果，欄位同 result_store.RESULT_SCHEMA
+- score_history：每次寫入 scores 時同時保存的歷史快照 (評分、總評、價位區間)，供前後兩次比較 (見 run_history.py)
+- screen：選股用檢視表 (scores 加上 stock_id / name / industry 英文別名)
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from result_store import RESULT_SCHEMA
+
+DB_PATH = os.environ.get('STOCK_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stock_cache.db'))
+
+SQL_TYPES = {'float64': 'REAL', 'int16': 'INTEGER', 'cat': 'TEXT', 'str': 'TEXT'}
+
+# 各資料集代表「代號」的欄位 (預設 stock_id)
+ID_COLUMNS = {'GovernmentBondsYield': 'name'}
+
+# scores 上建立索引的欄位，常用於篩選與排序
+SCORE_INDEXES = ['MasterScore', '產業別', '目前股價', '成長總分']
+
+# score_history 保存的欄位 (除了 run_at、股票代號)
+HISTORY_COLUMNS = ['股票名稱', '產業別', 'MasterScore', '成長總分', 'total_score', '股東報酬與獲利分',
+                   '最終總評', '成長總分建議', '價值評估', '目前股價', '便宜價', '合理價', '昂貴價', '目標價']
+
+# 時間一律以台灣時間記錄 (發布行事曆以台灣時間計算，見 scheduler.py)
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+
+def taipei_now():
+    """目前的台灣時間 (不帶時區資訊，方便與 fetch_log 中的時間比較)"""
+    return datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+
+
+def _q(name):
+    """SQL 識別字加上雙引號 (欄位多為中文)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Warehouse:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self.connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS fetch_log (
+                    dataset TEXT, data_id TEXT, start_date TEXT, rows INTEGER, fetched_at TEXT
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_fetch_log ON fetch_log (dataset, data_id, fetched_at)")
+            self._ensure_scores(con)
+            self._ensure_history(con)
+
+    @contextmanager
+    def connect(self, readonly=False):
+        if readonly:
+            con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        else:
+            con = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield con
+            con.commit()
+        finally:
+            con.close()
+
+    # ---------- 原始資料 ----------
+
+    @staticmethod
+    def _columns(con, table):
+        return [r[1] for r in con.execute(f"PRAGMA table_info({_q(table)})")]
+
+    def save_dataset(self, dataset, df, data_id="", start_date=""):
+        """
+        寫入一次抓取的原始資料
+        有代號時只替換該代號 start_date 之後的資料；沒有代號 (全市場資料) 則整張表替換
+        """
+        table = f"raw_{dataset}"
+        id_col = ID_COLUMNS.get(dataset, 'stock_id')
+
+        with self._lock, self.connect() as con:
+            cols = self._columns(con, table)
+            if not cols and not df.empty:
+                df.head(0).to_sql(table, con, index=False)
+                cols = list(df.columns)
+                if id_col in cols and 'date' in cols:
+                    con.execute(f"CREATE INDEX IF NOT EXISTS {_q('idx_' + table)} ON {_q(table)} ({_q(id_col)}, date)")
+
+            if cols:
+                if not data_id:
+                    con.execute(f"DELETE FROM {_q(table)}")
+                elif 'date' in cols and start_date:
+                    con.execute(f"DELETE FROM {_q(table)} WHERE {_q(id_col)} = ? AND date >= ?", (data_id, start_date))
+                else:
+                    con.execute(f"DELETE FROM {_q(table)} WHERE {_q(id_col)} = ?", (data_id,))
+
+                for c in df.columns:
+                    if c not in cols:
+                        con.execute(f"ALTER TABLE {_q(table)} ADD COLUMN {_q(c)}")
+                if not df.empty:
+                    df.to_sql(table, con, if_exists='append', index=False)
+
+            con.execute(
+                "INSERT INTO fetch_log VALUES (?, ?, ?, ?, ?)",
+                (dataset, data_id, start_date, len(df), taipei_now().isoformat(timespec='seconds'))
+            )
+
+    def load_dataset(self, dataset, data_id="", start_date=""):
+        """讀出快取的原始資料，沒有快取時回傳空 DataFrame"""
+        table = f"raw_{dataset}"
+        id_col = ID_COLUMNS.get(dataset, 'stock_id')
+        with self.connect(readonly=True) as con:
+            cols = self._columns(con, table)
+            if not cols:
+                return pd.DataFrame()
+            sql, params = f"SELECT * FROM {_q(table)} WHERE 1=1", []
+            if data_id and id_col in cols:
+                sql += f" AND {_q(id_col)} = ?"
+                params.append(data_id)
+            if start_date and 'date' in cols:
+                sql += " AND date >= ?"
+                params.append(start_date)
+            if 'date' in cols:
+                sql += " ORDER BY date"
+            return pd.read_sql_query(sql, con, params=params)
+
+    # ---------- 分析結果 ----------
+
+    def _ensure_scores(self, con):
+        """建立 scores 表；結果欄位有新增時自動補上欄位"""
+        cols = self._columns(con, 'scores')
+        if not cols:
+            defs = [f"{_q('股票代號')} TEXT PRIMARY KEY"]
+            defs += [f"{_q(c)} {SQL_TYPES[kind]}" for c, (_, kind) in RESULT_SCHEMA.items() if c != '股票代號']
+            defs.append("updated_at TEXT")
+            con.execute(f"CREATE TABLE scores ({', '.join(defs)})")
+        else:
+            for c, (_, kind) in RESULT_SCHEMA.items():
+                if c not in cols:
+                    con.execute(f"ALTER TABLE scores ADD COLUMN {_q(c)} {SQL_TYPES[kind]}")
+
+        for c in SCORE_INDEXES:
+            con.execute(f"CREATE INDEX IF NOT EXISTS {_q('idx_scores_' + c)} ON scores ({_q(c)})")
+
+        con.execute("DROP VIEW IF EXISTS screen")
+        con.execute(f"""
+            CREATE VIEW screen AS
+            SELECT *, {_q('股票代號')} AS stock_id, {_q('股票名稱')} AS name, {_q('產業別')} AS industry
+            FROM scores
+        """)
+
+    def _ensure_history(self, con):
+        """建立 score_history 表；第一次建立時以 scores 現有的結果作為第一份快照"""
+        cols = self._columns(con, 'score_history')
+        if cols:
+            return
+        defs = ["run_at TEXT", f"{_q('股票代號')} TEXT"]
+        defs += [f"{_q(c)} {SQL_TYPES[RESULT_SCHEMA[c][1]]}" for c in HISTORY_COLUMNS]
+        con.execute(f"CREATE TABLE score_history ({', '.join(defs)}, PRIMARY KEY ({_q('股票代號')}, run_at))")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_score_history_run ON score_history (run_at)")
+        cols = ', '.join(_q(c) for c in ['股票代號'] + HISTORY_COLUMNS)
+        con.execute(f"INSERT INTO score_history (run_at, {cols}) SELECT updated_at, {cols} FROM scores WHERE updated_at IS NOT NULL")
+
+    def save_scores(self, result_set):
+        """把一次分析的結果寫入 scores (同一代號以最新結果覆蓋)，同時在 score_history 留下快照"""
+        if not len(result_set):
+            return 0
+        df = result_set.frame()
+        df['updated_at'] = taipei_now().isoformat(timespec='seconds')
+        rows = [tuple(r) for r in zip(*[df[c].to_numpy(dtype=object, na_value=None) for c in df.columns])]
+        cols = ', '.join(_q(c) for c in df.columns)
+        marks = ', '.join('?' * len(df.columns))
+
+        hist = df[['updated_at', '股票代號'] + HISTORY_COLUMNS]
+        hist_rows = [tuple(r) for r in zip(*[hist[c].to_numpy(dtype=object, na_value=None) for c in hist.columns])]
+        hist_cols = ', '.join(['run_at'] + [_q(c) for c in hist.columns[1:]])
+        with self._lock, self.connect() as con:
+            con.executemany(f"INSERT OR REPLACE INTO scores ({cols}) VALUES ({marks})", rows)
+            con.executemany(f"INSERT OR REPLACE INTO score_history ({hist_cols}) VALUES ({', '.join('?' * len(hist.columns))})", hist_rows)
+        return len(rows)
+
+    def query(self, sql, params=()):
+        """以唯讀連線執行查詢，回傳 DataFrame"""
+        with self.connect(readonly=True) as con:
+            return pd.read_sql_query(sql, con, params=params)